@@ -0,0 +1,181 @@
+"""
+Compare the default asyncio event loop with uvloop on the node hot paths:
+- job dispatch latency: from the moment the pool returns a job to the moment runner.run starts
+- disk stream throughput: writing and reading a file through Disk.openWriteStream/openReadStream
+
+The pool is replaced by an in-memory stub, so the numbers measure the overhead of
+the SDK and of the event loop, not the network.
+
+Usage:
+    python benchmarks/bench_event_loop.py [--jobs 2000] [--mb 256] [--chunk 65536]
+"""
+import sys
+import os
+import time
+import asyncio
+import argparse
+import statistics
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from openagents import OpenAgentsNode, NodeConfig, JobRunner, RunnerConfig, Disk
+from openagents_grpc_proto import Job_pb2
+from openagents_grpc_proto import rpc_pb2
+
+
+class StubResponse:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class StubPool:
+    """
+    An in-memory stand-in for the PoolConnector stub.
+    """
+    def __init__(self, jobs:int, chunk:int):
+        self.pending = [Job_pb2.Job(id="job"+str(i), kind=5003) for i in range(jobs)]
+        self.returnedAt = {}
+        self.completed = 0
+        self.chunk = chunk
+        self.files = {}
+
+    async def getPendingJobs(self, req):
+        excluded = set(req.excludeId)
+        jobs = [job for job in self.pending[:64] if job.id not in excluded]
+        self.pending = [job for job in self.pending if job.id not in excluded and job not in jobs]
+        if len(jobs) == 0:
+            await asyncio.sleep(0.01)
+        now = time.perf_counter()
+        for job in jobs:
+            self.returnedAt[job.id] = now
+        return StubResponse(jobs=jobs)
+
+    async def acceptJob(self, req):
+        return StubResponse()
+
+    async def completeJob(self, req):
+        self.completed += 1
+        return StubResponse()
+
+    async def cancelJob(self, req):
+        return StubResponse()
+
+    async def logForJob(self, req):
+        return StubResponse()
+
+    async def closeDisk(self, req):
+        return StubResponse(success=True)
+
+    def diskWriteFile(self, requests):
+        async def consume():
+            size = 0
+            path = None
+            async for req in requests:
+                size += len(req.data)
+                path = req.path
+            self.files[path] = size
+            return StubResponse(success=True)
+        return asyncio.ensure_future(consume())
+
+    async def diskReadFile(self, req):
+        size = self.files.get(req.path, 0)
+        data = b"\0"*self.chunk
+        for i in range(0, size, self.chunk):
+            yield rpc_pb2.RpcDiskReadFileResponse(data=data[:min(self.chunk, size-i)])
+
+
+class DispatchRunner(JobRunner):
+    def __init__(self, pool:StubPool):
+        super().__init__(RunnerConfig(meta={"name": "Bench"}))
+        self.pool = pool
+        self.latencies = []
+        self.setRunInParallel(True)
+
+    async def run(self, ctx):
+        self.latencies.append(time.perf_counter() - self.pool.returnedAt[ctx.getJob().id])
+        return ""
+
+
+def createNode(pool:StubPool) -> OpenAgentsNode:
+    os.environ["LOG_LEVEL"] = "error"
+    node = OpenAgentsNode(NodeConfig(meta={"name": "Bench"}, options={"eventLoop": "asyncio"}))
+    node._getClient = lambda *args, **kwargs: pool
+    node._getBulkClient = lambda *args, **kwargs: pool
+    return node
+
+
+async def benchDispatch(jobs:int) -> dict:
+    pool = StubPool(jobs, 0)
+    node = createNode(pool)
+    runner = DispatchRunner(pool)
+    node.registerRunner(runner)
+    t = time.perf_counter()
+    await node._executePendingJob()
+    while pool.completed < jobs:
+        await asyncio.sleep(0.001)
+    elapsed = time.perf_counter() - t
+    for task in node.runnerTasks.values():
+        task.cancel()
+    node.runnerTasks.clear()
+    latencies = sorted(runner.latencies)
+    return {
+        "jobs/s": jobs/elapsed,
+        "p50 ms": statistics.median(latencies)*1000,
+        "p99 ms": latencies[int(len(latencies)*0.99)-1]*1000,
+    }
+
+
+async def benchDisk(mb:int, chunk:int) -> dict:
+    pool = StubPool(0, chunk)
+    node = createNode(pool)
+    disk = Disk("bench", "bench://", node)
+    data = b"\1"*chunk
+    size = mb*1024*1024
+
+    t = time.perf_counter()
+    async with await disk.openWriteStream("/file") as writer:
+        for i in range(0, size, chunk):
+            await writer.write(data)
+    writeElapsed = time.perf_counter() - t
+
+    t = time.perf_counter()
+    read = 0
+    async with await disk.openReadStream("/file") as reader:
+        while read < size:
+            read += len(await reader.read(chunk))
+    readElapsed = time.perf_counter() - t
+    return {
+        "write MB/s": mb/writeElapsed,
+        "read MB/s": mb/readElapsed,
+    }
+
+
+def runWith(loopFactory, args) -> dict:
+    results = {}
+    with asyncio.Runner(loop_factory=loopFactory) as runner:
+        results.update(runner.run(benchDispatch(args.jobs)))
+        results.update(runner.run(benchDisk(args.mb, args.chunk)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare asyncio and uvloop on the node hot paths")
+    parser.add_argument("--jobs", type=int, default=2000, help="number of jobs to dispatch")
+    parser.add_argument("--mb", type=int, default=256, help="MB written and read through a disk stream")
+    parser.add_argument("--chunk", type=int, default=64*1024, help="size of each disk stream write in bytes")
+    args = parser.parse_args()
+
+    loops = [("asyncio", None)]
+    try:
+        import uvloop
+        loops.append(("uvloop", uvloop.new_event_loop))
+    except ImportError:
+        print("uvloop is not installed, only the default loop is measured")
+
+    rows = [(name, runWith(factory, args)) for name, factory in loops]
+    columns = list(rows[0][1].keys())
+    print("loop".ljust(10)+"".join(c.rjust(14) for c in columns))
+    for name, results in rows:
+        print(name.ljust(10)+"".join(("%.2f" % results[c]).rjust(14) for c in columns))
+
+
+if __name__ == "__main__":
+    main()
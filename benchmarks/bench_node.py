@@ -0,0 +1,194 @@
+"""
+End-to-end benchmark of a node running against the in-process mock pool (see mock_pool.py),
+over a real gRPC connection on localhost:
+- dispatch: jobs/s, and the latency from the moment the pool returns a job to the start of
+  runner.run (dispatch) and to the moment the pool receives its completion (end to end)
+- disk: throughput of Disk.openWriteStream/openReadStream
+- cache: throughput of JobContext.cacheSet/cacheGet with local=False
+
+The results can be saved and used as the baseline of the next runs, the script exits with
+status 1 when a result is worse than the baseline by more than the tolerance:
+    python benchmarks/bench_node.py --save baseline.json
+    python benchmarks/bench_node.py --baseline baseline.json --tolerance 0.2
+
+Usage:
+    python benchmarks/bench_node.py [--jobs 2000] [--mb 64] [--chunk 1048576] [--parallel]
+"""
+import sys
+import os
+import json
+import time
+import asyncio
+import argparse
+import statistics
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from openagents import OpenAgentsNode, NodeConfig, JobRunner, RunnerConfig, Disk
+from openagents.JobContext import JobContext
+from openagents_grpc_proto import Job_pb2
+from openagents_grpc_proto import rpc_pb2
+from mock_pool import MockPool
+
+
+class DispatchRunner(JobRunner):
+    def __init__(self, pool:MockPool, parallel:bool):
+        super().__init__(RunnerConfig(meta={"name": "Bench"}, filter={"filterByKind": "5003"}))
+        self.pool = pool
+        self.latencies = []
+        self.setRunInParallel(parallel)
+
+    async def run(self, ctx):
+        self.latencies.append(time.perf_counter() - self.pool.returnedAt[ctx.getJob().id])
+        return ""
+
+
+def createNode(port:int) -> OpenAgentsNode:
+    os.environ["LOG_LEVEL"] = "error"
+    node = OpenAgentsNode(NodeConfig(meta={"name": "Bench"}))
+    node.poolAddress = "127.0.0.1"
+    node.poolPort = port
+    node.poolSsl = False
+    return node
+
+
+async def stopNode(node:OpenAgentsNode):
+    for task in node.runnerTasks.values():
+        task.cancel()
+    node.runnerTasks.clear()
+    await node._shutdown()
+
+
+def percentile(values:list, p:float) -> float:
+    values = sorted(values)
+    return values[max(0, int(len(values)*p)-1)]
+
+
+async def benchDispatch(jobs:int, parallel:bool) -> dict:
+    pool = MockPool()
+    port = await pool.start()
+    node = createNode(port)
+    runner = DispatchRunner(pool, parallel)
+    node.registerRunner(runner)
+    for i in range(jobs):
+        pool.addJob(Job_pb2.Job(id="job"+str(i), kind=5003))
+    t = time.perf_counter()
+    await node._executePendingJob()
+    await pool.waitForJobs(jobs, 600)
+    elapsed = time.perf_counter() - t
+    await stopNode(node)
+    await pool.stop()
+    endToEnd = [pool.finishedAt[jobId] - pool.returnedAt[jobId] for jobId in pool.finishedAt]
+    return {
+        "jobs/s": jobs/elapsed,
+        "dispatch p50 ms": statistics.median(runner.latencies)*1000,
+        "dispatch p99 ms": percentile(runner.latencies, 0.99)*1000,
+        "e2e p50 ms": statistics.median(endToEnd)*1000,
+        "e2e p99 ms": percentile(endToEnd, 0.99)*1000,
+    }
+
+
+async def benchDisk(mb:int, chunk:int) -> dict:
+    pool = MockPool(chunkSize=chunk)
+    port = await pool.start()
+    node = createNode(port)
+    client = node._getClient()
+    url = (await client.createDisk(rpc_pb2.RpcCreateDiskRequest(name="bench"))).url
+    diskId = (await client.openDisk(rpc_pb2.RpcOpenDiskRequest(url=url))).diskId
+    disk = Disk(diskId, url, node)
+    data = b"\1"*chunk
+    size = mb*1024*1024
+
+    t = time.perf_counter()
+    async with await disk.openWriteStream("/file") as writer:
+        for i in range(0, size, chunk):
+            await writer.write(data)
+    writeElapsed = time.perf_counter() - t
+
+    t = time.perf_counter()
+    read = 0
+    async with await disk.openReadStream("/file") as reader:
+        while read < size:
+            read += len(await reader.read(chunk))
+    readElapsed = time.perf_counter() - t
+    await disk.close()
+    await stopNode(node)
+    await pool.stop()
+    return {
+        "disk write MB/s": mb/writeElapsed,
+        "disk read MB/s": mb/readElapsed,
+    }
+
+
+async def benchCache(mb:int, chunk:int) -> dict:
+    pool = MockPool(chunkSize=chunk)
+    port = await pool.start()
+    node = createNode(port)
+    runner = DispatchRunner(pool, False)
+    ctx = JobContext(node, runner, Job_pb2.Job(id="bench-cache"))
+    value = b"\1"*(mb*1024*1024)
+
+    t = time.perf_counter()
+    assert await ctx.cacheSet("bench", value, local=False)
+    setElapsed = time.perf_counter() - t
+
+    t = time.perf_counter()
+    assert len(await ctx.cacheGet("bench", local=False)) == len(value)
+    getElapsed = time.perf_counter() - t
+    await ctx.close()
+    await stopNode(node)
+    await pool.stop()
+    return {
+        "cache set MB/s": mb/setElapsed,
+        "cache get MB/s": mb/getElapsed,
+    }
+
+
+def compare(results:dict, baseline:dict, tolerance:float) -> list:
+    """
+    Compare the results with a baseline.
+    Returns:
+        list: The descriptions of the results worse than the baseline by more than the tolerance.
+    """
+    regressions = []
+    for name, value in results.items():
+        if name not in baseline:
+            continue
+        expected = baseline[name]
+        # latencies must not grow, throughputs must not shrink
+        worse = value > expected*(1+tolerance) if name.endswith(" ms") else value < expected*(1-tolerance)
+        if worse:
+            regressions.append(name+": "+("%.2f" % value)+" (baseline "+("%.2f" % expected)+")")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark a node against an in-process mock pool")
+    parser.add_argument("--jobs", type=int, default=2000, help="number of jobs to dispatch")
+    parser.add_argument("--parallel", action="store_true", help="run the dispatched jobs in parallel")
+    parser.add_argument("--mb", type=int, default=64, help="MB written and read through a disk and the cache")
+    parser.add_argument("--chunk", type=int, default=1024*1024, help="size of each disk write and read chunk in bytes")
+    parser.add_argument("--save", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression against the baseline")
+    args = parser.parse_args()
+
+    results = {}
+    results.update(asyncio.run(benchDispatch(args.jobs, args.parallel)))
+    results.update(asyncio.run(benchDisk(args.mb, args.chunk)))
+    results.update(asyncio.run(benchCache(args.mb, args.chunk)))
+    for name, value in results.items():
+        print(name.ljust(20)+("%.2f" % value).rjust(14))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            f.write(json.dumps(results, indent=2))
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare(results, json.loads(f.read()), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION "+regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+An in-process PoolConnector server with the methods used by the SDK:
+the job queue (getPendingJobs, acceptJob, cancelJob, completeJob, logForJob),
+the announcements, the disks and the cache, all kept in memory.
+
+It lets a real OpenAgentsNode run over a real gRPC connection without network access:
+    pool = MockPool()
+    port = await pool.start()
+    pool.addJob(Job_pb2.Job(id="job0", kind=5003))
+    ...
+    await pool.stop()
+"""
+import time
+import asyncio
+from collections import OrderedDict
+import grpc
+from openagents_grpc_proto import rpc_pb2_grpc
+from openagents_grpc_proto import rpc_pb2
+from openagents_grpc_proto import Job_pb2
+
+
+class MockPool(rpc_pb2_grpc.PoolConnectorServicer):
+
+    def __init__(self, maxJobsPerPoll:int=64, maxWait:float=1.0, chunkSize:int=1024*1024):
+        """
+        Create a new mock pool.
+        Args:
+            maxJobsPerPoll (int): The maximum number of jobs returned by a poll. Defaults to 64.
+            maxWait (float): The maximum time in seconds a poll without jobs is held. Defaults to 1.
+            chunkSize (int): The size of the chunks of the disk and cache reads. Defaults to 1 MB.
+        """
+        self.maxJobsPerPoll = maxJobsPerPoll
+        self.maxWait = maxWait
+        self.chunkSize = chunkSize
+        self.pending = OrderedDict()
+        self.returnedAt = {}
+        self.acceptedAt = {}
+        # the accepts of jobs that were already accepted, eg. by another worker of the node
+        self.duplicateAccepts = 0
+        self.finishedAt = {}
+        self.completed = {}
+        self.cancelled = {}
+        self.logs = {}
+        self.announcements = 0
+        self.disks = {}
+        self.cache = {}
+        self._diskUrls = {}
+        self._newJobs = None
+        self._finished = None
+        self._server = None
+
+    def addJob(self, job:Job_pb2.Job):
+        """
+        Add a pending job.
+        Args:
+            job (Job): The job.
+        """
+        self.pending[job.id] = job
+        if self._newJobs is not None:
+            self._newJobs.set()
+
+    def getFinishedJobs(self) -> int:
+        """
+        Get the number of completed and cancelled jobs.
+        Returns:
+            int: The number of jobs.
+        """
+        return len(self.completed) + len(self.cancelled)
+
+    async def waitForJobs(self, count:int, timeout:float=None):
+        """
+        Wait until count jobs are completed or cancelled.
+        Args:
+            count (int): The number of jobs.
+            timeout (float): Optional: The maximum time to wait in seconds. Defaults to None.
+        """
+        async def wait():
+            while self.getFinishedJobs() < count:
+                self._finished.clear()
+                await self._finished.wait()
+        await asyncio.wait_for(wait(), timeout)
+
+    async def start(self, host:str="127.0.0.1", port:int=0) -> int:
+        """
+        Start the gRPC server.
+        Args:
+            host (str): The address to bind. Defaults to "127.0.0.1".
+            port (int): The port, 0 = any free port. Defaults to 0.
+        Returns:
+            int: The port.
+        """
+        self._newJobs = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._server = grpc.aio.server(options=[
+            ('grpc.max_send_message_length', 1024*1024*20),
+            ('grpc.max_receive_message_length', 1024*1024*20),
+        ])
+        if not hasattr(self._server, "add_registered_method_handlers"):
+            # the generated code targets a newer grpcio, the generic handlers are enough
+            self._server.add_registered_method_handlers = lambda *args: None
+        rpc_pb2_grpc.add_PoolConnectorServicer_to_server(self, self._server)
+        port = self._server.add_insecure_port(host+":"+str(port))
+        await self._server.start()
+        return port
+
+    async def stop(self):
+        """
+        Stop the gRPC server.
+        """
+        if self._server is not None:
+            await self._server.stop(None)
+            self._server = None
+
+    def _finish(self, jobId:str):
+        self.pending.pop(jobId, None)
+        self.finishedAt[jobId] = time.perf_counter()
+        self._finished.set()
+
+    def _takeJobs(self, excluded:set) -> list:
+        jobs = []
+        for job in self.pending.values():
+            if job.id not in excluded and job.id not in self.acceptedAt:
+                jobs.append(job)
+                if len(jobs) >= self.maxJobsPerPoll:
+                    break
+        return jobs
+
+    async def getPendingJobs(self, request, context):
+        excluded = set(request.excludeId)
+        deadline = time.monotonic() + min(request.wait/1000.0, self.maxWait)
+        jobs = self._takeJobs(excluded)
+        while len(jobs) == 0 and time.monotonic() < deadline:
+            self._newJobs.clear()
+            try:
+                await asyncio.wait_for(self._newJobs.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                pass
+            jobs = self._takeJobs(excluded)
+        now = time.perf_counter()
+        for job in jobs:
+            self.returnedAt.setdefault(job.id, now)
+        return rpc_pb2.PendingJobs(jobs=jobs)
+
+    def _getJob(self, jobId:str) -> Job_pb2.Job:
+        return self.pending.get(jobId) or Job_pb2.Job(id=jobId)
+
+    async def acceptJob(self, request, context):
+        if request.jobId in self.acceptedAt:
+            self.duplicateAccepts += 1
+        self.acceptedAt.setdefault(request.jobId, time.perf_counter())
+        return self._getJob(request.jobId)
+
+    async def cancelJob(self, request, context):
+        job = self._getJob(request.jobId)
+        self.cancelled[request.jobId] = request.reason
+        self._finish(request.jobId)
+        return job
+
+    async def completeJob(self, request, context):
+        job = self._getJob(request.jobId)
+        self.completed[request.jobId] = request.output
+        self._finish(request.jobId)
+        return job
+
+    async def logForJob(self, request, context):
+        self.logs.setdefault(request.jobId, []).append(request.log)
+        return self._getJob(request.jobId)
+
+    async def announceNode(self, request, context):
+        self.announcements += 1
+        return rpc_pb2.RpcAnnounceNodeResponse(success=True, refreshInterval=60000)
+
+    async def announceEventTemplate(self, request, context):
+        self.announcements += 1
+        return rpc_pb2.RpcAnnounceTemplateResponse(success=True, refreshInterval=60000)
+
+    async def createDisk(self, request, context):
+        url = "mock://"+(request.name or "disk"+str(len(self._diskUrls)))
+        self._diskUrls.setdefault(url, {})
+        return rpc_pb2.RpcCreateDiskResponse(url=url)
+
+    async def openDisk(self, request, context):
+        files = self._diskUrls.setdefault(request.url, {})
+        diskId = "disk"+str(len(self.disks))
+        self.disks[diskId] = files
+        return rpc_pb2.RpcOpenDiskResponse(success=True, diskId=diskId, version=0)
+
+    async def closeDisk(self, request, context):
+        self.disks.pop(request.diskId, None)
+        return rpc_pb2.RpcCloseDiskResponse(success=True)
+
+    async def diskDeleteFile(self, request, context):
+        files = self.disks.get(request.diskId, {})
+        return rpc_pb2.RpcDiskDeleteFileResponse(success=files.pop(request.path, None) is not None)
+
+    async def diskListFiles(self, request, context):
+        files = self.disks.get(request.diskId, {})
+        return rpc_pb2.RpcDiskListFilesResponse(files=[path for path in files if path.startswith(request.path)])
+
+    async def diskWriteFile(self, request_iterator, context):
+        data = bytearray()
+        diskId = None
+        path = None
+        async for request in request_iterator:
+            diskId = request.diskId
+            path = request.path
+            data.extend(request.data)
+        if diskId not in self.disks:
+            return rpc_pb2.RpcDiskWriteFileResponse(success=False)
+        self.disks[diskId][path] = bytes(data)
+        return rpc_pb2.RpcDiskWriteFileResponse(success=True)
+
+    async def diskReadFile(self, request, context):
+        data = self.disks.get(request.diskId, {}).get(request.path, b"")
+        for i in range(0, len(data), self.chunkSize):
+            yield rpc_pb2.RpcDiskReadFileResponse(data=data[i:i+self.chunkSize])
+
+    async def cacheSet(self, request_iterator, context):
+        data = bytearray()
+        key = None
+        version = 0
+        expireAt = 0
+        async for request in request_iterator:
+            key = request.key
+            version = request.version
+            expireAt = request.expireAt
+            data.extend(request.data)
+        self.cache[key] = (bytes(data), version, expireAt)
+        return rpc_pb2.RpcCacheSetResponse(success=True)
+
+    async def cacheGet(self, request, context):
+        entry = self.cache.get(request.key)
+        if entry is not None and request.lastVersion > 0 and entry[1] != request.lastVersion:
+            entry = None
+        if entry is not None and entry[2] > 0 and time.time()*1000 > entry[2]:
+            entry = None
+        if entry is None:
+            yield rpc_pb2.RpcCacheGetResponse(exists=False)
+            return
+        data = entry[0]
+        for i in range(0, len(data), self.chunkSize):
+            yield rpc_pb2.RpcCacheGetResponse(exists=True, data=data[i:i+self.chunkSize])
@@ -0,0 +1,191 @@
+"""
+Replay the jobs recorded by a node (see NODE_RECORD_FILE) against a node running over
+the in-process mock pool (see mock_pool.py), and report the throughput and the latency distributions.
+
+The jobs are added to the pool at the recorded times, sped up by --speed (0 = all at once),
+their expiration is cleared since the recorded jobs expired long ago.
+By default they are run by a synthetic runner that makes the recorded remote disk and cache
+transfers of each job (with the recorded sizes) and then waits for the rest of the recorded run duration,
+so two versions of the SDK can be compared on the same traffic. Pass --runner to run them with real runners.
+
+Usage:
+    python benchmarks/replay.py jobs.jsonl.gz [--speed 1] [--runner module:Class] [--serial]
+        [--save results.json] [--baseline results.json --tolerance 0.2]
+"""
+import sys
+import os
+import time
+import json
+import pickle
+import asyncio
+import argparse
+import importlib
+import statistics
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from openagents import JobRunner, RunnerConfig, JobRecorder, Disk
+from openagents_grpc_proto import rpc_pb2
+from mock_pool import MockPool
+from bench_node import createNode, stopNode, percentile, compare
+
+
+def loadRecording(path:str) -> tuple:
+    """
+    Load a recording.
+    Returns:
+        tuple: The (time in ms, job) pairs in order, and the runs and the transfers of each job id.
+    """
+    jobs = []
+    runs = {}
+    transfers = {}
+    for record in JobRecorder.read(path):
+        if record["type"] == "job":
+            job = record["job"]
+            job.ClearField("expiration")
+            jobs.append((record["t"], job))
+        elif record["type"] == "run":
+            runs[record["id"]] = record
+        elif record["type"] != "start" and record.get("id") and record.get("location", "remote") == "remote":
+            transfers.setdefault(record["id"], []).append(record)
+    return jobs, runs, transfers
+
+
+class ReplayRunner(JobRunner):
+    """
+    Makes the recorded remote transfers of each job, then waits for the rest of its recorded run duration.
+    A job whose recorded run failed fails again.
+    """
+
+    def __init__(self, pool:MockPool, runs:dict, transfers:dict, parallel:bool):
+        super().__init__(RunnerConfig(meta={"name": "Replay"}))
+        self.pool = pool
+        self.runs = runs
+        self.transfers = transfers
+        self.disk = None
+        self.setRunInParallel(parallel)
+
+    async def init(self, node):
+        client = node._getClient()
+        url = (await client.createDisk(rpc_pb2.RpcCreateDiskRequest(name="replay"))).url
+        diskId = (await client.openDisk(rpc_pb2.RpcOpenDiskRequest(url=url))).diskId
+        self.disk = Disk(diskId, url, node)
+        # the files and the cache entries read by the jobs
+        for jobId, records in self.transfers.items():
+            for i, record in enumerate(records):
+                key = "replay/"+jobId+"/"+str(i)
+                if record["type"] == "disk.read":
+                    self.pool.disks[diskId]["/"+key] = b"\0"*record["bytes"]
+                elif record["type"] == "cache.get" and record.get("result") == "hit":
+                    self.pool.cache[key] = (pickle.dumps(b"\0"*record["bytes"]), 0, 0)
+
+    async def run(self, ctx):
+        jobId = ctx.getJob().id
+        start = time.perf_counter()
+        for i, record in enumerate(self.transfers.get(jobId, [])):
+            key = "replay/"+jobId+"/"+str(i)
+            if record["type"] == "disk.read":
+                await self.disk.readBytes("/"+key)
+            elif record["type"] == "disk.write":
+                await self.disk.writeBytes("/"+key, b"\0"*record["bytes"])
+            elif record["type"] == "cache.get":
+                await ctx.cacheGet(key, local=False)
+            elif record["type"] == "cache.set":
+                await ctx.cacheSet(key, b"\0"*record["bytes"], local=False)
+        run = self.runs.get(jobId)
+        if run is not None:
+            remaining = run["duration"]/1000.0 - (time.perf_counter() - start)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+            if run["status"] == "error":
+                raise Exception("Recorded run failed")
+        return ""
+
+
+def loadRunner(spec:str) -> JobRunner:
+    moduleName, className = spec.split(":")
+    return getattr(importlib.import_module(moduleName), className)()
+
+
+async def feed(pool:MockPool, jobs:list, speed:float, addedAt:dict):
+    start = time.perf_counter()
+    for t, job in jobs:
+        if speed > 0:
+            delay = start + t/1000.0/speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        addedAt[job.id] = time.perf_counter()
+        pool.addJob(job)
+
+
+async def replay(args) -> dict:
+    jobs, runs, transfers = loadRecording(args.recording)
+    if len(jobs) == 0:
+        raise Exception("No jobs in "+args.recording)
+    if args.speed > 0:
+        # start with the first job
+        jobs = [(t - jobs[0][0], job) for t, job in jobs]
+    pool = MockPool()
+    port = await pool.start()
+    node = createNode(port)
+    runners = [loadRunner(spec) for spec in args.runner] or [ReplayRunner(pool, runs, transfers, not args.serial)]
+    for runner in runners:
+        node.registerRunner(runner)
+        await node._initRunner(runner)
+
+    addedAt = {}
+    t = time.perf_counter()
+    feeder = asyncio.create_task(feed(pool, jobs, args.speed, addedAt))
+    await node._executePendingJob()
+    await pool.waitForJobs(len(jobs), args.timeout)
+    elapsed = time.perf_counter() - t
+    await feeder
+    await stopNode(node)
+    await pool.stop()
+
+    accept = [pool.acceptedAt[jobId] - addedAt[jobId] for jobId in pool.acceptedAt if jobId in addedAt]
+    endToEnd = [pool.finishedAt[jobId] - addedAt[jobId] for jobId in pool.finishedAt if jobId in addedAt]
+    results = {
+        "jobs": len(jobs),
+        "completed": len(pool.completed),
+        "cancelled": len(pool.cancelled),
+        "duplicate accepts": pool.duplicateAccepts,
+        "jobs/s": len(jobs)/elapsed,
+    }
+    for name, values in (("accept", accept), ("e2e", endToEnd)):
+        results[name+" p50 ms"] = statistics.median(values)*1000
+        results[name+" p90 ms"] = percentile(values, 0.90)*1000
+        results[name+" p99 ms"] = percentile(values, 0.99)*1000
+        results[name+" max ms"] = max(values)*1000
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a job recording against a node and the in-process mock pool")
+    parser.add_argument("recording", help="the file recorded with NODE_RECORD_FILE")
+    parser.add_argument("--speed", type=float, default=1, help="speed of the replay, 1 = recorded times, 0 = as fast as possible")
+    parser.add_argument("--runner", action="append", default=[], help="module:Class of a runner to run the jobs, can be repeated")
+    parser.add_argument("--serial", action="store_true", help="run the jobs of the synthetic runner one at a time")
+    parser.add_argument("--timeout", type=float, default=3600, help="maximum duration of the replay in seconds")
+    parser.add_argument("--save", help="save the results to this JSON file")
+    parser.add_argument("--baseline", help="compare the results with this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression against the baseline")
+    args = parser.parse_args()
+
+    results = asyncio.run(replay(args))
+    for name, value in results.items():
+        print(name.ljust(20)+("%.2f" % value).rjust(14))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            f.write(json.dumps(results, indent=2))
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.loads(f.read())
+        regressions = compare({name: value for name, value in results.items() if name.endswith(" ms") or name.endswith("/s")}, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION "+regression)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import asyncio
+import random
+import time
+
+class Backoff:
+    """
+    Exponential backoff with full jitter: the n-th consecutive failure waits
+    a random time between 0 and min(cap, base * factor^(n-1)) milliseconds.
+    The delay goes back to the base after a success.
+    """
+
+    def __init__(self, name:str, base:float=1000, cap:float=60000, factor:float=2.0):
+        """
+        Create a new backoff policy.
+        Args:
+            name (str): The name of the backoff, used in its state.
+            base (float): The maximum delay of the first retry in milliseconds. Defaults to 1000.
+            cap (float): The maximum delay in milliseconds. Defaults to 60000.
+            factor (float): The growth factor of the delay. Defaults to 2.
+        """
+        self.name = name
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.attempts = 0
+        self.failures = 0
+        self.lastDelay = 0.0
+        self.lastFailureAt = 0
+        self.lastSuccessAt = 0
+
+    def next(self) -> float:
+        """
+        Register a failure and get the delay before the next attempt.
+        Returns:
+            float: The delay in milliseconds.
+        """
+        self.attempts += 1
+        self.failures += 1
+        self.lastFailureAt = int(time.time()*1000)
+        # cap the exponent too, to avoid overflows after many failures
+        maxDelay = min(self.cap, self.base * (self.factor ** min(self.attempts-1, 64)))
+        self.lastDelay = random.uniform(0, maxDelay)
+        return self.lastDelay
+
+    async def wait(self):
+        """
+        Register a failure and wait before the next attempt.
+        """
+        await asyncio.sleep(self.next()/1000.0)
+
+    def reset(self):
+        """
+        Register a success.
+        """
+        self.attempts = 0
+        self.lastSuccessAt = int(time.time()*1000)
+
+    def getState(self) -> dict:
+        """
+        Get the state of the backoff.
+        Returns:
+            dict: The consecutive failed attempts, the total failures, the last delay in milliseconds
+                and the timestamps of the last failure and success.
+        """
+        return {
+            "attempts": self.attempts,
+            "failures": self.failures,
+            "lastDelay": self.lastDelay,
+            "lastFailureAt": self.lastFailureAt,
+            "lastSuccessAt": self.lastSuccessAt,
+        }
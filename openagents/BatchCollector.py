@@ -0,0 +1,58 @@
+import asyncio
+
+class BatchCollector:
+    """
+    Collects items and hands them out in batches, when the batch is full
+    or when the oldest item has waited for maxWait milliseconds.
+    """
+
+    def __init__(self, maxSize:int, maxWait:int, onBatch, serial:bool=False):
+        """
+        Create a new batch collector.
+        Args:
+            maxSize (int): The maximum number of items in a batch.
+            maxWait (int): The maximum time in milliseconds an item waits for the batch to fill.
+            onBatch (coroutine function): Called with the list of items of each batch.
+            serial (bool): Optional: If True, a batch is processed only after the previous one completed. Defaults to False.
+        """
+        self.maxSize = max(1, maxSize)
+        self.maxWait = maxWait
+        self.onBatch = onBatch
+        self.items = []
+        self._timer = None
+        self._lock = asyncio.Lock() if serial else None
+
+    def add(self, item):
+        """
+        Add an item to the current batch.
+        Args:
+            item: The item to add.
+        """
+        self.items.append(item)
+        if len(self.items) >= self.maxSize:
+            self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.maxWait/1000.0, self.flush)
+
+    def flush(self):
+        """
+        Hand out the current batch immediately.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if len(self.items) == 0:
+            return
+        batch = self.items
+        self.items = []
+        asyncio.create_task(self._process(batch))
+
+    async def _process(self, batch:list):
+        if self._lock is None:
+            await self.onBatch(batch)
+            return
+        async with self._lock:
+            await self.onBatch(batch)
+
+    def __len__(self):
+        return len(self.items)
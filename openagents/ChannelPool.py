@@ -0,0 +1,332 @@
+import asyncio
+import time
+import grpc
+from openagents_grpc_proto import rpc_pb2_grpc
+
+class ChannelStats:
+    """
+    Traffic counters of a GRPC channel.
+    """
+
+    def __init__(self, name:str):
+        self.name = name
+        self.calls = 0
+        self.active = 0
+        self.errors = 0
+        self.bytesSent = 0
+        self.bytesReceived = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.failovers = 0
+        self.state = None
+        self.stateChanges = 0
+        self.lastStateChangeAt = 0
+
+    def _start(self):
+        self.calls += 1
+        self.active += 1
+
+    def _end(self, error:bool):
+        self.active -= 1
+        if error:
+            self.errors += 1
+
+    def getStats(self) -> dict:
+        """
+        Get the counters of the channel.
+        Returns:
+            dict: The number of calls, active calls, failed calls, bytes sent and received, connections,
+                reconnections and failovers, and the connectivity state with the number and time of its changes.
+        """
+        return {
+            "calls": self.calls,
+            "active": self.active,
+            "errors": self.errors,
+            "bytesSent": self.bytesSent,
+            "bytesReceived": self.bytesReceived,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "failovers": self.failovers,
+            "state": self.state,
+            "stateChanges": self.stateChanges,
+            "lastStateChangeAt": self.lastStateChangeAt,
+        }
+
+class StatsInterceptor:
+    """
+    An interceptor for GRPC that updates the stats of the channel.
+    """
+    def __init__(self, stats:ChannelStats, rpcDuration=None):
+        self._stats = stats
+        self._rpcDuration = rpcDuration
+        # the running _watch tasks, the event loop only keeps weak references to them
+        self._tasks = set()
+
+    def _startWatch(self, call, client_call_details, start:float, unaryResponse:bool=False):
+        task = asyncio.ensure_future(self._watch(call, client_call_details, start, unaryResponse))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _observe(self, client_call_details, start:float, error:bool):
+        if self._rpcDuration is not None:
+            method = client_call_details.method
+            if isinstance(method, bytes):
+                method = method.decode()
+            self._rpcDuration.labels(method=method.rsplit("/", 1)[-1], channel=self._stats.name, status="error" if error else "ok").observe(time.monotonic()-start)
+
+    async def _countRequests(self, request_iterator):
+        if hasattr(request_iterator, "__aiter__"):
+            async for request in request_iterator:
+                self._stats.bytesSent += request.ByteSize()
+                yield request
+        else:
+            for request in request_iterator:
+                self._stats.bytesSent += request.ByteSize()
+                yield request
+
+    async def _watch(self, call, client_call_details, start:float, unaryResponse:bool=False):
+        error = True
+        try:
+            if unaryResponse:
+                self._stats.bytesReceived += (await call).ByteSize()
+            code = await call.code()
+            error = code != grpc.StatusCode.OK
+        except Exception:
+            pass
+        self._stats._end(error)
+        self._observe(client_call_details, start, error)
+
+class StatsInterceptor0(grpc.aio.UnaryStreamClientInterceptor,StatsInterceptor):
+    async def intercept_unary_stream(self, continuation, client_call_details, request):
+        self._stats._start()
+        self._stats.bytesSent += request.ByteSize()
+        start = time.monotonic()
+        try:
+            call = await continuation(client_call_details, request)
+        except Exception:
+            self._stats._end(True)
+            self._observe(client_call_details, start, True)
+            raise
+        async def countResponses():
+            error = True
+            try:
+                async for response in call:
+                    self._stats.bytesReceived += response.ByteSize()
+                    yield response
+                error = False
+            finally:
+                self._stats._end(error)
+                self._observe(client_call_details, start, error)
+        return countResponses()
+
+class StatsInterceptor1(grpc.aio.StreamUnaryClientInterceptor,StatsInterceptor):
+    async def intercept_stream_unary(self, continuation, client_call_details, request_iterator):
+        self._stats._start()
+        start = time.monotonic()
+        call = await continuation(client_call_details, self._countRequests(request_iterator))
+        self._startWatch(call, client_call_details, start, True)
+        return call
+
+class StatsInterceptor2(grpc.aio.StreamStreamClientInterceptor,StatsInterceptor):
+    async def intercept_stream_stream(self, continuation, client_call_details, request_iterator):
+        self._stats._start()
+        start = time.monotonic()
+        call = await continuation(client_call_details, self._countRequests(request_iterator))
+        self._startWatch(call, client_call_details, start)
+        return call
+
+class StatsInterceptor3(grpc.aio.UnaryUnaryClientInterceptor,StatsInterceptor):
+    async def intercept_unary_unary(self, continuation, client_call_details, request):
+        self._stats._start()
+        self._stats.bytesSent += request.ByteSize()
+        start = time.monotonic()
+        error = True
+        try:
+            response = await (await continuation(client_call_details, request))
+            self._stats.bytesReceived += response.ByteSize()
+            error = False
+            return response
+        finally:
+            self._stats._end(error)
+            self._observe(client_call_details, start, error)
+
+
+class ChannelPool:
+    """
+    The GRPC channels of a node: a control channel for the latency sensitive RPCs
+    (polling, accepting and completing jobs, logs, announcements) and a set of bulk
+    channels for the streaming transfers (disk and cache), so big uploads
+    don't share the HTTP/2 flow control window with the control traffic.
+    Every channel uses its own connection, kept alive with keepalive pings and
+    watched in background: the stubs are cached, a channel that stays in
+    TRANSIENT_FAILURE is rebuilt and the traffic fails over to the healthy channels.
+    """
+
+    def __init__(self, node, bulkChannels:int=1, reconnectTimeout:float=20000):
+        """
+        Create a new channel pool.
+        Args:
+            node (OpenAgentsNode): The node, used to create the channels.
+            bulkChannels (int): The number of bulk channels, 0 = bulk transfers use the control channel. Defaults to 1.
+            reconnectTimeout (float): How long in milliseconds a channel can stay in TRANSIENT_FAILURE before it is rebuilt. Defaults to 20000.
+        """
+        self.node = node
+        self.bulkChannels = max(0, bulkChannels)
+        self.reconnectTimeout = reconnectTimeout
+        self._stats = [ChannelStats("control")] + [ChannelStats("bulk"+str(i)) for i in range(self.bulkChannels)]
+        self._channels = [None]*len(self._stats)
+        self._stubs = [None]*len(self._stats)
+        self._watchers = [None]*len(self._stats)
+        self._states = [None]*len(self._stats)
+        self._listeners = []
+        self._nextBulk = 0
+        # set while the control traffic is failed over, so each failure counts as one failover
+        self._failedOver = False
+
+    def addStateListener(self, listener):
+        """
+        Add a listener of the connectivity state changes.
+        Args:
+            listener (callable): A function called with the channel name, the previous state and
+                the new state (grpc.ChannelConnectivity). The previous state is None for a new channel.
+        """
+        self._listeners.append(listener)
+
+    def removeStateListener(self, listener):
+        """
+        Remove a listener of the connectivity state changes.
+        Args:
+            listener (callable): The listener.
+        """
+        self._listeners.remove(listener)
+
+    def _setState(self, i:int, state):
+        previous = self._states[i]
+        if previous == state:
+            return
+        self._states[i] = state
+        if i == 0 and self._isHealthy(0):
+            self._failedOver = False
+        stats = self._stats[i]
+        stats.state = state.name if state is not None else None
+        stats.stateChanges += 1
+        stats.lastStateChangeAt = int(time.time()*1000)
+        self.node.getLogger().finer("Channel "+stats.name+" is "+str(stats.state))
+        for listener in self._listeners:
+            try:
+                listener(stats.name, previous, state)
+            except Exception as e:
+                self.node.getLogger().error("Error in connectivity listener "+str(e))
+
+    def _open(self, i:int):
+        stats = self._stats[i]
+        options = [
+            # a local subchannel pool, so channels to the same pool don't share the connection
+            ('grpc.use_local_subchannel_pool', 1),
+            ('grpc.primary_user_agent', "openagents-"+stats.name),
+        ]
+        rpcDuration = self.node.metrics.histogram("rpc_duration_seconds", "Duration of the calls to the pool", ("method", "channel", "status"))
+        interceptors = [StatsInterceptor0(stats, rpcDuration), StatsInterceptor1(stats, rpcDuration), StatsInterceptor2(stats, rpcDuration), StatsInterceptor3(stats, rpcDuration)]
+        channel = self.node._connect(options, interceptors)
+        stats.connects += 1
+        self._channels[i] = channel
+        self._stubs[i] = rpc_pb2_grpc.PoolConnectorStub(channel)
+        self._watchers[i] = asyncio.create_task(self._watch(i, channel))
+
+    async def _watch(self, i:int, channel):
+        name = self._stats[i].name
+        backoff = self.node._getBackoff("reconnect."+name)
+        failingSince = None
+        try:
+            while True:
+                # connect eagerly, so the connection is ready before the first call
+                state = channel.get_state(try_to_connect=True)
+                self._setState(i, state)
+                if state == grpc.ChannelConnectivity.READY:
+                    failingSince = None
+                    backoff.reset()
+                elif state == grpc.ChannelConnectivity.TRANSIENT_FAILURE:
+                    failingSince = failingSince or time.monotonic()
+                elif state == grpc.ChannelConnectivity.SHUTDOWN:
+                    break
+                timeout = None
+                if failingSince is not None:
+                    timeout = max(0, self.reconnectTimeout/1000.0 - (time.monotonic()-failingSince))
+                try:
+                    await asyncio.wait_for(channel.wait_for_state_change(state), timeout)
+                except asyncio.TimeoutError:
+                    break
+            # the channel is down: wait a bit and rebuild it
+            self.node.getLogger().warn("Reconnecting channel "+name)
+            await backoff.wait()
+            self._stats[i].reconnects += 1
+            self._watchers[i] = None
+            self._channels[i] = None
+            self._stubs[i] = None
+            asyncio.ensure_future(channel.close())
+            self._open(i)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.node.getLogger().error("Error watching channel "+name+" "+str(e))
+
+    def _isHealthy(self, i:int) -> bool:
+        return self._states[i] not in (grpc.ChannelConnectivity.TRANSIENT_FAILURE, grpc.ChannelConnectivity.SHUTDOWN)
+
+    def _getStub(self, i:int):
+        if self._stubs[i] is None:
+            self._open(i)
+        return self._stubs[i]
+
+    def getControlClient(self):
+        """
+        Get the client of the control channel, or of a healthy bulk channel while the control channel is failing.
+        Returns:
+            PoolConnectorStub: The client.
+        """
+        if self._stubs[0] is not None and not self._isHealthy(0):
+            for i in range(1, len(self._stubs)):
+                if self._stubs[i] is not None and self._states[i] == grpc.ChannelConnectivity.READY:
+                    if not self._failedOver:
+                        self._failedOver = True
+                        self._stats[0].failovers += 1
+                    return self._stubs[i]
+        return self._getStub(0)
+
+    def getBulkClient(self):
+        """
+        Get the client of the least busy healthy bulk channel.
+        Returns:
+            PoolConnectorStub: The client.
+        """
+        if self.bulkChannels == 0:
+            return self._getStub(0)
+        best = None
+        for j in range(self.bulkChannels):
+            i = 1 + (self._nextBulk + j) % self.bulkChannels
+            if best is None or (self._isHealthy(i), -self._stats[i].active) > (self._isHealthy(best), -self._stats[best].active):
+                best = i
+        self._nextBulk = best % self.bulkChannels
+        return self._getStub(best)
+
+    def getStats(self) -> dict:
+        """
+        Get the stats of every channel.
+        Returns:
+            dict: The stats of each channel by name (see ChannelStats.getStats).
+        """
+        return {stats.name: stats.getStats() for stats in self._stats}
+
+    async def close(self):
+        """
+        Close all the channels.
+        """
+        for i, channel in enumerate(self._channels):
+            if self._watchers[i] is not None:
+                self._watchers[i].cancel()
+            if channel is not None:
+                await channel.close()
+            self._watchers[i] = None
+            self._channels[i] = None
+            self._stubs[i] = None
+            self._setState(i, None)
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import json
+import time
+import traceback
+from collections import deque
+from openagents_grpc_proto import rpc_pb2
+from .Backoff import Backoff
+
+class CompletionOutbox:
+    """
+    Delivers the completions and cancellations of the jobs to the pool in background,
+    so the runner slots don't wait for the pool.
+    Failed deliveries are retried with backoff, a job is completed or cancelled at most once.
+    When a delivery keeps failing, the result is dropped or, if a spill path is set,
+    saved on disk and sent again when the pool is reachable.
+    """
+
+    def __init__(self, node, maxRetries:int=8, spillPath:str=None, maxDelivered:int=1000):
+        """
+        Create a new outbox.
+        Args:
+            node (OpenAgentsNode): The node.
+            maxRetries (int): The maximum number of retries of a delivery. Defaults to 8.
+            spillPath (str): Optional: The directory where undelivered results are saved. Defaults to None (disabled).
+            maxDelivered (int): How many delivered job ids are remembered to ignore duplicates. Defaults to 1000.
+        """
+        self.node = node
+        self.maxRetries = maxRetries
+        self.spillPath = spillPath
+        self.pending = {}
+        self._entries = {}
+        self.delivered = deque(maxlen=maxDelivered)
+        self._deliveredIds = set()
+        self._spilledIds = set()
+        self._resending = False
+        self._spans = {}
+        self.stats = {
+            "delivered": 0,
+            "retries": 0,
+            "failed": 0,
+            "spilled": 0,
+            "resent": 0,
+        }
+
+    def complete(self, jobId:str, output:str, span=None):
+        """
+        Queue the completion of a job.
+        Args:
+            jobId (str): The ID of the job.
+            output (str): The output of the job.
+            span (Span): Optional: The span ended when the completion is delivered.
+        """
+        self._submit({"jobId": jobId, "type": "complete", "value": output}, span)
+
+    def cancel(self, jobId:str, reason:str, span=None):
+        """
+        Queue the cancellation of a job.
+        Args:
+            jobId (str): The ID of the job.
+            reason (str): The reason of the cancellation.
+            span (Span): Optional: The span ended when the cancellation is delivered.
+        """
+        self._submit({"jobId": jobId, "type": "cancel", "value": reason}, span)
+
+    def _submit(self, entry:dict, span=None):
+        jobId = entry["jobId"]
+        if jobId in self.pending or jobId in self._deliveredIds or jobId in self._spilledIds:
+            self.node.getLogger().warn("Job "+jobId+" was already "+entry["type"]+"d, ignoring")
+            if span is not None:
+                span.end("already "+entry["type"]+"d")
+            return
+        if span is not None:
+            self._spans[jobId] = span
+        self._entries[jobId] = entry
+        self.pending[jobId] = asyncio.create_task(self._deliver(entry))
+
+    def _endSpan(self, jobId:str, attempts:int, error=None):
+        span = self._spans.pop(jobId, None)
+        if span is not None:
+            span.setAttribute("attempts", attempts)
+            span.end(error)
+
+    async def _send(self, entry:dict):
+        client = self.node._getClient()
+        if entry["type"] == "complete":
+            await client.completeJob(rpc_pb2.RpcJobOutput(jobId=entry["jobId"], output=entry["value"]))
+        else:
+            await client.cancelJob(rpc_pb2.RpcCancelJob(jobId=entry["jobId"], reason=entry["value"]))
+
+    def _markDelivered(self, jobId:str):
+        if len(self.delivered) == self.delivered.maxlen:
+            self._deliveredIds.discard(self.delivered[0])
+        self.delivered.append(jobId)
+        self._deliveredIds.add(jobId)
+        self.stats["delivered"] += 1
+
+    async def _deliver(self, entry:dict):
+        jobId = entry["jobId"]
+        backoff = Backoff(entry["type"]+"."+jobId, self.node.backoffBase, self.node.backoffMax)
+        try:
+            while True:
+                try:
+                    await self._send(entry)
+                    self._markDelivered(jobId)
+                    self._endSpan(jobId, backoff.attempts+1)
+                    if not self._resending and self.spillPath and self.stats["spilled"] > 0:
+                        asyncio.create_task(self.resendSpilled())
+                    return
+                except Exception as e:
+                    if backoff.attempts >= self.maxRetries:
+                        self._endSpan(jobId, backoff.attempts+1, e)
+                        self._fail(entry, e)
+                        return
+                    self.stats["retries"] += 1
+                    self.node.getLogger().warn("Error delivering "+entry["type"]+" of job "+jobId+", retrying: "+str(e))
+                    await backoff.wait()
+        finally:
+            self.pending.pop(jobId, None)
+            self._entries.pop(jobId, None)
+            self._endSpan(jobId, backoff.attempts+1, "delivery interrupted")
+
+    def _getSpillFile(self, jobId:str) -> str:
+        return os.path.join(self.spillPath, "".join(c if c.isalnum() or c in "-_" else "_" for c in jobId)+".json")
+
+    def _fail(self, entry:dict, e:Exception):
+        self.stats["failed"] += 1
+        if not self.spillPath:
+            self.node.getLogger().error("Couldn't deliver "+entry["type"]+" of job "+entry["jobId"]+", dropping it: "+str(e))
+            return
+        try:
+            os.makedirs(self.spillPath, exist_ok=True)
+            path = self._getSpillFile(entry["jobId"])
+            with open(path+".tmp", "w") as f:
+                f.write(json.dumps(dict(entry, spilledAt=int(time.time()*1000))))
+            os.replace(path+".tmp", path)
+            self._spilledIds.add(entry["jobId"])
+            self.stats["spilled"] += 1
+            self.node.getLogger().error("Couldn't deliver "+entry["type"]+" of job "+entry["jobId"]+", saved to "+path+": "+str(e))
+        except Exception as e2:
+            traceback.print_exc()
+            self.node.getLogger().error("Error saving "+entry["type"]+" of job "+entry["jobId"]+" "+str(e2))
+
+    async def resendSpilled(self):
+        """
+        Send again the results saved on disk, and remove the delivered ones.
+        """
+        if not self.spillPath or self._resending or not os.path.isdir(self.spillPath):
+            return
+        self._resending = True
+        try:
+            for name in sorted(os.listdir(self.spillPath)):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(self.spillPath, name)
+                try:
+                    with open(path, "r") as f:
+                        entry = json.loads(f.read())
+                    if entry["jobId"] not in self._deliveredIds:
+                        await self._send(entry)
+                        self._markDelivered(entry["jobId"])
+                        self.stats["resent"] += 1
+                    os.remove(path)
+                    self._spilledIds.discard(entry["jobId"])
+                    self.stats["spilled"] = max(0, self.stats["spilled"] - 1)
+                except Exception as e:
+                    self.node.getLogger().warn("Error resending "+name+", will retry later: "+str(e))
+                    break
+        finally:
+            self._resending = False
+
+    async def flush(self, timeout:float=None):
+        """
+        Wait for the pending deliveries.
+        Args:
+            timeout (float): Optional: The maximum time to wait in seconds. Defaults to None.
+        """
+        tasks = list(self.pending.values())
+        if len(tasks) > 0:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    async def close(self, timeout:float=None):
+        """
+        Wait for the pending deliveries, then stop the ones still retrying and spill their results
+        (or drop them if there is no spill path), eg. when the node shuts down.
+        Args:
+            timeout (float): Optional: The maximum time to wait in seconds. Defaults to None.
+        """
+        await self.flush(timeout)
+        tasks = []
+        for jobId, task in list(self.pending.items()):
+            entry = self._entries.get(jobId)
+            if entry is not None:
+                self._fail(entry, Exception("the node is shutting down"))
+            task.cancel()
+            tasks.append(task)
+        if len(tasks) > 0:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def getStats(self) -> dict:
+        """
+        Get the stats of the outbox.
+        Returns:
+            dict: The pending deliveries, and the delivered, retried, failed, spilled and resent results.
+        """
+        return dict(self.stats, pending=len(self.pending))
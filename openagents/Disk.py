@@ -1,6 +1,7 @@
 
 
 import asyncio
+import time
 import grpc
 import struct
 
@@ -20,6 +21,14 @@ class Disk:
         self.url = url
         self.node = node
         self.closed = False
+        self._bytes = node.metrics.counter("disk_bytes_total", "Bytes written to and read from the disks", ("direction",))
+        self._duration = node.metrics.histogram("disk_transfer_seconds", "Duration of the disk transfers", ("direction",))
+
+    def _recordTransfer(self, direction:str, size:int, start:float):
+        self._bytes.labels(direction=direction).inc(size)
+        self._duration.labels(direction=direction).observe(time.time()-start)
+        self.node.tracer.recordSpan("disk."+direction, start, attributes={"disk": self.id, "bytes": size})
+        self.node.recorder.recordTransfer("disk."+direction, size, start)
     
     async def list(self, prefix:str="/") -> list[str]:
         """
@@ -66,13 +75,15 @@ class Disk:
         Returns:
             bool: True if the bytes were written successfully, False otherwise.
         """
-        client = self.node._getClient()
+        client = self.node._getBulkClient()
+        start = time.time()
         def write_data():
             for j in range(0, len(dataBytes), CHUNK_SIZE):
                 chunk = bytes(dataBytes[j:min(j+CHUNK_SIZE, len(dataBytes))])                   
                 request = rpc_pb2.RpcDiskWriteFileRequest(diskId=str(self.id), path=path, data=chunk)
                 yield request                              
         res=await client.diskWriteFile(write_data())
+        self._recordTransfer("write", len(dataBytes), start)
         return res.success
 
 
@@ -87,9 +98,11 @@ class Disk:
         Returns:
             DiskWriter: A writer for writing data to the stream.
         """
-        client = self.node._getClient()
+        client = self.node._getBulkClient()
         writeQueue = asyncio.Queue()             
         async def write_data():
+            start = time.time()
+            size = 0
             while True:
                 dataBytes = await writeQueue.get()
                 if dataBytes is None:  # End of stream
@@ -98,7 +111,9 @@ class Disk:
                     chunk = bytes(dataBytes[j:min(j+CHUNK_SIZE, len(dataBytes))])                   
                     request = rpc_pb2.RpcDiskWriteFileRequest(diskId=str(self.id), path=path, data=chunk)
                     yield request
+                size += len(dataBytes)
                 writeQueue.task_done()
+            self._recordTransfer("write", size, start)
         res=client.diskWriteFile(write_data())
         return DiskWriter(writeQueue, res)
 
@@ -114,11 +129,15 @@ class Disk:
             DiskReader: A reader for reading data from the stream.
         """
 
-        client = self.node._getClient()
+        client = self.node._getBulkClient()
         readQueue = asyncio.Queue()
         async def read_data():
+            start = time.time()
+            size = 0
             async for chunk in client.diskReadFile(rpc_pb2.RpcDiskReadFileRequest(diskId=self.id, path=path)):
                 readQueue.put_nowait(chunk.data)
+                size += len(chunk.data)
+            self._recordTransfer("read", size, start)
         r = asyncio.create_task(read_data())
         return DiskReader(readQueue, r)
 
@@ -136,10 +155,12 @@ class Disk:
         Returns:
             bytes: The bytes read from the file.
         """
-        client = self.node._getClient()
+        client = self.node._getBulkClient()
+        start = time.time()
         bytesOut = bytearray()
         async for chunk in client.diskReadFile(rpc_pb2.RpcDiskReadFileRequest(diskId=self.id, path=path)):
             bytesOut.extend(chunk.data)
+        self._recordTransfer("read", len(bytesOut), start)
         return bytesOut
 
     async def writeUTF8(self, path:str, data:str) -> bool:
@@ -4,10 +4,10 @@ from openagents_grpc_proto import rpc_pb2
 from .Logger import Logger
 from .Disk import Disk
 from .RunnerConfig import RunnerConfig
+from .Tracer import NOOP_SPAN
 import time
-import os
-import json
 import pickle
+import asyncio
 from typing import Union
 
 class JobContext:
@@ -18,10 +18,10 @@ class JobContext:
         self.job=job
         self._node=node
         self.runner=runner
-        
-        self._cachePath = os.getenv('CACHE_PATH',  "cache")
-        if not os.path.exists(self._cachePath):
-            os.makedirs(self._cachePath)
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loop = None
 
         self.logger=Logger(
             self._node.getMeta()["name"]+"."+self.runner.getMeta()["name"],
@@ -33,6 +33,15 @@ class JobContext:
         self._disksByUrl = {}
         self._disksById = {}
         self._diskByName = {}
+        self.acceptedAt = None
+        # the root span of the trace of the job
+        self.span = NOOP_SPAN
+        # set when the job is profiled (see JobRunner.setProfileRate)
+        self.profiler = None
+        # built on first use by _getJobIndex and getInputs
+        self._jobIndex = None
+        self._inputs = None
+        self._node._openLogBuffer(self.job.id)
 
     def getLogger(self):
         """
@@ -53,6 +62,32 @@ class JobContext:
         """
         return self.job
 
+    def runSync(self, coro, timeout:float=None):
+        """
+        Run a coroutine on the node event loop and wait for its result.
+        To be used by synchronous runner hooks, that run on the node thread pool, 
+        to access the asynchronous methods of the context, eg.
+            value = ctx.runSync(ctx.cacheGet("key"))
+        Args:
+            coro (coroutine): The coroutine to run.
+            timeout (float): Optional: The maximum time to wait in seconds. Defaults to None.
+        Returns:
+            any: The result of the coroutine.
+        Raises:
+            RuntimeError: If called from the event loop, or if the context was created outside of an event loop.
+        """
+        if self._loop is None:
+            coro.close()
+            raise RuntimeError("runSync needs a context created on the node event loop")
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            coro.close()
+            raise RuntimeError("runSync can't be called from the event loop, use await instead")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
     
     async def cacheSet(self, key:str, value, version:int=0, expireAt:int=0, local=True, CHUNK_SIZE=1024*1024*15):
         """
@@ -65,16 +100,15 @@ class JobContext:
             local (bool): Whether to store the value locally or remotely. Defaults to True.
             CHUNK_SIZE (int): The size of each chunk to write in bytes, if needed. Defaults to 1024*1024*15.
         """
+        start = time.time()
         try:
             dataBytes = pickle.dumps(value)
             if local:
-                fullPath = os.path.join(self._cachePath, key)
-                with open(fullPath, "wb") as f:
-                    f.write(dataBytes)
-                with open(fullPath+".meta.json", "w") as f:
-                    f.write(json.dumps({"version":version, "expireAt":expireAt}))
+                stored = self._node._getLocalCache().set(key, dataBytes, version, expireAt)
+                self._recordCache("set", local, start, len(dataBytes), "ok" if stored else "error")
+                return stored
             else:
-                client = self._node._getClient()
+                client = self._node._getBulkClient()
                 def write_data():
                     for j in range(0, len(dataBytes), CHUNK_SIZE):
                         chunk = bytes(dataBytes[j:min(j+CHUNK_SIZE, len(dataBytes))])                   
@@ -86,8 +120,10 @@ class JobContext:
                         )
                         yield request                              
                 res=await client.cacheSet(write_data())
+                self._recordCache("set", local, start, len(dataBytes), "ok" if res.success else "error")
                 return res.success
         except Exception as e:
+            self._recordCache("set", local, start, 0, "error")
             self._node.getLogger().error("Error setting cache "+str(e))
             return False
         
@@ -102,32 +138,42 @@ class JobContext:
         Returns:
             any: The value of the cache.
         """
+        start = time.time()
         try:
             if local:
-                fullPath = os.path.join(self._cachePath, key)
-                if not os.path.exists(fullPath) or not os.path.exists(fullPath+".meta.json"):
-                    return None
-                with open(fullPath+".meta.json", "r") as f:
-                    meta = json.loads(f.read())
-                if lastVersion > 0 and meta["version"] != lastVersion:
-                    return None
-                if meta["expireAt"] > 0 and time.time()*1000 > meta["expireAt"]:
+                dataBytes = self._node._getLocalCache().get(key, lastVersion)
+                if dataBytes is None:
+                    self._recordCache("get", local, start, 0, "miss")
                     return None
-                with open(fullPath, "rb") as f:
-                    return pickle.load(f)
+                self._recordCache("get", local, start, len(dataBytes), "hit")
+                return pickle.loads(dataBytes)
             else:
-                client = self._node._getClient()
+                client = self._node._getBulkClient()
                 bytesOut = bytearray()
                 stream = client.cacheGet(rpc_pb2.RpcCacheGetRequest(key=key, lastVersion = lastVersion))
                 async for chunk in stream:
                     if not chunk.exists:
+                        self._recordCache("get", local, start, 0, "miss")
                         return None
                     bytesOut.extend(chunk.data)
+                self._recordCache("get", local, start, len(bytesOut), "hit")
                 return pickle.loads(bytesOut)
         except Exception as e:
+            self._recordCache("get", local, start, 0, "error")
             self._node.getLogger().error("Error getting cache "+str(e))
             return None
 
+    def _recordCache(self, op:str, local:bool, start:float, size:int, result:str):
+        metrics = self._node.metrics
+        location = "local" if local else "remote"
+        metrics.counter("cache_requests_total", "Cache requests", ("op", "location", "result")).labels(op=op, location=location, result=result).inc()
+        metrics.histogram("cache_duration_seconds", "Duration of the cache requests", ("op", "location")).labels(op=op, location=location).observe(time.time()-start)
+        if size > 0:
+            metrics.counter("cache_bytes_total", "Bytes written to and read from the cache", ("op", "location")).labels(op=op, location=location).inc(size)
+        self._node.tracer.recordSpan("cache."+op, start, attributes={"location": location, "result": result, "bytes": size},
+            error="cache "+op+" failed" if result == "error" else None)
+        self._node.recorder.recordTransfer("cache."+op, size, start, self.job.id, location=location, result=result)
+
 
     
     async def openStorage(self, url:str)->Disk:
@@ -188,38 +234,63 @@ class JobContext:
         self._disksById = {}
         self._disksByUrl = {}
         self._diskByName = {}
+        await self._node._closeLogBuffer(self.job.id)
         self.logger.close()
+        if self.profiler is not None:
+            self.profiler.release()
+
 
+    def _getJobIndex(self) -> tuple:
+        # the params by key and the inputs by marker, built once per job
+        index = self._jobIndex
+        if index is None:
+            job=self.getJob()
+            params={}
+            for p in job.param:
+                params.setdefault(p.key, p.value)
+            inputs={}
+            for i in job.input:
+                inputs.setdefault(i.marker, []).append(i)
+            index = (params, inputs, list(job.input))
+            self._jobIndex = index
+        return index
 
     def getJobParamValues(self,key,default:list[str]=None)->list[str]:
-        job=self.getJob()
-        for p in job.param:
-            if p.key == key:
-                return p.value or default
-        return default
+        values=self._getJobIndex()[0].get(key)
+        return values or default
 
     
     def getJobParamValue(self,key,default:str=None)->str:
-        job=self.getJob()
-        for p in job.param:
-            if p.key == key:
-                return p.value[0] or default
-        return default 
+        values=self._getJobIndex()[0].get(key)
+        if not values:
+            return default
+        return values[0] or default
 
     def getJobInputs(self,marker:str|None=None)->list[rpc_pb2.JobInput__pb2]:
-        job=self.getJob()
-        out=[]
-        for i in job.input:
-            if marker is None or i.marker == marker:
-                out.append(i)
-        return out
+        params, inputs, allInputs = self._getJobIndex()
+        if marker is None:
+            return list(allInputs)
+        return list(inputs.get(marker, []))
 
     def getJobInput(self,marker:str|None=None)->rpc_pb2.JobInput__pb2:
-        job=self.getJob()
-        for i in job.input:
-            if marker is None or i.marker == marker:
-                return i
-        return None
+        params, inputs, allInputs = self._getJobIndex()
+        found = allInputs if marker is None else inputs.get(marker)
+        return found[0] if found else None
+
+    def getInputs(self)->dict:
+        """
+        Get the inputs of the job, decoded and validated with the "in" sockets of the runner
+        (see SocketSchema).
+        Returns:
+            dict: The typed value of each socket.
+        Raises:
+            ValueError: If the inputs don't match the sockets.
+        """
+        inputs = self._inputs
+        if inputs is None:
+            inputs = self.runner.getInputSchema().decode(self)
+            self._inputs = inputs
+        return inputs
 
     def getOutputFormat(self):
         job=self.getJob()
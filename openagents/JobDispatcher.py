@@ -0,0 +1,179 @@
+import re
+import asyncio
+import json
+
+# Filter keys of RunnerConfig and the job fields they are matched against
+FILTER_FIELDS = {
+    "filterByRunOn": "runOn",
+    "filterByCustomer": "customerPublicKey",
+    "filterByDescription": "description",
+    "filterById": "id",
+    "filterByKind": "kind",
+}
+
+class JobDispatcher:
+    """
+    Routes the jobs fetched by a single shared long-poll to the registered runners.
+    The filters of the runners are compiled once in an index, that is rebuilt
+    only when the registered runners change.
+    """
+
+    def __init__(self, node):
+        """
+        Create a new dispatcher.
+        Args:
+            node (OpenAgentsNode): The node.
+        """
+        self.node = node
+        # How long in milliseconds a job whose runners were all busy is excluded from the next polls
+        self.busySkipTtl = 5000
+        self._skippedBusy = set()
+        self._pollTask = None
+        self._index = None
+        self._filter = None
+        self._prices = None
+
+    def invalidate(self):
+        """
+        Rebuild the index on the next use, to be called when the runners change.
+        """
+        self._index = None
+
+    def _build(self):
+        index = []
+        patterns = {key: [] for key in FILTER_FIELDS}
+        prices = []
+        for reg in self.node.registeredRunners:
+            runner = reg["runner"]
+            filter = runner.getFilter()
+            compiled = []
+            for key, field in FILTER_FIELDS.items():
+                if key in filter and filter[key] is not None:
+                    pattern = str(filter[key])
+                    compiled.append((field, re.compile(pattern)))
+                    if patterns[key] is not None and pattern not in patterns[key]:
+                        patterns[key].append(pattern)
+                else:
+                    # a runner accepts any value for this field, so the shared poll can't filter it
+                    patterns[key] = None
+            meta = runner.getMeta()
+            runnerPrices = "prices" in meta and meta["prices"] or None
+            index.append((runner, compiled, runnerPrices))
+            prices.append(runnerPrices)
+
+        self._filter = {}
+        for key, values in patterns.items():
+            if values:
+                self._filter[key] = values[0] if len(values) == 1 else "|".join(["(?:"+v+")" for v in values])
+        # bids can be filtered by the pool only if all the runners ask for the same prices
+        self._prices = prices[0] if len(prices) > 0 and all(json.dumps(p, sort_keys=True) == json.dumps(prices[0], sort_keys=True) for p in prices) else None
+        if self._prices is None:
+            # the bids are checked locally against the prices of each runner
+            self._index = index
+        else:
+            self._index = [(runner, compiled, None) for runner, compiled, runnerPrices in index]
+
+    def getFilter(self) -> dict:
+        """
+        Get the filter of the shared poll, that matches the jobs of every runner.
+        Returns:
+            dict: The filter, in the same format of RunnerConfig.getFilter.
+        """
+        if self._index is None:
+            self._build()
+        return self._filter
+
+    def getPrices(self) -> list:
+        """
+        Get the prices to filter the bids of the shared poll by.
+        Returns:
+            list: The prices, or None.
+        """
+        if self._index is None:
+            self._build()
+        return self._prices
+
+    def match(self, job) -> list:
+        """
+        Find the runners whose filter matches a job.
+        Args:
+            job (Job): The job.
+        Returns:
+            list[JobRunner]: The matching runners, in registration order.
+        """
+        if self._index is None:
+            self._build()
+        out = []
+        for runner, compiled, prices in self._index:
+            if all(pattern.search(str(getattr(job, field))) for field, pattern in compiled) and self._acceptsBid(job, prices):
+                out.append(runner)
+        return out
+
+    def _acceptsBid(self, job, prices:list) -> bool:
+        # the bid must be at least one of the prices, in the same currency and protocol
+        if not prices:
+            return True
+        bid = job.bid
+        for price in prices:
+            if price.get("currency") == bid.currency and price.get("protocol") == bid.protocol and bid.amount >= int(price.get("amount", 0)):
+                return True
+        return False
+
+    async def poll(self) -> list:
+        """
+        Long-poll the pool for the jobs of all the runners.
+        The poll is interrupted when a runner frees a slot for a job that was skipped because it was busy.
+        Returns:
+            list: The pending jobs, empty if the poll was interrupted.
+        """
+        self._pollTask = asyncio.create_task(self.node._pollJobs(self.getFilter(), self.getPrices(), "dispatcher"))
+        try:
+            return await self._pollTask
+        except asyncio.CancelledError:
+            # re-raise if the dispatcher itself is being cancelled
+            if asyncio.current_task().cancelling() or not self._pollTask.cancelled():
+                raise
+            return []
+        finally:
+            self._pollTask = None
+
+    def skip(self, job, busy:bool):
+        """
+        Exclude a job that no runner took from the next polls, so it stays available to other nodes.
+        Args:
+            job (Job): The job.
+            busy (bool): True if the job matched some runners that were all busy.
+        """
+        if busy:
+            self.node.lockedJobs.add(job.id, self.busySkipTtl)
+            self._skippedBusy.add(job.id)
+        else:
+            self.node.lockedJobs.add(job.id)
+
+    def onSlotReleased(self):
+        """
+        Called when a job slot is freed: make the jobs skipped because their runners
+        were busy available again and restart the poll.
+        """
+        if len(self._skippedBusy) == 0:
+            return
+        for jobId in self._skippedBusy:
+            self.node.lockedJobs.remove(jobId)
+        self._skippedBusy.clear()
+        if self._pollTask is not None:
+            self._pollTask.cancel()
+
+    async def waitForFreeSlot(self) -> bool:
+        """
+        Wait until at least one runner has room for another in-flight job.
+        Returns:
+            bool: False if there are no registered runners.
+        """
+        if len(self.node.registeredRunners) == 0:
+            await asyncio.sleep(1)
+            return False
+        hasFreeSlot = lambda: any(self.node._hasFreeSlot(reg["runner"]) for reg in self.node.registeredRunners)
+        if not hasFreeSlot():
+            async with self.node._slotsCondition:
+                await self.node._slotsCondition.wait_for(hasFreeSlot)
+        return True
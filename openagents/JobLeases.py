@@ -0,0 +1,76 @@
+import time
+import heapq
+from itertools import islice
+
+class JobLeases:
+    """
+    An expiring set of job ids, used to remember the jobs the node has already
+    picked up so they are excluded from the next polls.
+    Membership checks are O(1), expired leases are removed from a heap ordered by expiration.
+    """
+
+    def __init__(self, ttl:int=60000, maxExcluded:int=1000):
+        """
+        Create a new lease table.
+        Args:
+            ttl (int): The default duration of a lease in milliseconds. Defaults to 60000.
+            maxExcluded (int): The maximum number of ids returned by getExcludeIds. Defaults to 1000.
+        """
+        self.ttl = ttl
+        self.maxExcluded = maxExcluded
+        self._leases = {}
+        self._expirations = []
+
+    def add(self, jobId:str, ttl:int=None):
+        """
+        Lease a job, or renew its lease.
+        Args:
+            jobId (str): The ID of the job.
+            ttl (int): Optional: The duration of the lease in milliseconds. Defaults to the table ttl.
+        """
+        expireAt = time.monotonic() + (ttl if ttl is not None else self.ttl)/1000.0
+        # re-insert to keep the most recent leases at the end
+        self._leases.pop(jobId, None)
+        self._leases[jobId] = expireAt
+        heapq.heappush(self._expirations, (expireAt, jobId))
+        if len(self._expirations) > 2*len(self._leases) + 64:
+            self._compact()
+
+    def remove(self, jobId:str):
+        """
+        Release the lease of a job.
+        Args:
+            jobId (str): The ID of the job.
+        """
+        self._leases.pop(jobId, None)
+
+    def prune(self):
+        """
+        Remove the expired leases.
+        """
+        now = time.monotonic()
+        while self._expirations and self._expirations[0][0] <= now:
+            expireAt, jobId = heapq.heappop(self._expirations)
+            # skip stale heap entries of renewed or removed leases
+            if self._leases.get(jobId) == expireAt:
+                del self._leases[jobId]
+
+    def _compact(self):
+        self._expirations = [(expireAt, jobId) for jobId, expireAt in self._leases.items()]
+        heapq.heapify(self._expirations)
+
+    def getExcludeIds(self) -> list[str]:
+        """
+        Get the ids to exclude from the next poll, the most recent leases first.
+        Returns:
+            list[str]: Up to maxExcluded job ids.
+        """
+        self.prune()
+        return list(islice(reversed(self._leases), self.maxExcluded))
+
+    def __contains__(self, jobId:str) -> bool:
+        expireAt = self._leases.get(jobId)
+        return expireAt is not None and expireAt > time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self._leases)
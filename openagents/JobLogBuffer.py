@@ -0,0 +1,134 @@
+import asyncio
+import traceback
+from collections import deque
+from openagents_grpc_proto import rpc_pb2
+
+class JobLogBuffer:
+    """
+    Buffers the log lines of a job and ships them to the pool in order,
+    coalescing the lines logged within a short time window, or up to a byte limit,
+    in a single logForJob call.
+    The buffered bytes are bounded: the lines that don't fit are dropped and counted.
+    """
+
+    def __init__(self, node, jobId:str, maxWait:float=200, maxBytes:int=64*1024, maxBuffered:int=1024*1024):
+        """
+        Create a new log buffer.
+        Args:
+            node (OpenAgentsNode): The node.
+            jobId (str): The ID of the job.
+            maxWait (float): The maximum time in milliseconds a line waits before being sent. Defaults to 200.
+            maxBytes (int): The maximum size in bytes of the lines sent in a single call. Defaults to 64 KB.
+            maxBuffered (int): The maximum size in bytes of the buffered lines. Defaults to 1 MB.
+        """
+        self.node = node
+        self.jobId = jobId
+        self.maxWait = maxWait
+        self.maxBytes = maxBytes
+        self.maxBuffered = maxBuffered
+        self.lines = deque()
+        self.bufferedBytes = 0
+        self.dropped = 0
+        self.sentLines = 0
+        self.calls = 0
+        self.closed = False
+        self._timer = None
+        self._sender = None
+        self._droppedLines = node.metrics.counter("job_logs_dropped_total", "Job log lines dropped because the buffer was full or the pool unreachable")
+
+    def add(self, message:str):
+        """
+        Buffer a line.
+        Args:
+            message (str): The line.
+        """
+        # the pool limits are in bytes, not characters
+        size = len(message.encode("utf-8"))
+        if self.closed or self.bufferedBytes + size > self.maxBuffered:
+            self.dropped += 1
+            self.node.droppedJobLogs += 1
+            self._droppedLines.inc()
+            return
+        self.lines.append((message, size))
+        self.bufferedBytes += size
+        if self._sender is not None:
+            # the sender picks up the new lines when the current call is done
+            return
+        if self.bufferedBytes >= self.maxBytes:
+            self._send()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.maxWait/1000.0, self._send)
+
+    def _send(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._sender is None and len(self.lines) > 0:
+            self._sender = asyncio.create_task(self._run())
+
+    def _takeBatch(self) -> list:
+        batch = []
+        size = 0
+        while len(self.lines) > 0 and (len(batch) == 0 or size + self.lines[0][1] + 1 <= self.maxBytes):
+            line, lineSize = self.lines.popleft()
+            batch.append(line)
+            size += lineSize + 1
+        self.bufferedBytes -= size - len(batch)
+        return batch
+
+    async def _run(self):
+        try:
+            while len(self.lines) > 0:
+                batch = self._takeBatch()
+                try:
+                    await self.node._getClient().logForJob(rpc_pb2.RpcJobLog(jobId=self.jobId, log="\n".join(batch)))
+                    self.calls += 1
+                    self.sentLines += len(batch)
+                except Exception as e:
+                    self.dropped += len(batch)
+                    self.node.droppedJobLogs += len(batch)
+                    self._droppedLines.inc(len(batch))
+                    print("Error logging to job "+str(e))
+        finally:
+            self._sender = None
+
+    async def flush(self):
+        """
+        Send all the buffered lines and wait for them to be delivered.
+        """
+        self._send()
+        while self._sender is not None:
+            await asyncio.shield(self._sender)
+            self._send()
+
+    async def close(self):
+        """
+        Flush the buffer and stop accepting new lines.
+        The number of dropped lines, if any, is reported as the last line.
+        """
+        if self.closed:
+            return
+        if self.dropped > 0:
+            message = str(self.dropped)+" log lines dropped"
+            self.lines.append((message, len(message)))
+            self.bufferedBytes += len(message)
+        self.closed = True
+        try:
+            await self.flush()
+        except Exception as e:
+            traceback.print_exc()
+            self.node.getLogger().error("Error flushing logs of job "+self.jobId+" "+str(e))
+
+    def getStats(self) -> dict:
+        """
+        Get the stats of the buffer.
+        Returns:
+            dict: The buffered lines and bytes, the sent lines, the calls and the dropped lines.
+        """
+        return {
+            "buffered": len(self.lines),
+            "bufferedBytes": self.bufferedBytes,
+            "sent": self.sentLines,
+            "calls": self.calls,
+            "dropped": self.dropped,
+        }
@@ -0,0 +1,98 @@
+import asyncio
+import time
+import traceback
+from collections import deque
+
+class JobPrefetcher:
+    """
+    Keeps a small local queue of fetched, but not yet accepted, jobs for a serial runner,
+    so the next job can start as soon as the current one is finished.
+    Queued jobs are excluded from the next polls until they are taken or released,
+    they are not accepted so they stay available to other nodes.
+    """
+
+    def __init__(self, node, runner, size:int):
+        """
+        Create a new prefetcher.
+        Args:
+            node (OpenAgentsNode): The node.
+            runner (JobRunner): The runner.
+            size (int): The maximum number of queued jobs.
+        """
+        self.node = node
+        self.runner = runner
+        self.size = max(1, size)
+        self.queue = deque()
+        self._task = None
+
+    def _isExpired(self, job) -> bool:
+        if not job.expiration:
+            return False
+        expiration = job.expiration
+        # accept both seconds and milliseconds timestamps
+        if expiration < 10**12:
+            expiration = expiration*1000
+        return expiration <= time.time()*1000
+
+    def start(self):
+        """
+        Start fetching jobs in background, if the queue has room and no fetch is in progress.
+        """
+        if self._task is None and len(self.queue) < self.size:
+            self._task = asyncio.create_task(self._fetch())
+
+    async def _fetch(self):
+        try:
+            meta = self.runner.getMeta()
+            prices = "prices" in meta and meta["prices"] or None
+            jobs = await self.node._pollJobs(self.runner.getFilter(), prices, self.runner.__class__.__name__)
+            queued = set(job.id for job in self.queue)
+            for job in jobs:
+                if len(self.queue) >= self.size:
+                    break
+                if job.id in queued or self._isExpired(job):
+                    continue
+                self.queue.append(job)
+                self.node.lockedJobs.add(job.id)
+        except Exception as e:
+            traceback.print_exc()
+            self.node.getLogger().error("Error prefetching jobs for "+self.runner.__class__.__name__+" "+str(e))
+            await self.node._getBackoff("runner."+self.runner.__class__.__name__).wait()
+        finally:
+            self._task = None
+
+    def _pop(self):
+        while len(self.queue) > 0:
+            job = self.queue.popleft()
+            if not self._isExpired(job):
+                return job
+            self.node.lockedJobs.remove(job.id)
+        return None
+
+    async def take(self):
+        """
+        Take the next job, fetching it if the queue is empty.
+        Returns:
+            Job: The next job, or None if no job is pending.
+        """
+        job = self._pop()
+        if job is not None:
+            return job
+        self.start()
+        task = self._task
+        if task is not None:
+            await asyncio.shield(task)
+        return self._pop()
+
+    def release(self):
+        """
+        Drop the queued jobs and make them available to the next polls.
+        """
+        while len(self.queue) > 0:
+            self.node.lockedJobs.remove(self.queue.popleft().id)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def __len__(self):
+        return len(self.queue)
@@ -0,0 +1,178 @@
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+
+class _ProfiledCoroutine:
+    """
+    Drives a coroutine step by step, profiling and timing only the steps of the job,
+    not the other tasks that run on the event loop while the job is waiting.
+    """
+
+    def __init__(self, profiler:'JobProfiler', timing:dict, coro):
+        self.profiler = profiler
+        self.timing = timing
+        self.coro = coro
+
+    def __await__(self):
+        it = self.coro.__await__()
+        value = None
+        error = None
+        while True:
+            t = time.perf_counter()
+            profiling = self.profiler._enable()
+            try:
+                if error is not None:
+                    yielded = it.throw(error)
+                else:
+                    yielded = it.send(value)
+            except StopIteration as e:
+                return e.value
+            finally:
+                if profiling:
+                    self.profiler.profile.disable()
+                self.timing["busy"] += time.perf_counter() - t
+                self.timing["steps"] += 1
+            try:
+                value = yield yielded
+                error = None
+            except BaseException as e:
+                value = None
+                error = e
+
+
+class JobProfiler:
+    """
+    Profiles the preRun, run and postRun hooks of a job with cProfile and times them:
+    the wall time of each hook, the time spent running it (on the event loop for async hooks,
+    on the thread for synchronous hooks), and for async hooks the number of event loop steps.
+    Only one profiler can be active at a time in a process (Python 3.12+ refuses a second one),
+    so a single job is profiled at a time, see JobProfiler.acquire.
+    """
+
+    # the profiler of the job being profiled in the process
+    _active = None
+    _activeLock = threading.Lock()
+
+    @staticmethod
+    def acquire(jobId:str) -> 'JobProfiler':
+        """
+        Get a profiler for a job, unless another job is being profiled.
+        Args:
+            jobId (str): The ID of the job.
+        Returns:
+            JobProfiler: The profiler, to be released with release(), or None if another job is being profiled.
+        """
+        with JobProfiler._activeLock:
+            if JobProfiler._active is not None:
+                return None
+            profiler = JobProfiler(jobId)
+            JobProfiler._active = profiler
+            return profiler
+
+    def release(self):
+        """
+        Let another job be profiled.
+        """
+        with JobProfiler._activeLock:
+            if JobProfiler._active is self:
+                JobProfiler._active = None
+
+    def __init__(self, jobId:str):
+        """
+        Create a new profiler.
+        Args:
+            jobId (str): The ID of the job.
+        """
+        self.jobId = jobId
+        self.profile = cProfile.Profile()
+        self.timings = {}
+
+    def _getTiming(self, name:str) -> dict:
+        timing = self.timings.get(name)
+        if timing is None:
+            timing = {"wall": 0.0, "busy": 0.0, "steps": 0, "calls": 0}
+            self.timings[name] = timing
+        return timing
+
+    def _enable(self) -> bool:
+        try:
+            self.profile.enable()
+            return True
+        except ValueError:
+            # another profiling tool is active (Python 3.12+), the step runs without profiling
+            return False
+
+    def _callSync(self, timing:dict, hook, *args):
+        cpu = time.thread_time()
+        profiling = self._enable()
+        try:
+            return hook(*args)
+        finally:
+            if profiling:
+                self.profile.disable()
+            timing["busy"] += time.thread_time() - cpu
+            timing["steps"] += 1
+
+    async def call(self, hook, executor, *args):
+        """
+        Call and profile a runner hook, on the executor if it is a synchronous method.
+        Args:
+            hook: The bound hook (eg. runner.preRun).
+            executor (Executor): The executor of the synchronous hooks.
+            *args: The arguments of the hook.
+        Returns:
+            The value returned by the hook.
+        """
+        timing = self._getTiming(getattr(hook, "__name__", str(hook)))
+        timing["calls"] += 1
+        t = time.perf_counter()
+        try:
+            if asyncio.iscoroutinefunction(hook):
+                return await _ProfiledCoroutine(self, timing, hook(*args))
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(contextvars.copy_context().run, self._callSync, timing, hook, *args))
+        finally:
+            timing["wall"] += time.perf_counter() - t
+
+    def getSummary(self, top:int=30) -> dict:
+        """
+        Get the timings of the hooks and the functions with the highest cumulative time.
+        Args:
+            top (int): The number of functions. Defaults to 30.
+        Returns:
+            dict: The summary.
+        """
+        stats = pstats.Stats(self.profile, stream=io.StringIO())
+        functions = []
+        for (file, line, name), (cc, nc, tt, ct, callers) in stats.stats.items():
+            functions.append({"function": name, "file": file, "line": line, "calls": nc, "tottime": tt, "cumtime": ct})
+        functions.sort(key=lambda x: x["cumtime"], reverse=True)
+        return {
+            "jobId": self.jobId,
+            "hooks": self.timings,
+            "functions": functions[:top],
+        }
+
+    def save(self, path:str) -> list[str]:
+        """
+        Save the profile to path/<job id>.prof and its summary to path/<job id>.json.
+        Args:
+            path (str): The directory.
+        Returns:
+            list[str]: The paths of the saved files.
+        """
+        os.makedirs(path, exist_ok=True)
+        name = "".join(c if c.isalnum() or c in "-_" else "_" for c in self.jobId)
+        profPath = os.path.join(path, name+".prof")
+        jsonPath = os.path.join(path, name+".json")
+        self.profile.dump_stats(profPath)
+        with open(jsonPath, "w") as f:
+            f.write(json.dumps(self.getSummary(), indent=2))
+        return [profPath, jsonPath]
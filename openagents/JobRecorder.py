@@ -0,0 +1,193 @@
+import atexit
+import base64
+import contextvars
+import gzip
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from openagents_grpc_proto import Job_pb2
+
+# the job whose hooks are running, the disk and cache transfers are recorded under its id
+_currentJobId = contextvars.ContextVar("openagents_recorded_job", default=None)
+
+class _ActiveJob:
+    def __init__(self, jobId:str):
+        self.jobId = jobId
+        self.token = None
+
+    def __enter__(self):
+        self.token = _currentJobId.set(self.jobId)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        _currentJobId.reset(self.token)
+        return False
+
+
+class _NoopJob:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NOOP_JOB = _NoopJob()
+
+
+class JobRecorder:
+    """
+    Records the jobs received from the pool, the duration of their runs and the disk and cache transfers
+    they make, to a JSON lines file (gzip compressed if the path ends with .gz) that can be replayed
+    against a node with benchmarks/replay.py.
+    Each line has the time in milliseconds since the start of the recording ("t") and a "type":
+    - "start": the header, with the wall clock time of the start of the recording ("startedAt")
+    - "job": a job returned by getPendingJobs, serialized as base64 protobuf ("job")
+    - "run": the run of a job, with its "duration" and "status" ("ok" or "error")
+    - "disk.read", "disk.write", "cache.get", "cache.set": a transfer of a job, with its "bytes" and "duration"
+    Without a path the recorder is disabled and records nothing.
+    The file is created on the first record.
+    """
+
+    def __init__(self, path:str=None, maxSeen:int=10000):
+        """
+        Create a new recorder.
+        Args:
+            path (str): Optional: The path of the file, it is overwritten. Defaults to None (disabled).
+            maxSeen (int): Optional: The number of recorded job ids remembered to skip the jobs returned again by a poll. Defaults to 10000.
+        """
+        self.path = path
+        self.maxSeen = maxSeen
+        self.recorded = 0
+        self._file = None
+        self._closed = False
+        self._lock = threading.Lock()
+        # the ids of the last recorded jobs, oldest first
+        self._seen = OrderedDict()
+        self._start = time.monotonic()
+
+    def isEnabled(self) -> bool:
+        """
+        Check if the recorder is writing to a file.
+        Returns:
+            bool: True if the recorder is enabled.
+        """
+        return bool(self.path) and not self._closed
+
+    def activate(self, jobId:str):
+        """
+        Record the transfers made inside a with block under a job.
+        Args:
+            jobId (str): The ID of the job.
+        Returns:
+            A context manager.
+        """
+        if not self.path:
+            return _NOOP_JOB
+        return _ActiveJob(jobId)
+
+    def forWorker(self, index:int) -> 'JobRecorder':
+        """
+        Get a recorder that writes to the file of a worker process, eg. jobs.jsonl.gz -> jobs.1.jsonl.gz
+        Args:
+            index (int): The index of the worker.
+        Returns:
+            JobRecorder: The recorder.
+        """
+        if not self.path:
+            return JobRecorder(maxSeen=self.maxSeen)
+        directory, name = os.path.split(self.path)
+        parts = name.split(".", 1)
+        return JobRecorder(os.path.join(directory, parts[0]+"."+str(index)+("."+parts[1] if len(parts) > 1 else "")), self.maxSeen)
+
+    def _write(self, record:dict):
+        line = json.dumps(record, separators=(",", ":"))+"\n"
+        with self._lock:
+            if self._closed:
+                return
+            if self._file is None:
+                self._file = gzip.open(self.path, "wt") if self.path.endswith(".gz") else open(self.path, "w")
+                self._file.write(json.dumps({"type": "start", "startedAt": int(time.time()*1000), "version": 1}, separators=(",", ":"))+"\n")
+                atexit.register(self.close)
+            self._file.write(line)
+            self.recorded += 1
+
+    def _now(self) -> float:
+        return round((time.monotonic() - self._start)*1000, 3)
+
+    def recordJobs(self, jobs:list):
+        """
+        Record the jobs returned by a poll, each job is recorded once.
+        Args:
+            jobs (list): The jobs.
+        """
+        if not self.path:
+            return
+        t = self._now()
+        for job in jobs:
+            if job.id in self._seen:
+                continue
+            self._seen[job.id] = True
+            if len(self._seen) > self.maxSeen:
+                self._seen.popitem(last=False)
+            self._write({"t": t, "type": "job", "id": job.id, "job": base64.b64encode(job.SerializeToString()).decode("ascii")})
+
+    def recordRun(self, jobId:str, start:float, end:float, error=None):
+        """
+        Record the run of a job.
+        Args:
+            jobId (str): The ID of the job.
+            start (float): The start timestamp in seconds.
+            end (float): The end timestamp in seconds.
+            error (Exception): Optional: The error that made the run fail.
+        """
+        if not self.path:
+            return
+        self._write({"t": self._now(), "type": "run", "id": jobId, "duration": round((end-start)*1000, 3), "status": "error" if error is not None else "ok"})
+
+    def recordTransfer(self, type:str, size:int, start:float, jobId:str=None, **attributes):
+        """
+        Record a disk or cache transfer, under the job whose hooks are running if jobId is not set.
+        Args:
+            type (str): The type of the transfer, eg. "disk.read".
+            size (int): The transferred bytes.
+            start (float): The start timestamp in seconds.
+            jobId (str): Optional: The ID of the job.
+            **attributes: Additional fields of the record.
+        """
+        if not self.path:
+            return
+        record = {"t": self._now(), "type": type, "id": jobId or _currentJobId.get(), "bytes": size, "duration": round((time.time()-start)*1000, 3)}
+        record.update(attributes)
+        self._write(record)
+
+    def close(self):
+        """
+        Flush and close the file.
+        """
+        with self._lock:
+            self._closed = True
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def read(path:str):
+        """
+        Read a recording.
+        Args:
+            path (str): The path of the file.
+        Returns:
+            A generator of the records, the jobs are parsed in the "job" field.
+        """
+        with (gzip.open(path, "rt") if path.endswith(".gz") else open(path, "r")) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                record = json.loads(line)
+                if record["type"] == "job":
+                    record["job"] = Job_pb2.Job.FromString(base64.b64decode(record["job"]))
+                yield record
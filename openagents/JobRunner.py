@@ -4,6 +4,7 @@ from .Disk import Disk
 from openagents_grpc_proto import rpc_pb2_grpc
 from openagents_grpc_proto import rpc_pb2
 from .RunnerConfig import RunnerConfig
+from .SocketSchema import SocketSchema
 import time
 import os
 import json
@@ -16,6 +17,10 @@ class JobRunner:
     """
     An abstract class that represents a job runner.
     Implementations of this class should be able to run jobs.
+    The preRun, run and postRun hooks can be implemented either as async methods, 
+    that run on the node event loop, or as regular methods for blocking code, 
+    that run on the node thread pool (see NODE_THREAD_POOL_SIZE) and can use 
+    ctx.runSync to call the async methods of the JobContext.
     The internal logic of the runner uses these additional environment variables for configuration:
     - CACHE_PATH: The path to store cached data. Defaults to "./cache".
 
@@ -30,7 +35,25 @@ class JobRunner:
         self._sockets = config.getSockets()
         self._filter = config.getFilter()
         self.runInParallel=False
+        self.maxParallelJobs=0
+        self.runningJobs=0
+        self.runInProcess=False
+        self.loopTPS=0
+        self.maxBatchSize=1
+        self.maxBatchWait=50
+        self.processPoolSize=0
         self.initialized=False
+        self.configRevision=0
+        self.profileRate=0
+        self._inputSchema=None
+        self._inputSchemaRevision=-1
+
+    def __getstate__(self):
+        # the node (event loop, threads, connections) can't leave its process,
+        # eg. when the runner is sent to the workers of a ProcessPool started with spawn
+        state = self.__dict__.copy()
+        state["_node"] = None
+        return state
     
     
         
@@ -47,6 +70,64 @@ class JobRunner:
     def getSockets(self):
         return self._sockets
 
+    def getInputSchema(self) -> SocketSchema:
+        """
+        Get the "in" sockets compiled to decode the inputs of the jobs (see JobContext.getInputs).
+        The schema is compiled again when the config changes.
+        Returns:
+            SocketSchema: The compiled schema.
+        """
+        if self._inputSchema is None or self._inputSchemaRevision != self.configRevision:
+            self._inputSchema = SocketSchema(self._sockets)
+            self._inputSchemaRevision = self.configRevision
+        return self._inputSchema
+
+    def setMeta(self, meta:dict):
+        """
+        Replace the meta data of the event template.
+        Args:
+            meta (dict): The meta data.
+        """
+        self._meta = meta
+        self.invalidateConfig()
+
+    def setFilter(self, filter:dict):
+        """
+        Replace the filter of the jobs accepted by the runner.
+        Args:
+            filter (dict): The filter.
+        """
+        self._filter = filter
+        self.invalidateConfig()
+
+    def setTemplate(self, template:str):
+        """
+        Replace the mustache template of the event.
+        Args:
+            template (str): The template.
+        """
+        self._template = template
+        self.invalidateConfig()
+
+    def setSockets(self, sockets:dict):
+        """
+        Replace the sockets of the event template.
+        Args:
+            sockets (dict): The sockets.
+        """
+        self._sockets = sockets
+        self.invalidateConfig()
+
+    def invalidateConfig(self):
+        """
+        Signal that the meta, filter, template or sockets changed.
+        The node serializes the template again and announces it as soon as possible.
+        Must be called after changing the values returned by the getters in place.
+        """
+        self.configRevision += 1
+        if self._node is not None:
+            self._node._onRunnerConfigChanged(self)
+
     def setRunInParallel(self, runInParallel:bool):
         """
         Set whether the runner should run in parallel.
@@ -63,6 +144,102 @@ class JobRunner:
         """
         return self.runInParallel
 
+    def setRunInProcess(self, runInProcess:bool, poolSize:int=0):
+        """
+        Set whether the run method should be executed in a pool of worker processes.
+        Useful for cpu-bound runners, since the node event loop stays responsive.
+        In this mode run receives a ProcessJobContext that exposes the job and a logger,
+        preRun and postRun are still executed in the node process with the full JobContext.
+        The runner must not use disks or the remote cache inside run, and its output must be picklable.
+        Args:
+            runInProcess (bool): True if the runner should run in worker processes. Defaults to False.
+            poolSize (int): Optional: The number of worker processes. Defaults to NODE_PROCESS_POOL_SIZE.
+        """
+        self.runInProcess = runInProcess
+        self.processPoolSize = poolSize
+
+    def isRunInProcess(self) -> bool:
+        """
+        Check if the runner should run in worker processes.
+        Returns:
+            bool: True if the runner should run in worker processes, False otherwise.
+        """
+        return self.runInProcess
+
+    def setLoopTPS(self, tps:float):
+        """
+        Set how many times per second the loop method is called.
+        Args:
+            tps (float): The ticks per second of the loop, 0 = use the node NODE_TPS. Defaults to 0.
+        """
+        self.loopTPS = tps
+
+    def getLoopTPS(self) -> float:
+        """
+        Get how many times per second the loop method is called.
+        Returns:
+            float: The ticks per second of the loop, 0 if the node NODE_TPS is used.
+        """
+        return self.loopTPS
+
+    def setBatchSize(self, maxBatchSize:int, maxBatchWait:int=50):
+        """
+        Enable micro-batching: accepted jobs are grouped and passed to runBatch,
+        a batch is run when it contains maxBatchSize jobs or when its first job 
+        waited for maxBatchWait milliseconds.
+        Batches run one at a time, unless the runner is set to run in parallel.
+        Args:
+            maxBatchSize (int): The maximum number of jobs in a batch, 1 disables batching. Defaults to 1.
+            maxBatchWait (int): The maximum time in milliseconds a job waits for the batch to fill. Defaults to 50.
+        """
+        self.maxBatchSize = maxBatchSize
+        self.maxBatchWait = maxBatchWait
+
+    def getMaxBatchSize(self) -> int:
+        """
+        Get the maximum number of jobs in a batch.
+        Returns:
+            int: The maximum number of jobs in a batch, 1 if batching is disabled.
+        """
+        return self.maxBatchSize
+
+    def setMaxParallelJobs(self, maxParallelJobs:int):
+        """
+        Set the maximum number of jobs this runner can run at the same time.
+        When the limit is reached the node stops fetching jobs for this runner
+        until a job completes, leaving the pending jobs in the pool for other nodes.
+        Args:
+            maxParallelJobs (int): The maximum number of in-flight jobs, 0 = unlimited. Defaults to 0.
+        """
+        self.maxParallelJobs = maxParallelJobs
+
+    def getMaxParallelJobs(self) -> int:
+        """
+        Get the maximum number of jobs this runner can run at the same time.
+        Returns:
+            int: The maximum number of in-flight jobs, 0 = unlimited.
+        """
+        return self.maxParallelJobs
+
+    def setProfileRate(self, profileRate:float):
+        """
+        Profile a fraction of the jobs of this runner: preRun, run and postRun are profiled with cProfile
+        and the profile is saved under the job id (see NODE_PROFILE_PATH and NODE_PROFILE_DISK).
+        Jobs run in batches, and the run method of jobs run in worker processes, are not profiled.
+        Only one job is profiled at a time, the jobs sampled while another one is profiled run without profiling.
+        Args:
+            profileRate (float): The fraction of the jobs to profile, from 0 to 1, 0 = use the node NODE_PROFILE_RATE. Defaults to 0.
+        """
+        self.profileRate = profileRate
+
+    def getProfileRate(self) -> float:
+        """
+        Get the fraction of the jobs of this runner that are profiled.
+        Returns:
+            float: The fraction of the jobs, 0 if the node NODE_PROFILE_RATE is used.
+        """
+        return self.profileRate
+
 
     
     async def postRun(self, ctx:JobContext) -> None:
@@ -99,9 +276,29 @@ class JobRunner:
         """
         pass
 
+    async def runBatch(self, ctxs:list[JobContext]) -> list:
+        """
+        Run a batch of jobs, used when batching is enabled with setBatchSize.
+        By default each job is run with run by the node, like the unbatched jobs
+        (on the thread pool if run is synchronous, or in the process pool with setRunInProcess).
+        Args:
+            ctxs (list[JobContext]): The contexts of the jobs.
+        Returns:
+            list: The output of each job, in the same order of ctxs. 
+                An Exception in place of an output fails only that job.
+        """
+        async def runOne(ctx):
+            output = self.run(ctx)
+            if asyncio.iscoroutine(output):
+                output = await output
+            return output
+        return await asyncio.gather(*[runOne(ctx) for ctx in ctxs], return_exceptions=True)
+
     async def loop(self, node: 'OpenAgentsNode')-> None:
         """
         The main loop of the runner.
+        Called NODE_TPS times per second (or the rate set with setLoopTPS), 
+        each runner loop is scheduled independently.
         Args:
             node (OpenAgentsNode): The node
         """
@@ -111,6 +308,9 @@ class JobRunner:
     async def init(self,node: 'OpenAgentsNode')-> None:
         """
         Initialize the runner.
+        When the node runs with several workers, this is called once before forking:
+        the loaded state (eg. models) is shared by the workers and should be treated as read-only,
+        while connections, threads and event loop bound objects should be created lazily in the workers.
         Args:
             node (OpenAgentsNode): The node
         """
@@ -0,0 +1,381 @@
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+class LocalCache:
+    """
+    The local cache of the node, behind JobContext.cacheSet/cacheGet with local=True.
+    Each value is written to its own file, in one of 256 subdirectories named after the first
+    two characters of the sha256 of its key. The file starts with a JSON header line (key, version, expireAt)
+    followed by the pickled value, and is written to a temporary file then renamed, so a reader never sees
+    a partial value.
+    An index of the entries (size, version, expiration, last access) is kept in memory and saved to index.json
+    in the background, it is used to evict the least recently used entries when the cache is over its byte budget.
+    The expired entries are removed in the background.
+    Several processes can share the directory (eg. the workers of a node): the files are self describing,
+    and the index saved by another process is merged before saving.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, path:str, maxBytes:int=0, cleanupInterval:float=60000, metrics=None):
+        """
+        Open a cache directory.
+        Args:
+            path (str): The directory of the cache, created if it doesn't exist.
+            maxBytes (int): Optional: The maximum size in bytes of the values, 0 = unlimited. Defaults to 0.
+            cleanupInterval (float): Optional: The interval in milliseconds of the removal of the expired entries
+                and of the saving of the index. Defaults to 60000.
+            metrics (MetricsRegistry): Optional: The registry of the cache metrics. Defaults to None.
+        """
+        self.path = path
+        self.maxBytes = maxBytes
+        self.cleanupInterval = cleanupInterval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.size = 0
+        self._entries = OrderedDict()
+        # the keys removed since the last save, not to be merged back from the saved index
+        self._removed = set()
+        self._dirty = False
+        self._indexMtime = None
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._evictionsTotal = None
+        if metrics is not None:
+            self._evictionsTotal = metrics.counter("cache_evictions_total", "Entries removed from the local cache", ("reason",))
+            metrics.gauge("cache_local_bytes", "Size of the values in the local cache").setFunction(lambda: self.size)
+        os.makedirs(self.path, exist_ok=True)
+        self._load()
+
+    def _getFile(self, key:str) -> str:
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.path, name[:2], name)
+
+    def _readIndex(self) -> dict:
+        indexPath = os.path.join(self.path, self.INDEX_FILE)
+        try:
+            mtime = os.stat(indexPath).st_mtime_ns
+            if mtime == self._indexMtime:
+                return None
+            with open(indexPath, "r") as f:
+                entries = json.loads(f.read())["entries"]
+            self._indexMtime = mtime
+            return entries
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print("Error reading cache index "+str(e))
+            return None
+
+    def _setEntries(self, entries:dict):
+        # least recently used first
+        self._entries = OrderedDict(sorted(entries.items(), key=lambda item: item[1]["atime"]))
+        self.size = sum(entry["size"] for entry in self._entries.values())
+
+    def _load(self):
+        entries = self._readIndex() or {}
+        if len(entries) == 0:
+            # no index (first start or crash before the first save), rebuild it from the headers of the files
+            for shard in os.listdir(self.path):
+                shardPath = os.path.join(self.path, shard)
+                if len(shard) != 2 or not os.path.isdir(shardPath):
+                    continue
+                for name in os.listdir(shardPath):
+                    filePath = os.path.join(shardPath, name)
+                    if name.endswith(".tmp"):
+                        # left by an interrupted write
+                        self._unlink(filePath)
+                        continue
+                    try:
+                        with open(filePath, "rb") as f:
+                            header = json.loads(f.readline())
+                        stat = os.stat(filePath)
+                        entries[header["key"]] = {
+                            "size": stat.st_size,
+                            "version": header["version"],
+                            "expireAt": header["expireAt"],
+                            "atime": stat.st_mtime,
+                        }
+                    except Exception as e:
+                        print("Removing unreadable cache file "+filePath+" "+str(e))
+                        self._unlink(filePath)
+            self._dirty = len(entries) > 0
+        self._setEntries(entries)
+
+    def _unlink(self, filePath:str):
+        try:
+            os.unlink(filePath)
+        except FileNotFoundError:
+            pass
+
+    def _remove(self, key:str, reason:str=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self.size -= entry["size"]
+        self._removed.add(key)
+        self._dirty = True
+        self._unlink(self._getFile(key))
+        if reason == "evicted":
+            self.evictions += 1
+        elif reason == "expired":
+            self.expired += 1
+        if reason and self._evictionsTotal is not None:
+            self._evictionsTotal.labels(reason=reason).inc()
+
+    def _evict(self, keep:str=None):
+        if self.maxBytes <= 0:
+            return
+        for key in list(self._entries.keys()):
+            if self.size <= self.maxBytes:
+                break
+            if key != keep:
+                self._remove(key, "evicted")
+
+    def start(self):
+        """
+        Start the background removal of the expired entries and saving of the index.
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._cleanupLoop, name="local-cache", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """
+        Stop the background thread and save the index.
+        """
+        self._stopped.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(5)
+        self._thread = None
+        self.saveIndex()
+
+    def _cleanupLoop(self):
+        while not self._stopped.wait(self.cleanupInterval/1000.0):
+            try:
+                self.removeExpired()
+                self.saveIndex()
+            except Exception as e:
+                traceback.print_exc()
+                print("Error cleaning up the local cache "+str(e))
+
+    def removeExpired(self) -> int:
+        """
+        Remove the expired entries.
+        Returns:
+            int: The number of removed entries.
+        """
+        now = time.time()*1000
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if entry["expireAt"] > 0 and now > entry["expireAt"]]
+            for key in keys:
+                self._remove(key, "expired")
+        return len(keys)
+
+    def saveIndex(self):
+        """
+        Save the index, merged with the entries added by other processes since the last save.
+        """
+        with self._lock:
+            saved = self._readIndex()
+            if saved is not None:
+                entries = dict(self._entries)
+                for key, entry in saved.items():
+                    if key in self._removed:
+                        continue
+                    if key not in entries or entry["atime"] > entries[key]["atime"]:
+                        entries[key] = entry
+                        self._dirty = True
+                self._setEntries(entries)
+                self._evict()
+            if not self._dirty:
+                return
+            indexPath = os.path.join(self.path, self.INDEX_FILE)
+            tmpPath = indexPath+"."+uuid.uuid4().hex+".tmp"
+            with open(tmpPath, "w") as f:
+                f.write(json.dumps({"version": 1, "entries": self._entries}, separators=(",", ":")))
+            os.replace(tmpPath, indexPath)
+            self._indexMtime = os.stat(indexPath).st_mtime_ns
+            self._removed.clear()
+            self._dirty = False
+
+    def set(self, key:str, data:bytes, version:int=0, expireAt:int=0) -> bool:
+        """
+        Store a value.
+        Args:
+            key (str): The key.
+            data (bytes): The serialized value.
+            version (int): Optional: The version of the value. Defaults to 0.
+            expireAt (int): Optional: The timestamp at which the value expires in milliseconds, 0 = never. Defaults to 0.
+        Returns:
+            bool: False if the value is larger than the byte budget of the cache.
+        """
+        header = (json.dumps({"key": key, "version": version, "expireAt": expireAt})+"\n").encode("utf-8")
+        size = len(header)+len(data)
+        if self.maxBytes > 0 and size > self.maxBytes:
+            return False
+        filePath = self._getFile(key)
+        os.makedirs(os.path.dirname(filePath), exist_ok=True)
+        tmpPath = filePath+"."+uuid.uuid4().hex+".tmp"
+        try:
+            with open(tmpPath, "wb") as f:
+                f.write(header)
+                f.write(data)
+            os.replace(tmpPath, filePath)
+        except BaseException:
+            self._unlink(tmpPath)
+            raise
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous["size"]
+            self._entries[key] = {"size": size, "version": version, "expireAt": expireAt, "atime": time.time()}
+            self.size += size
+            self._removed.discard(key)
+            self._dirty = True
+            self._evict(key)
+        return True
+
+    def importLegacy(self, path:str) -> int:
+        """
+        Move the entries of the flat layout used before this cache (a <key> file with the pickled value
+        next to a <key>.meta.json file with its version and expiration) into the cache.
+        Only the imported and the expired entries are deleted, the files that don't look like an entry,
+        can't be read or don't fit in the cache are left in place.
+        Args:
+            path (str): The directory of the flat layout.
+        Returns:
+            int: The number of imported entries.
+        """
+        imported = 0
+        try:
+            names = os.listdir(path)
+        except FileNotFoundError:
+            return 0
+        now = time.time()*1000
+        for name in names:
+            if not name.endswith(".meta.json"):
+                continue
+            metaPath = os.path.join(path, name)
+            key = name[:-len(".meta.json")]
+            filePath = os.path.join(path, key)
+            if not os.path.isfile(metaPath) or not os.path.isfile(filePath):
+                continue
+            try:
+                with open(metaPath, "r") as f:
+                    meta = json.loads(f.read())
+                if not isinstance(meta, dict) or set(meta.keys()) != {"version", "expireAt"}:
+                    # not written by the flat layout
+                    continue
+                expireAt = meta["expireAt"]
+                if not (expireAt > 0 and now > expireAt):
+                    with open(filePath, "rb") as f:
+                        data = f.read()
+                    if not self.set(key, data, meta["version"], expireAt):
+                        print("Legacy cache entry "+key+" is too large, left in "+path)
+                        continue
+                    imported += 1
+            except Exception as e:
+                print("Error importing legacy cache entry "+key+" "+str(e))
+                continue
+            self._unlink(filePath)
+            self._unlink(metaPath)
+        return imported
+
+    def get(self, key:str, lastVersion:int=0) -> bytes:
+        """
+        Read a value.
+        Args:
+            key (str): The key.
+            lastVersion (int): Optional: The required version, 0 = any. Defaults to 0.
+        Returns:
+            bytes: The serialized value, or None if it is missing, expired or has a different version.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["expireAt"] > 0 and time.time()*1000 > entry["expireAt"]:
+                self._remove(key, "expired")
+                entry = None
+        filePath = self._getFile(key)
+        expired = False
+        try:
+            with open(filePath, "rb") as f:
+                header = json.loads(f.readline())
+                if header["key"] != key:
+                    raise FileNotFoundError(filePath)
+                if header["expireAt"] > 0 and time.time()*1000 > header["expireAt"]:
+                    expired = True
+                    data = None
+                elif lastVersion > 0 and header["version"] != lastVersion:
+                    data = None
+                else:
+                    data = f.read()
+        except FileNotFoundError:
+            # removed by another process
+            with self._lock:
+                if key in self._entries:
+                    self._remove(key)
+            self.misses += 1
+            return None
+        with self._lock:
+            if expired:
+                if key in self._entries:
+                    self._remove(key, "expired")
+                else:
+                    self._unlink(filePath)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                # written by another process
+                entry = {"size": os.path.getsize(filePath), "version": header["version"], "expireAt": header["expireAt"]}
+                self.size += entry["size"]
+                self._removed.discard(key)
+            entry["atime"] = time.time()
+            self._entries[key] = entry
+            self._dirty = True
+            self._evict(key)
+        return data
+
+    def delete(self, key:str):
+        """
+        Remove a value.
+        Args:
+            key (str): The key.
+        """
+        with self._lock:
+            self._remove(key)
+        self._unlink(self._getFile(key))
+
+    def getStats(self) -> dict:
+        """
+        Get the stats of the cache.
+        Returns:
+            dict: The number of entries, their size in bytes, the byte budget, and the hits, misses,
+                evicted and expired entries since the cache was opened.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "maxBytes": self.maxBytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expired": self.expired,
+            }
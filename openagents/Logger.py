@@ -1,12 +1,15 @@
 import time
 import os
-import concurrent
-from threading import Condition
+import json
+import atexit
+import threading
 import queue
 from typing import Literal
 import base64
 import requests
 import traceback
+import weakref
+from .MetricsRegistry import MetricsRegistry
 LogLevel = Literal[
     "error",
     "warn",
@@ -17,11 +20,58 @@ LogLevel = Literal[
     "finest"
 ]
 
+# the OpenObserve loggers alive in the process, to expose the size of their queues
+_oobsLoggers = weakref.WeakSet()
+_logLines = MetricsRegistry.getDefault().counter("log_lines_total", "Log lines by level", ("level",))
+MetricsRegistry.getDefault().gauge("log_queue_depth", "Log lines waiting to be sent", ("queue",)).labels(queue="openobserve").setFunction(
+    lambda: sum(logger.buffer.qsize() for logger in list(_oobsLoggers))
+)
+
 class OpenObserveLogger:
     """
-    A logger for OpenObserve that sends logs in batches.
+    A logger for OpenObserve that sends logs in batches from a single background thread.
+    The loggers of the process share one sink per OpenObserve configuration (see OpenObserveLogger.acquire),
+    and add their own metadata to each entry.
     """
+
+    # the shared sinks of the process, by configuration
+    _sinks = {}
+    _sinksLock = threading.Lock()
+
+    @staticmethod
+    def acquire(options:dict) -> 'OpenObserveLogger':
+        """
+        Get the shared sink for the given options, it is created on the first call
+        and closed when it is released as many times as it was acquired.
+        Args:
+            options (dict): The OpenObserve options.
+        Returns:
+            OpenObserveLogger: The sink.
+        """
+        key = json.dumps(options, sort_keys=True, default=str)
+        with OpenObserveLogger._sinksLock:
+            sink = OpenObserveLogger._sinks.get(key)
+            if sink is None:
+                sink = OpenObserveLogger(options)
+                sink._key = key
+                OpenObserveLogger._sinks[key] = sink
+            sink.refs += 1
+            return sink
+
+    def release(self):
+        """
+        Release a sink obtained with acquire, the last release flushes and closes it.
+        """
+        with OpenObserveLogger._sinksLock:
+            self.refs -= 1
+            if self.refs > 0:
+                return
+            if OpenObserveLogger._sinks.get(self._key) is self:
+                del OpenObserveLogger._sinks[self._key]
+        self.close()
+
     def __init__(self, options:dict):
+        _oobsLoggers.add(self)
         self.options = options        
         self.batchSize= self.options["batchSize"]
         self.flushInterval = self.options["flushInterval"]
@@ -29,17 +79,22 @@ class OpenObserveLogger:
             self.flushInterval = 5000
         if not self.batchSize:
             self.batchSize = 21        
+        self.refs = 0
+        self.closed = False
+        self._key = None
+        self._start()
+
+    def _start(self):
         self.buffer = queue.Queue()
-        self.wait = Condition()
-        self.flushThread = concurrent.futures.ThreadPoolExecutor(max_workers=3)
-        self.flushThread.submit(self.flushLoop)
-        
+        self.wait = threading.Condition()
+        self.flushThread = threading.Thread(target=self.flushLoop, name="openobserve-logger", daemon=True)
+        self.flushThread.start()
 
     def batchReady(self):
         with self.wait:
             self.wait.notify_all()
 
-    def log(self, level:LogLevel, message:str, timestamp:int=None):
+    def log(self, level:LogLevel, message:str, timestamp:int=None, meta:dict=None):
         """
         Log a message with a specific level.
 
@@ -47,32 +102,32 @@ class OpenObserveLogger:
             level (LogLevel): The level of the log.
             message (str): The message to log.
             timestamp (int): The timestamp of the log. Defaults to the current time.
+            meta (dict): Optional: The metadata of the entry, added to the metadata of the options. Defaults to None.
         """
         log_entry = {
             'level': level,
             '_timestamp': timestamp or int(time.time()*1000),
             'log': message
         }
-        meta=self.options["meta"] if "meta" in self.options else {}
-        for key in meta:
-            log_entry[key]=meta[key]
+        if "meta" in self.options:
+            log_entry.update(self.options["meta"])
+        if meta:
+            log_entry.update(meta)
 
         self.buffer.put(log_entry)
         if self.buffer.qsize() >= self.batchSize:
-            self.flushThread.submit(self.batchReady)
+            self.batchReady()
 
-    def _close(self):
-        while not self.buffer.empty():
-            with self.wait:
-                self.wait.notify_all()
-            time.sleep(0.1)
-        self.flushThread.shutdown()
-        
-    def close(self):
+    def close(self, timeout:float=None):
         """
-        Immediately flush all the logs to OpenObserve and shutdown the logger.
+        Flush all the logs to OpenObserve and stop the flush thread.
+        Args:
+            timeout (float): Optional: The time in seconds to wait for the flush, None = don't wait. Defaults to None.
         """
-        self.flushThread.submit(self._close)        
+        self.closed = True
+        self.batchReady()
+        if timeout is not None and self.flushThread is not threading.current_thread():
+            self.flushThread.join(timeout)
             
         
     def _flushToOpenObserve(self, batch):
@@ -99,16 +154,38 @@ class OpenObserveLogger:
     def flushLoop(self):
         while True:
             with self.wait:
-                self.wait.wait(self.flushInterval/1000)
-            batch = []
-            while not self.buffer.empty() and len(batch) < self.batchSize:
-                try:
-                    batch.append(self.buffer.get(block=False))
-                except queue.Empty:
-                    break         
-            self._flushToOpenObserve(batch)
+                if not self.closed and self.buffer.qsize() < self.batchSize:
+                    self.wait.wait(self.flushInterval/1000)
+            # send everything that is queued, in batches
+            while True:
+                batch = []
+                while len(batch) < self.batchSize:
+                    try:
+                        batch.append(self.buffer.get(block=False))
+                    except queue.Empty:
+                        break
+                self._flushToOpenObserve(batch)
+                if len(batch) < self.batchSize:
+                    break
+            if self.closed and self.buffer.empty():
+                return
+
 
+def _closeSinks():
+    # flush the logs left at exit, the flush threads are daemons
+    for sink in list(_oobsLoggers):
+        sink.close(5)
 
+def _afterFork():
+    # the flush threads don't survive a fork, and the queued entries are sent by the parent
+    OpenObserveLogger._sinksLock = threading.Lock()
+    for sink in list(_oobsLoggers):
+        if not sink.closed:
+            sink._start()
+
+atexit.register(_closeSinks)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_afterFork)
     
 
 
@@ -161,7 +238,8 @@ class Logger :
         oobsEndPoint = os.getenv('OPENOBSERVE_ENDPOINT', None)
         if enableOobs and oobsEndPoint:
             
-            self.oobsLogger = OpenObserveLogger({
+            # the sink is shared by the loggers of the process, this logger only adds its metadata
+            self.oobsLogger = OpenObserveLogger.acquire({
                 "baseUrl": oobsEndPoint,
                 "org": os.getenv('OPENOBSERVE_ORG', "default"),
                 "stream": os.getenv('OPENOBSERVE_STREAM', "default"),
@@ -171,12 +249,12 @@ class Logger :
                 },
                 "batchSize": int(os.getenv('OPENOBSERVE_BATCHSIZE', 21)),
                 "flushInterval": int(os.getenv('OPENOBSERVE_FLUSHINTERVAL', 0)),
-                "meta":{
-                    "appName": self.name,
-                    "appVersion": self.version,
-                    "jobId": self.jobId
-                }                
             })
+            self.oobsMeta = {
+                "appName": self.name,
+                "appVersion": self.version,
+                "jobId": self.jobId
+            }
 
     def _levelToValue(self, level:LogLevel)->int:
         if level == "error": return 7
@@ -190,6 +268,7 @@ class Logger :
 
     def _log(self, level: LogLevel, args:tuple):
         message = " ".join([str(x) for x in args])
+        _logLines.labels(level=level).inc()
 
         levelV=self._levelToValue(level)
         minLevel = self.logLevel
@@ -201,7 +280,7 @@ class Logger :
             print(date+" ["+self.name+":"+self.version+"] "+(("("+self.jobId+")") if self.jobId else "")+": "+level+" : "+message)
 
         if self.oobsLogger and levelV >= minObsLevel:
-            self.oobsLogger.log(level, message)
+            self.oobsLogger.log(level, message, meta=self.oobsMeta)
         
         if self.runnerLogger and levelV >= minNostrLevel:
             self.runnerLogger(message)
@@ -234,7 +313,9 @@ class Logger :
 
     def close(self):
         if self.oobsLogger:
-            self.oobsLogger.close()
+            oobsLogger = self.oobsLogger
+            self.oobsLogger = None
+            oobsLogger.release()
 
 
        
\ No newline at end of file
@@ -0,0 +1,147 @@
+import asyncio
+import sys
+import threading
+import time
+import traceback
+from .JobContext import JobContext
+from .JobRunner import JobRunner
+
+class LoopMonitor:
+    """
+    Measures the scheduling delay of the node event loop with a heartbeat task,
+    and watches it from a separate thread: when the loop doesn't run for longer than the threshold,
+    the stack of the code blocking it is captured and the stall is attributed to the runner and the job
+    whose JobContext is found in the blocked frames (or to the runner alone, eg. when its loop is blocking).
+    Stalls are reported through the node logger, the log of the job, and the metrics.
+    """
+
+    def __init__(self, node, threshold:float=250, interval:float=100):
+        """
+        Create a new monitor.
+        Args:
+            node (OpenAgentsNode): The node.
+            threshold (float): The time in milliseconds the loop must be blocked to report a stall. Defaults to 250.
+            interval (float): The interval of the heartbeat in milliseconds. Defaults to 100.
+        """
+        self.node = node
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = 0
+        self.maxLag = 0.0
+        self.lastStall = None
+        self._lastBeat = time.monotonic()
+        self._reportedBeat = None
+        self._loop = None
+        self._loopThreadId = None
+        self._task = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lag = node.metrics.histogram("event_loop_lag_seconds", "Delay of the event loop heartbeat")
+        self._stallsTotal = node.metrics.counter("event_loop_stalls_total", "Event loop stalls longer than the threshold, by the runner that was blocking", ("runner",))
+
+    def start(self):
+        """
+        Start the heartbeat on the running loop and the watchdog thread.
+        """
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loopThreadId = threading.get_ident()
+        self._lastBeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the heartbeat and the watchdog thread.
+        """
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _beat(self):
+        interval = self.interval/1000.0
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            previousBeat = self._lastBeat
+            lag = max(0.0, now - previousBeat - interval)
+            self._lastBeat = now
+            self._lag.observe(lag)
+            self.maxLag = max(self.maxLag, lag)
+            if self.lastStall is not None and self.lastStall["beat"] == previousBeat:
+                # the stall is over, record how long it lasted
+                self.lastStall["blocked"] = lag*1000
+
+    def _findCulprit(self, frame) -> tuple:
+        runner = None
+        while frame is not None:
+            for value in list(frame.f_locals.values()):
+                if isinstance(value, list) and len(value) > 0:
+                    value = value[0]
+                if isinstance(value, JobContext):
+                    return (value.runner, value)
+                if runner is None and isinstance(value, JobRunner):
+                    runner = value
+            frame = frame.f_back
+        return (runner, None)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval/2000.0):
+            lastBeat = self._lastBeat
+            blocked = (time.monotonic() - lastBeat)*1000 - self.interval
+            if blocked < self.threshold or self._reportedBeat == lastBeat:
+                continue
+            self._reportedBeat = lastBeat
+            try:
+                self._report(lastBeat, blocked)
+            except Exception as e:
+                traceback.print_exc()
+                print("Error reporting event loop stall "+str(e))
+
+    def _report(self, beat:float, blocked:float):
+        frame = sys._current_frames().get(self._loopThreadId)
+        if frame is None:
+            return
+        runner, ctx = self._findCulprit(frame)
+        stack = "".join(traceback.format_stack(frame))
+        runner = runner.__class__.__name__ if runner is not None else None
+        jobId = ctx.getJob().id if ctx is not None else None
+        self.stalls += 1
+        self._stallsTotal.labels(runner=runner or "unknown").inc()
+        self.lastStall = {
+            "beat": beat,
+            "at": int(time.time()*1000),
+            "blocked": blocked,
+            "runner": runner,
+            "jobId": jobId,
+            "stack": stack,
+        }
+        message = "Event loop blocked for more than "+str(int(blocked))+" ms"
+        if runner is not None:
+            message += " by runner "+runner
+        if ctx is not None:
+            message += " running job "+jobId
+        self.node.getLogger().warn(message+"\n"+stack)
+        if ctx is not None:
+            # the job log is sent from the loop, as soon as it is unblocked
+            self._loop.call_soon_threadsafe(ctx.getLogger().warn, "This job blocked the node event loop for more than "+str(int(blocked))+" ms, move blocking code to a synchronous hook")
+
+    def getStats(self) -> dict:
+        """
+        Get the stats of the monitor.
+        Returns:
+            dict: The number of stalls, the maximum lag in milliseconds, and the last stall
+                (its timestamp, duration in milliseconds, runner, job id and stack).
+        """
+        lastStall = None
+        if self.lastStall is not None:
+            lastStall = {key: value for key, value in self.lastStall.items() if key != "beat"}
+        return {
+            "stalls": self.stalls,
+            "maxLag": self.maxLag*1000,
+            "lastStall": lastStall,
+        }
@@ -0,0 +1,102 @@
+import asyncio
+import time
+import traceback
+
+class LoopScheduler:
+    """
+    Calls a coroutine function at a fixed rate on its own task.
+    Ticks are scheduled on an absolute timeline, so the time spent in each tick
+    doesn't accumulate as drift. A tick that takes longer than the interval is
+    counted as an overrun and the missed ticks are skipped instead of being run back to back.
+    """
+
+    def __init__(self, name:str, fn, interval:float, logger=None):
+        """
+        Create a new scheduler.
+        Args:
+            name (str): The name of the scheduled loop, used in logs.
+            fn (coroutine function): The function to call on every tick.
+            interval (float): The interval between ticks in milliseconds.
+            logger (Logger): Optional: The logger to report errors to.
+        """
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.logger = logger
+        self._task = None
+        self.ticks = 0
+        self.overruns = 0
+        self.missedTicks = 0
+        self.lastDuration = 0.0
+        self.maxDuration = 0.0
+        self.totalDuration = 0.0
+        self.maxLateness = 0.0
+        self.totalLateness = 0.0
+
+    def start(self):
+        """
+        Start calling the function.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        """
+        Stop calling the function.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def isRunning(self) -> bool:
+        return self._task is not None
+
+    async def _run(self):
+        interval = self.interval/1000.0
+        nextTick = time.monotonic()
+        while True:
+            start = time.monotonic()
+            lateness = max(0.0, start - nextTick)
+            try:
+                await self.fn()
+            except Exception as e:
+                traceback.print_exc()
+                if self.logger:
+                    self.logger.error("Error in loop "+self.name+" "+str(e))
+            end = time.monotonic()
+            duration = end - start
+
+            self.ticks += 1
+            self.lastDuration = duration
+            self.totalDuration += duration
+            self.maxDuration = max(self.maxDuration, duration)
+            self.totalLateness += lateness
+            self.maxLateness = max(self.maxLateness, lateness)
+
+            nextTick += interval
+            if end > nextTick:
+                # skip the ticks that should have happened while this one was running
+                missed = int((end - nextTick)/interval) + 1
+                self.overruns += 1
+                self.missedTicks += missed
+                nextTick += missed*interval
+            await asyncio.sleep(nextTick - time.monotonic())
+
+    def getStats(self) -> dict:
+        """
+        Get the timing stats of the loop.
+        Returns:
+            dict: The number of ticks, overruns and missed ticks, the durations and
+                the lateness (delay of the tick start from its schedule) in milliseconds.
+        """
+        return {
+            "interval": self.interval,
+            "ticks": self.ticks,
+            "overruns": self.overruns,
+            "missedTicks": self.missedTicks,
+            "lastDuration": self.lastDuration*1000,
+            "avgDuration": (self.totalDuration/self.ticks*1000) if self.ticks else 0.0,
+            "maxDuration": self.maxDuration*1000,
+            "avgLateness": (self.totalLateness/self.ticks*1000) if self.ticks else 0.0,
+            "maxLateness": self.maxLateness*1000,
+        }
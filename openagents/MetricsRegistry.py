@@ -0,0 +1,323 @@
+import threading
+import math
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class Metric:
+    """
+    A metric with optional labels: metric.labels(runner="x") returns the child
+    of a label combination, a metric without labels is its own child.
+    """
+    typeName = "untyped"
+
+    def __init__(self, name:str, help:str, labelNames:tuple=()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels) -> 'Metric':
+        """
+        Get the child of a label combination.
+        Args:
+            **labels: The value of each label.
+        Returns:
+            Metric: The child.
+        """
+        key = tuple(str(labels.get(name, "")) for name in self.labelNames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = self._newChild()
+                    self._children[key] = child
+        return child
+
+    def _newChild(self):
+        # a child has no labels, it is the same kind of metric
+        return type(self)(self.name, self.help)
+
+    def _getChildren(self) -> list:
+        if len(self.labelNames) == 0:
+            return [((), self)]
+        return list(self._children.items())
+
+    def _formatLabels(self, key:tuple, extra:dict=None) -> str:
+        pairs = list(zip(self.labelNames, key))
+        if extra:
+            pairs += list(extra.items())
+        if len(pairs) == 0:
+            return ""
+        return "{"+",".join(k+'="'+str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")+'"' for k, v in pairs)+"}"
+
+    def _formatValue(self, value:float) -> str:
+        if value == math.inf:
+            return "+Inf"
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value)
+
+    def expose(self) -> list:
+        """
+        Get the lines of the metric in the Prometheus text format.
+        Returns:
+            list: The lines.
+        """
+        lines = ["# HELP "+self.name+" "+self.help, "# TYPE "+self.name+" "+self.typeName]
+        for key, child in self._getChildren():
+            lines += child._exposeChild(self, key)
+        return lines
+
+
+class Counter(Metric):
+    """
+    A value that only goes up.
+    """
+    typeName = "counter"
+
+    def __init__(self, name:str, help:str, labelNames:tuple=()):
+        super().__init__(name, help, labelNames)
+        self.value = 0
+
+    def inc(self, value:float=1):
+        """
+        Increase the counter.
+        Args:
+            value (float): The increment. Defaults to 1.
+        """
+        with self._lock:
+            self.value += value
+
+    def _exposeChild(self, parent:Metric, key:tuple) -> list:
+        return [self.name+parent._formatLabels(key)+" "+self._formatValue(self.value)]
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, or that is read from a function when exposed.
+    """
+    typeName = "gauge"
+
+    def __init__(self, name:str, help:str, labelNames:tuple=()):
+        super().__init__(name, help, labelNames)
+        self.value = 0
+        self._function = None
+
+    def set(self, value:float):
+        """
+        Set the gauge.
+        Args:
+            value (float): The value.
+        """
+        self.value = value
+
+    def inc(self, value:float=1):
+        """
+        Increase the gauge.
+        Args:
+            value (float): The increment. Defaults to 1.
+        """
+        with self._lock:
+            self.value += value
+
+    def dec(self, value:float=1):
+        """
+        Decrease the gauge.
+        Args:
+            value (float): The decrement. Defaults to 1.
+        """
+        with self._lock:
+            self.value -= value
+
+    def setFunction(self, function):
+        """
+        Read the value from a function when the gauge is exposed.
+        Args:
+            function (callable): A function that returns the value.
+        """
+        self._function = function
+
+    def _exposeChild(self, parent:Metric, key:tuple) -> list:
+        value = self.value
+        if self._function is not None:
+            try:
+                value = self._function()
+            except Exception:
+                value = math.nan
+        return [self.name+parent._formatLabels(key)+" "+self._formatValue(value)]
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values in cumulative buckets.
+    """
+    typeName = "histogram"
+    # seconds, from 1 ms to 1 minute
+    DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name:str, help:str, labelNames:tuple=(), buckets:tuple=None):
+        super().__init__(name, help, labelNames)
+        self.buckets = tuple(sorted(buckets or Histogram.DEFAULT_BUCKETS))
+        self.counts = [0]*(len(self.buckets)+1)
+        self.sum = 0.0
+        self.count = 0
+
+    def _newChild(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value:float):
+        """
+        Observe a value.
+        Args:
+            value (float): The value.
+        """
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def _exposeChild(self, parent:Metric, key:tuple) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(list(self.buckets)+[math.inf], self.counts):
+            cumulative += count
+            lines.append(self.name+"_bucket"+parent._formatLabels(key, {"le": self._formatValue(float(bound))})+" "+str(cumulative))
+        lines.append(self.name+"_sum"+parent._formatLabels(key)+" "+self._formatValue(self.sum))
+        lines.append(self.name+"_count"+parent._formatLabels(key)+" "+str(self.count))
+        return lines
+
+
+class MetricsRegistry:
+    """
+    A set of metrics that can be exposed in the Prometheus text format,
+    optionally on a local HTTP endpoint.
+    The metrics are created on first use and shared by everything in the process
+    that uses the same registry (see MetricsRegistry.getDefault).
+    """
+    _default = None
+
+    def __init__(self, prefix:str="openagents_"):
+        """
+        Create a new registry.
+        Args:
+            prefix (str): The prefix of the names of the metrics. Defaults to "openagents_".
+        """
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @staticmethod
+    def getDefault() -> 'MetricsRegistry':
+        """
+        Get the registry shared by the node, the jobs, the disks and the loggers of the process.
+        Returns:
+            MetricsRegistry: The registry.
+        """
+        if MetricsRegistry._default is None:
+            MetricsRegistry._default = MetricsRegistry()
+        return MetricsRegistry._default
+
+    def _getOrCreate(self, cls, name:str, help:str, labelNames:tuple, **kwargs) -> Metric:
+        name = self.prefix+name
+        metric = self._metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(name)
+                if metric is None:
+                    metric = cls(name, help, labelNames, **kwargs)
+                    self._metrics[name] = metric
+        if not isinstance(metric, cls):
+            raise ValueError("Metric "+name+" is already registered as "+metric.typeName)
+        return metric
+
+    def counter(self, name:str, help:str, labelNames:tuple=()) -> Counter:
+        """
+        Get or create a counter.
+        Args:
+            name (str): The name of the counter, without the prefix.
+            help (str): The description of the counter.
+            labelNames (tuple): The names of the labels. Defaults to no labels.
+        Returns:
+            Counter: The counter.
+        """
+        return self._getOrCreate(Counter, name, help, labelNames)
+
+    def gauge(self, name:str, help:str, labelNames:tuple=()) -> Gauge:
+        """
+        Get or create a gauge.
+        Args:
+            name (str): The name of the gauge, without the prefix.
+            help (str): The description of the gauge.
+            labelNames (tuple): The names of the labels. Defaults to no labels.
+        Returns:
+            Gauge: The gauge.
+        """
+        return self._getOrCreate(Gauge, name, help, labelNames)
+
+    def histogram(self, name:str, help:str, labelNames:tuple=(), buckets:tuple=None) -> Histogram:
+        """
+        Get or create a histogram.
+        Args:
+            name (str): The name of the histogram, without the prefix.
+            help (str): The description of the histogram.
+            labelNames (tuple): The names of the labels. Defaults to no labels.
+            buckets (tuple): The upper bounds of the buckets. Defaults to latencies from 1 ms to 1 minute.
+        Returns:
+            Histogram: The histogram.
+        """
+        return self._getOrCreate(Histogram, name, help, labelNames, buckets=buckets)
+
+    def expose(self) -> str:
+        """
+        Get all the metrics in the Prometheus text format.
+        Returns:
+            str: The metrics.
+        """
+        lines = []
+        for name in sorted(self._metrics.keys()):
+            lines += self._metrics[name].expose()
+        return "\n".join(lines)+"\n"
+
+    def serve(self, port:int, host:str="127.0.0.1"):
+        """
+        Expose the metrics on http://host:port/metrics from a background thread.
+        Args:
+            port (int): The port.
+            host (str): The address to bind. Defaults to "127.0.0.1".
+        """
+        if self._server is not None:
+            return
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.expose().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+
+    def close(self):
+        """
+        Stop the HTTP endpoint.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
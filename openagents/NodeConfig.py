@@ -7,20 +7,49 @@ class NodeConfig :
     - NODE_NAME: The name of the node.
     - NODE_DESCRIPTION: The description of the node.
     - NODE_VERSION: The version of the node.
+    Node options (eg. maxParallelJobs) can be passed in the options dict, 
+    they take precedence over their environment variable.
     """
-    def __init__(self, meta:dict=None):
+    def __init__(self, meta:dict=None, options:dict=None):
         self._meta={
             "name": "OpenAgents Node",
             "description": "An new OpenAgents Node",
             "version": "0.0.1",
             "picture":""
         }
+        self._options={}
         if meta:
             for k,v in meta.items():
                 self._meta[k]=v
+        if options:
+            for k,v in options.items():
+                self._options[k]=v
 
     def getMeta(self):
         self._meta["name"] = os.getenv('NODE_NAME', self._meta["name"])
         self._meta["description"] = os.getenv('NODE_DESCRIPTION', self._meta["description"])
         self._meta["version"] = os.getenv('NODE_VERSION', self._meta["version"])
         return self._meta
+
+    def getOption(self, key:str, env:str=None, default=None):
+        """
+        Get a node option.
+        Args:
+            key (str): The name of the option.
+            env (str): Optional: The environment variable to read if the option is not set.
+            default: The default value, its type is used to parse the environment variable.
+        Returns:
+            The value of the option.
+        """
+        if key in self._options and self._options[key] is not None:
+            return self._options[key]
+        value = os.getenv(env, None) if env else None
+        if value is None or value == "":
+            return default
+        if isinstance(default, bool):
+            return value.lower() in ("true", "1", "yes")
+        if isinstance(default, int):
+            return int(value)
+        if isinstance(default, float):
+            return float(value)
+        return value
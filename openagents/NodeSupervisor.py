@@ -0,0 +1,141 @@
+import asyncio
+import os
+import gc
+import signal
+import time
+import multiprocessing
+import multiprocessing.connection
+import traceback
+from .Backoff import Backoff
+
+class NodeSupervisor:
+    """
+    Runs a node in several forked worker processes, each one with its own event loop
+    and pool connection, and respawns the workers that crash.
+    The workers poll the same jobs, each one takes the jobs whose id hashes to its index.
+    The runners are initialized once in the supervisor before forking, so the state
+    loaded by JobRunner.init (eg. models) is shared copy-on-write by all the workers.
+    The supervisor can be configured with the following environment variables:
+    - NODE_WORKER_READY_TIMEOUT: How long in seconds to wait for the workers to start. Defaults to 60.
+    - NODE_WORKER_STOP_TIMEOUT: How long in seconds to wait for the workers to stop gracefully. Defaults to 30.
+    """
+
+    def __init__(self, node, workers:int):
+        """
+        Create a new supervisor.
+        Args:
+            node (OpenAgentsNode): The node to run.
+            workers (int): The number of worker processes.
+        """
+        self.node = node
+        self.workers = workers
+        self.mpContext = multiprocessing.get_context("fork")
+        self.processes = [None]*workers
+        self.backoffs = [Backoff("worker"+str(i), node.backoffBase, node.backoffMax) for i in range(workers)]
+        self.nextSpawn = [0.0]*workers
+        self.spawnedAt = [0.0]*workers
+        self.readyQueue = None
+        self.stopping = False
+        self.readyTimeout = float(os.getenv('NODE_WORKER_READY_TIMEOUT', "60"))
+        self.stopTimeout = float(os.getenv('NODE_WORKER_STOP_TIMEOUT', "30"))
+
+    def _initRunners(self):
+        async def init():
+            for reg in self.node.registeredRunners:
+                await self.node._initRunner(reg["runner"])
+            # connections can't be shared with forked processes
+            await self.node._channelPool.close()
+        asyncio.run(init())
+        # keep the objects loaded so far out of the garbage collector, so the
+        # workers don't touch (and copy) the shared pages
+        gc.freeze()
+
+    def _spawn(self, index:int, poolAddress:str, poolPort:int):
+        process = self.mpContext.Process(
+            target=self.node._runWorker,
+            args=(index, self.readyQueue, poolAddress, poolPort, self.workers),
+            name=self.node.nodeName+"-worker"+str(index),
+            daemon=False
+        )
+        process.start()
+        self.processes[index] = process
+        self.spawnedAt[index] = time.monotonic()
+        self.node.getLogger().info("Started worker "+str(index)+" with pid "+str(process.pid))
+
+    def _waitReady(self):
+        ready = 0
+        deadline = time.monotonic() + self.readyTimeout
+        while ready < self.workers and time.monotonic() < deadline:
+            if self.readyQueue.empty():
+                time.sleep(0.05)
+                continue
+            index, pid = self.readyQueue.get()
+            ready += 1
+            self.node.getLogger().finer("Worker "+str(index)+" ("+str(pid)+") ready")
+        if ready < self.workers:
+            self.node.getLogger().warn(str(self.workers-ready)+" workers didn't start in "+str(self.readyTimeout)+" seconds")
+        else:
+            self.node.getLogger().info("All "+str(self.workers)+" workers are ready")
+
+    def _stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def _shutdown(self):
+        self.node.getLogger().info("Stopping workers")
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                # SIGINT cancels the main task of the worker event loop
+                os.kill(process.pid, signal.SIGINT)
+        deadline = time.monotonic() + self.stopTimeout
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0, deadline - time.monotonic()))
+                if process.is_alive():
+                    self.node.getLogger().warn("Killing worker "+process.name)
+                    process.kill()
+                    process.join()
+
+    def run(self, poolAddress:str=None, poolPort:int=None):
+        """
+        Start the workers and supervise them until the supervisor receives SIGINT or SIGTERM.
+        Args:
+            poolAddress (str): The address of the pool.
+            poolPort (int): The port of the pool.
+        """
+        # JobRunner.init can use the pool connection, like in a single process node
+        self.node._setPool(poolAddress, poolPort)
+        self._initRunners()
+        self.readyQueue = self.mpContext.SimpleQueue()
+        previousHandlers = {
+            signal.SIGTERM: signal.signal(signal.SIGTERM, self._stop),
+            signal.SIGINT: signal.signal(signal.SIGINT, self._stop),
+        }
+        try:
+            for i in range(self.workers):
+                self._spawn(i, poolAddress, poolPort)
+            self._waitReady()
+            while not self.stopping:
+                sentinels = [p.sentinel for p in self.processes if p is not None and p.is_alive()]
+                multiprocessing.connection.wait(sentinels, timeout=1.0)
+                now = time.monotonic()
+                for i, process in enumerate(self.processes):
+                    if self.stopping:
+                        break
+                    if process is not None and process.is_alive():
+                        continue
+                    if process is not None:
+                        self.node.getLogger().error("Worker "+str(i)+" exited with code "+str(process.exitcode))
+                        self.processes[i] = None
+                        # a worker that ran for a while is not crash looping
+                        if (now - self.spawnedAt[i])*1000 > self.backoffs[i].cap:
+                            self.backoffs[i].reset()
+                        self.nextSpawn[i] = now + self.backoffs[i].next()/1000.0
+                    if now >= self.nextSpawn[i]:
+                        self._spawn(i, poolAddress, poolPort)
+        except Exception as e:
+            traceback.print_exc()
+            self.node.getLogger().error("Error supervising workers "+str(e))
+        finally:
+            self._shutdown()
+            for signum, handler in previousHandlers.items():
+                signal.signal(signum, handler)
@@ -5,12 +5,42 @@ import time
 import os
 import traceback
 import asyncio
+import signal
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from .JobRunner import JobRunner
 from .NodeConfig import NodeConfig
 from .Logger import Logger
 from typing import Union
 from .JobContext import JobContext
+from .ProcessPool import ProcessPool
+from .BatchCollector import BatchCollector
+from .JobLeases import JobLeases
+from .JobDispatcher import JobDispatcher
+from .JobPrefetcher import JobPrefetcher
+from .LoopScheduler import LoopScheduler
+from .Backoff import Backoff
+from .NodeSupervisor import NodeSupervisor
+from .ChannelPool import ChannelPool
+from .JobLogBuffer import JobLogBuffer
+from .CompletionOutbox import CompletionOutbox
+from .MetricsRegistry import MetricsRegistry
+from .Tracer import Tracer, JsonLinesExporter
+from .JobProfiler import JobProfiler
+from .JobRecorder import JobRecorder
+from .LoopMonitor import LoopMonitor
+from .LocalCache import LocalCache
+import random
+import zlib
+from collections import OrderedDict
 import json
+
+# lower bound of the announcement interval, in case the pool asks for an immediate refresh
+MIN_ANNOUNCE_INTERVAL = 1000
+# how many fetched jobs remember when they were fetched, for their traces
+MAX_FETCH_TIMES = 1000
+
 class HeaderAdderInterceptor(
     grpc.aio.ClientInterceptor     
 ):
@@ -62,22 +92,131 @@ class OpenAgentsNode:
     - POOL_SSL: Whether to use SSL for the pool. Defaults to False.
     - NODE_TPS: The ticks per second of the node main loop. Defaults to 10.
     - NODE_TOKEN: The token of the node. Defaults to None.
+    - NODE_MAX_PARALLEL_JOBS: The maximum number of jobs running at the same time on the node, 0 = unlimited. Defaults to 0.
+    - NODE_JOB_LEASE_TTL: How long in milliseconds a picked up job is excluded from the next polls. Defaults to 60000.
+    - NODE_MAX_EXCLUDED_JOBS: The maximum number of job ids excluded in each poll request. Defaults to 1000.
+    - NODE_SHARED_POLL: If "true" the node uses a single long-poll for all the runners and routes the jobs locally. Defaults to false.
+    - NODE_PREFETCH_JOBS: The number of jobs fetched in advance for serial runners while they are running a job, 0 = disabled. Defaults to 0.
+    - NODE_BACKOFF_BASE: The maximum delay in milliseconds of the first retry after a failed poll, announce or connection. Defaults to 1000.
+    - NODE_BACKOFF_MAX: The maximum delay in milliseconds between retries. Defaults to 60000.
+    - NODE_EVENT_LOOP: The event loop implementation, "asyncio" or "uvloop" (requires the uvloop package). Defaults to "asyncio".
+    - NODE_THREAD_POOL_SIZE: The number of threads used to run synchronous runner hooks. Defaults to min(32, cpus + 4).
+    - NODE_PROCESS_POOL_SIZE: The number of worker processes of the runners that run their jobs in processes (see JobRunner.setRunInProcess), unless the runner sets its own. Defaults to the number of cpus.
+    - NODE_PROCESS_START_METHOD: The multiprocessing start method of those worker processes, "fork", "spawn" or "forkserver". Defaults to "fork" when available, "spawn" otherwise.
+    - NODE_BULK_CHANNELS: The number of dedicated connections for disk and cache transfers, 0 = use the control connection. Defaults to 1.
+    - NODE_KEEPALIVE_TIME: The interval in milliseconds of the keepalive pings on the pool connections. Defaults to 30000.
+    - NODE_KEEPALIVE_TIMEOUT: How long in milliseconds to wait for a keepalive ping response before closing the connection. Defaults to 10000.
+    - NODE_RECONNECT_TIMEOUT: How long in milliseconds a failing pool connection is retried before it is rebuilt. Defaults to 20000.
+    - NODE_ANNOUNCE_CONCURRENCY: The maximum number of announcements sent at the same time. Defaults to 8.
+    - NODE_LOG_FLUSH_INTERVAL: The maximum time in milliseconds a job log line is buffered before being sent to the pool. Defaults to 200.
+    - NODE_LOG_BATCH_BYTES: The maximum size in bytes of the job log lines sent in a single call. Defaults to 65536.
+    - NODE_LOG_BUFFER_BYTES: The maximum size in bytes of the buffered log lines of a job, the lines over the limit are dropped. Defaults to 1048576.
+    - NODE_OUTBOX_RETRIES: The maximum number of retries to complete or cancel a job. Defaults to 8.
+    - NODE_OUTBOX_SPILL_PATH: The directory where the results that couldn't be delivered to the pool are saved and sent again later. Defaults to None (disabled).
+    - NODE_SHUTDOWN_TIMEOUT: How long in milliseconds the node waits on shutdown for the results of the finished jobs to be delivered, the ones left are spilled (see NODE_OUTBOX_SPILL_PATH). Defaults to 10000.
+    - NODE_METRICS_PORT: The port of the local HTTP endpoint exposing the metrics in the Prometheus text format, 0 = disabled. With several workers, each worker uses the next port. Defaults to 0.
+    - NODE_METRICS_HOST: The address of the metrics endpoint. Defaults to "127.0.0.1".
+    - NODE_WORKERS: The number of forked worker processes running the node, 1 = run in the current process. Each job is run by a single worker, picked by the hash of its id. Defaults to 1.
+    - NODE_TRACE_FILE: The file where the spans of the jobs are appended as JSON lines, tracing is disabled if not set and no exporter is added. Defaults to None.
+    - NODE_PROFILE_RATE: The fraction of the jobs profiled, for the runners that don't set their own (see JobRunner.setProfileRate), 0 = disabled. Defaults to 0.
+    - NODE_PROFILE_PARAM: The name of a job param that enables profiling when set to "true", eg. "profile". Defaults to None (disabled).
+    - NODE_PROFILE_PATH: The directory where the profiles of the jobs are saved. Defaults to CACHE_PATH/profiles.
+    - NODE_PROFILE_DISK: The URL of a disk where the profiles are uploaded to <job id>/, instead of being kept on the local filesystem. Defaults to None.
+    - NODE_LOOP_LAG_THRESHOLD: How long in milliseconds the event loop must be blocked to report the stall, with the stack and the runner and job that caused it, 0 = disabled. Defaults to 250.
+    - NODE_RECORD_FILE: The file where the received jobs and their disk and cache transfers are recorded, to be replayed with benchmarks/replay.py (gzip compressed if it ends with .gz). With several workers, the index of the worker is added to the name of the file. Defaults to None (disabled).
+    - NODE_CACHE_MAX_BYTES: The byte budget of the local cache (see JobContext.cacheSet), the least recently used entries are evicted over it, 0 = unlimited. Defaults to 1073741824.
+    - NODE_CACHE_CLEANUP_INTERVAL: The interval in milliseconds of the removal of the expired entries of the local cache. Defaults to 60000.
     - NWC: Nostr wallet connect URL
     """
   
     def __init__(self, config: NodeConfig):
+        self.config = config
         self.meta = config.getMeta()
             
         self.nextNodeAnnounce = 0        
-        self.channel = None
-        self.rpcClient = None
+        self.bulkChannels = config.getOption("bulkChannels", "NODE_BULK_CHANNELS", 1)
+        self.keepaliveTime = config.getOption("keepaliveTime", "NODE_KEEPALIVE_TIME", 30000)
+        self.keepaliveTimeout = config.getOption("keepaliveTimeout", "NODE_KEEPALIVE_TIMEOUT", 10000)
+        self.reconnectTimeout = config.getOption("reconnectTimeout", "NODE_RECONNECT_TIMEOUT", 20000)
+        self._channelPool = ChannelPool(self, self.bulkChannels, self.reconnectTimeout)
         self.registeredRunners=[]
         self.poolAddress = None
         self.poolPort = None
-        self.lockedJobs = []
+        self.lockedJobs = JobLeases(
+            config.getOption("jobLeaseTtl", "NODE_JOB_LEASE_TTL", 60000),
+            config.getOption("maxExcludedJobs", "NODE_MAX_EXCLUDED_JOBS", 1000)
+        )
         self.isLooping = False
         self.logger = None
         self.loopInterval = 100
+        self.maxParallelJobs = config.getOption("maxParallelJobs", "NODE_MAX_PARALLEL_JOBS", 0)
+        self.runningJobs = 0
+        self._slotsCondition = asyncio.Condition()
+        self._processPools = {}
+        self._batchCollectors = {}
+        self.sharedPolling = config.getOption("sharedPolling", "NODE_SHARED_POLL", False)
+        self._jobDispatcher = JobDispatcher(self)
+        self._dispatcherTask = None
+        self.prefetchJobs = config.getOption("prefetchJobs", "NODE_PREFETCH_JOBS", 0)
+        self._prefetchers = {}
+        self._loopSchedulers = {}
+        self._announceTask = None
+        self._runnersChanged = asyncio.Event()
+        self._announceWake = asyncio.Event()
+        self.announceConcurrency = config.getOption("announceConcurrency", "NODE_ANNOUNCE_CONCURRENCY", 8)
+        self._announceSemaphore = asyncio.Semaphore(max(1, self.announceConcurrency))
+        self.backoffBase = config.getOption("backoffBase", "NODE_BACKOFF_BASE", 1000)
+        self.backoffMax = config.getOption("backoffMax", "NODE_BACKOFF_MAX", 60000)
+        self._backoffs = {}
+        self.logFlushInterval = config.getOption("logFlushInterval", "NODE_LOG_FLUSH_INTERVAL", 200)
+        self.logBatchBytes = config.getOption("logBatchBytes", "NODE_LOG_BATCH_BYTES", 64*1024)
+        self.logBufferBytes = config.getOption("logBufferBytes", "NODE_LOG_BUFFER_BYTES", 1024*1024)
+        self._logBuffers = {}
+        self.droppedJobLogs = 0
+        self._outbox = CompletionOutbox(
+            self,
+            config.getOption("outboxRetries", "NODE_OUTBOX_RETRIES", 8),
+            config.getOption("outboxSpillPath", "NODE_OUTBOX_SPILL_PATH", None)
+        )
+        self.shutdownTimeout = config.getOption("shutdownTimeout", "NODE_SHUTDOWN_TIMEOUT", 10000)
+        self._channelPool.addStateListener(self._onConnectionStateChange)
+        self.metrics = MetricsRegistry.getDefault()
+        self.metricsPort = config.getOption("metricsPort", "NODE_METRICS_PORT", 0)
+        self.metricsHost = config.getOption("metricsHost", "NODE_METRICS_HOST", "127.0.0.1")
+        self._pollDuration = self.metrics.histogram("poll_duration_seconds", "Duration of the polls for pending jobs", ("poller",))
+        self._jobsPerPoll = self.metrics.histogram("poll_jobs", "Jobs returned by each poll", ("poller",), (0, 1, 2, 5, 10, 20, 50, 100))
+        self._jobStartDelay = self.metrics.histogram("job_start_delay_seconds", "Time from the acceptance of a job to the start of its run", ("runner",))
+        self._jobRunDuration = self.metrics.histogram("job_run_duration_seconds", "Duration of the run of the jobs", ("runner",))
+        self._jobsTotal = self.metrics.counter("jobs_total", "Finished jobs", ("runner", "status"))
+        self._jobsInFlight = self.metrics.gauge("jobs_in_flight", "Jobs holding a slot of the node", ("runner",))
+        self.metrics.gauge("log_queue_depth", "Log lines waiting to be sent", ("queue",)).labels(queue="job").setFunction(
+            lambda: sum(len(buffer.lines) for buffer in list(self._logBuffers.values()))
+        )
+        self.tracer = Tracer()
+        traceFile = config.getOption("traceFile", "NODE_TRACE_FILE", None)
+        if traceFile:
+            self.tracer.addExporter(JsonLinesExporter(traceFile))
+        # when the jobs were fetched, for their traces
+        self._fetchTimes = OrderedDict()
+        self.profileRate = config.getOption("profileRate", "NODE_PROFILE_RATE", 0.0)
+        self.profileParam = config.getOption("profileParam", "NODE_PROFILE_PARAM", None)
+        self.profilePath = config.getOption("profilePath", "NODE_PROFILE_PATH", os.path.join(os.getenv("CACHE_PATH", "cache"), "profiles"))
+        self.profileDisk = config.getOption("profileDisk", "NODE_PROFILE_DISK", None)
+        self.recorder = JobRecorder(config.getOption("recordFile", "NODE_RECORD_FILE", None))
+        self.loopLagThreshold = config.getOption("loopLagThreshold", "NODE_LOOP_LAG_THRESHOLD", 250)
+        self._loopMonitor = LoopMonitor(self, self.loopLagThreshold)
+        self.cacheMaxBytes = config.getOption("cacheMaxBytes", "NODE_CACHE_MAX_BYTES", 1024*1024*1024)
+        self.cacheCleanupInterval = config.getOption("cacheCleanupInterval", "NODE_CACHE_CLEANUP_INTERVAL", 60000)
+        self._localCache = None
+        self.threadPoolSize = config.getOption("threadPoolSize", "NODE_THREAD_POOL_SIZE", min(32, (os.cpu_count() or 1) + 4))
+        self._threadPool = None
+        self.processPoolSize = config.getOption("processPoolSize", "NODE_PROCESS_POOL_SIZE", os.cpu_count() or 1)
+        self.processStartMethod = config.getOption("processStartMethod", "NODE_PROCESS_START_METHOD", "")
+        self.loop = None
+        self.workers = config.getOption("workers", "NODE_WORKERS", 1)
+        self.workerIndex = 0
+        # the number of workers sharing the pool jobs, set in the forked workers
+        self.workerCount = 1
         
         self.NWC = os.getenv('NWC', None)
         if self.NWC and "prices" not in self.meta:
@@ -94,8 +233,6 @@ class OpenAgentsNode:
         self.nodeVersion =  self.meta["version"]
         self.nodeDescription =  self.meta["description"]
 
-        self.channel = None
-        self.rpcClient = None
         self.logger = Logger(self.nodeName,self.nodeVersion)
         self.logger.info("Starting "+self.nodeName+" v"+self.nodeVersion)
 
@@ -108,10 +245,14 @@ class OpenAgentsNode:
         Args:
             runner (JobRunner): The runner to register.
         """
+        runner._node = self
         self.registeredRunners.append({
             "runner": runner,
             "nextAnnouncementTimestamp": 0    
         })
+        self._jobDispatcher.invalidate()
+        self._runnersChanged.set()
+        self._announceWake.set()
 
     def getLogger(self):
         """
@@ -119,54 +260,112 @@ class OpenAgentsNode:
         """
         return self.logger        
 
-    def _getClient(self): 
+    def _getBackoff(self, name:str, base:float=None, cap:float=None) -> Backoff:
         """
-        Get or create a GRPC client for the node.
+        Get or create a named backoff policy.
+        Args:
+            name (str): The name of the backoff (eg. "poll.MyRunner").
+            base (float): Optional: The delay of the first retry in milliseconds. Defaults to NODE_BACKOFF_BASE.
+            cap (float): Optional: The maximum delay in milliseconds. Defaults to NODE_BACKOFF_MAX.
+        Returns:
+            Backoff: The backoff.
         """
-        if self.channel is None or self.channel._channel.check_connectivity_state(True)  == grpc.ChannelConnectivity.SHUTDOWN:
-            if self.channel is not None:
-                try:
-                    self.getLogger().info("Closing channel")
-                    self.channel.close()
-                except Exception as e:
-                    self.getLogger().error("Error closing channel "+str(e))
-            self.getLogger().info("Connect to "+self.poolAddress+":"+str(self.poolPort)+" with ssl "+str(self.poolSsl))
-            
-            options=[
-                # 20 MB
-                ('grpc.max_send_message_length', 1024*1024*20),
-                ('grpc.max_receive_message_length', 1024*1024*20)
-            ]
+        backoff = self._backoffs.get(name)
+        if backoff is None:
+            backoff = Backoff(name, base if base is not None else self.backoffBase, cap if cap is not None else self.backoffMax)
+            self._backoffs[name] = backoff
+        return backoff
 
-            interceptors=None
-            nodeToken = os.getenv('NODE_TOKEN', None)
-            nwc = self.NWC
-            if nodeToken or nwc:
-                metadata=[]
-                if nwc:
-                    metadata.append(("nwc", str(nwc)))                
-                if nodeToken:
-                    metadata.append(("authorization", str(nodeToken)))                    
-                if interceptors is None: interceptors=[]
-                interceptors.append(HeaderAdderInterceptor0(metadata))
-                interceptors.append(HeaderAdderInterceptor1(metadata))
-                interceptors.append(HeaderAdderInterceptor2(metadata))
-                interceptors.append(HeaderAdderInterceptor3(metadata))
-                
+    def getBackoffState(self) -> dict:
+        """
+        Get the state of the backoff policies of the node.
+        Returns:
+            dict: The state of each backoff by name (see Backoff.getState).
+        """
+        return {name: backoff.getState() for name, backoff in self._backoffs.items()}
+
+    def _connect(self, extraOptions:list=[], extraInterceptors:list=[]):
+        """
+        Create a new GRPC channel to the pool.
+        Args:
+            extraOptions (list): Additional channel options.
+            extraInterceptors (list): Additional interceptors.
+        Returns:
+            grpc.aio.Channel: The channel.
+        """
+        self.getLogger().info("Connect to "+self.poolAddress+":"+str(self.poolPort)+" with ssl "+str(self.poolSsl))
+        
+        options=[
+            # 20 MB
+            ('grpc.max_send_message_length', 1024*1024*20),
+            ('grpc.max_receive_message_length', 1024*1024*20),
+            # grpc reconnects with its own jittered exponential backoff
+            ('grpc.initial_reconnect_backoff_ms', int(self.backoffBase)),
+            ('grpc.max_reconnect_backoff_ms', int(self.backoffMax)),
+            # detect half-dead connections without waiting for a call to time out
+            ('grpc.keepalive_time_ms', int(self.keepaliveTime)),
+            ('grpc.keepalive_timeout_ms', int(self.keepaliveTimeout)),
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0)
+        ]+extraOptions
+
+        interceptors=list(extraInterceptors)
+        nodeToken = os.getenv('NODE_TOKEN', None)
+        nwc = self.NWC
+        if nodeToken or nwc:
+            metadata=[]
             if nwc:
-                self.getLogger().info("This node can receive payments")
-            else: 
-                self.getLogger().warn("This node is not enabled to receive payments. Please provide a NWC URL")
-                
-            if self.poolSsl:
-                self.channel = grpc.aio.secure_channel(self.poolAddress+":"+str(self.poolPort), grpc.ssl_channel_credentials(),options,interceptors=interceptors)
-            else:
-                self.channel = grpc.aio.insecure_channel(self.poolAddress+":"+str(self.poolPort),options,interceptors=interceptors)
+                metadata.append(("nwc", str(nwc)))                
+            if nodeToken:
+                metadata.append(("authorization", str(nodeToken)))                    
+            interceptors.append(HeaderAdderInterceptor0(metadata))
+            interceptors.append(HeaderAdderInterceptor1(metadata))
+            interceptors.append(HeaderAdderInterceptor2(metadata))
+            interceptors.append(HeaderAdderInterceptor3(metadata))
             
-            self.rpcClient = rpc_pb2_grpc.PoolConnectorStub(self.channel)
+        if nwc:
+            self.getLogger().info("This node can receive payments")
+        else: 
+            self.getLogger().warn("This node is not enabled to receive payments. Please provide a NWC URL")
             
+        if self.poolSsl:
+            return grpc.aio.secure_channel(self.poolAddress+":"+str(self.poolPort), grpc.ssl_channel_credentials(),options,interceptors=interceptors)
+        else:
+            return grpc.aio.insecure_channel(self.poolAddress+":"+str(self.poolPort),options,interceptors=interceptors)
 
-        return self.rpcClient
+    def _getClient(self): 
+        """
+        Get or create the GRPC client of the control channel, for the latency sensitive RPCs.
+        """
+        return self._channelPool.getControlClient()
+
+    def _getBulkClient(self):
+        """
+        Get or create a GRPC client of a bulk channel, for the disk and cache transfers.
+        """
+        return self._channelPool.getBulkClient()
+
+    def addConnectionListener(self, listener):
+        """
+        Add a listener of the connectivity state changes of the pool connections.
+        Args:
+            listener (callable): A function called with the channel name, the previous state and
+                the new state (grpc.ChannelConnectivity).
+        """
+        self._channelPool.addStateListener(listener)
+
+    def _onConnectionStateChange(self, name:str, previous, state):
+        if name == "control" and state == grpc.ChannelConnectivity.READY and self._outbox.spillPath:
+            # the pool is reachable again
+            asyncio.create_task(self._outbox.resendSpilled())
+
+    def getChannelStats(self) -> dict:
+        """
+        Get the traffic stats of the pool connections.
+        Returns:
+            dict: The stats of each channel by name (see ChannelStats.getStats).
+        """
+        return self._channelPool.getStats()
 
     async def _logToJob(self, message:str, jobId:str=None):
         """
@@ -180,6 +379,28 @@ class OpenAgentsNode:
         except Exception as e:
             print("Error logging to job "+str(e))
 
+    def _openLogBuffer(self, jobId:str) -> JobLogBuffer:
+        """
+        Start buffering the logs of a job.
+        Args:
+            jobId (str): The ID of the job.
+        Returns:
+            JobLogBuffer: The buffer.
+        """
+        buffer = JobLogBuffer(self, jobId, self.logFlushInterval, self.logBatchBytes, self.logBufferBytes)
+        self._logBuffers[jobId] = buffer
+        return buffer
+
+    async def _closeLogBuffer(self, jobId:str):
+        """
+        Flush and remove the log buffer of a job.
+        Args:
+            jobId (str): The ID of the job.
+        """
+        buffer = self._logBuffers.pop(jobId, None)
+        if buffer is not None:
+            await buffer.close()
+
     def _log(self,message:str, jobId:str=None):
         """
         Log a message to the network.
@@ -188,7 +409,19 @@ class OpenAgentsNode:
             jobId (str): The ID of the job to log to.
         """
         if jobId: 
-            asyncio.create_task(self._logToJob(message, jobId))
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                # called from a synchronous hook running on the thread pool
+                if self.loop:
+                    self.loop.call_soon_threadsafe(self._log, message, jobId)
+                return
+            buffer = self._logBuffers.get(jobId)
+            if buffer is not None:
+                buffer.add(message)
+            else:
+                # the job context is already closed
+                asyncio.create_task(self._logToJob(message, jobId))
     
     async def _acceptJob(self, jobId:str):
         """
@@ -198,28 +431,286 @@ class OpenAgentsNode:
         """
         await self._getClient().acceptJob(rpc_pb2.RpcAcceptJob(jobId=jobId))
 
-    async def _executePendingJobForRunner(self , runner:JobRunner):
+    def _hasFreeSlot(self, runner:JobRunner) -> bool:
         """
-        Execute all pending jobs for a runner.
+        Check if the node and the runner have room for another in-flight job.
         Args:
-            runner (JobRunner): The runner to execute the job.
+            runner (JobRunner): The runner.
         """
-        if len([x for x in self.registeredRunners if x["runner"]==runner])==0:
-            del self.runnerTasks[runner]
+        if self.maxParallelJobs > 0 and self.runningJobs >= self.maxParallelJobs:
+            return False
+        maxRunnerJobs = runner.maxParallelJobs
+        if maxRunnerJobs <= 0 and not runner.isRunInParallel():
+            # serial runners run one job at a time, 
+            # serial batching runners buffer at most the running batch and the next one
+            maxRunnerJobs = runner.maxBatchSize*2 if runner.maxBatchSize > 1 else 1
+        if maxRunnerJobs > 0 and runner.runningJobs >= maxRunnerJobs:
+            return False
+        return True
+
+    async def _waitForFreeSlot(self, runner:JobRunner):
+        """
+        Wait until the node and the runner have room for another in-flight job.
+        Args:
+            runner (JobRunner): The runner.
+        """
+        if self._hasFreeSlot(runner):
             return
-        
+        self.getLogger().finer("Concurrency limit reached for "+runner.__class__.__name__+", waiting for a free slot")
+        async with self._slotsCondition:
+            await self._slotsCondition.wait_for(lambda: self._hasFreeSlot(runner))
+
+    def _acquireSlot(self, runner:JobRunner):
+        self.runningJobs += 1
+        runner.runningJobs += 1
+        self._jobsInFlight.labels(runner=runner.__class__.__name__).inc()
+
+    async def _releaseSlot(self, runner:JobRunner):
+        self.runningJobs -= 1
+        runner.runningJobs -= 1
+        self._jobsInFlight.labels(runner=runner.__class__.__name__).dec()
+        if self.sharedPolling:
+            self._jobDispatcher.onSlotReleased()
+        async with self._slotsCondition:
+            self._slotsCondition.notify_all()
+
+    def _getThreadPool(self) -> ThreadPoolExecutor:
+        """
+        Get or create the thread pool used to run synchronous runner hooks.
+        """
+        if self._threadPool is None:
+            self._threadPool = ThreadPoolExecutor(max_workers=self.threadPoolSize, thread_name_prefix="runner")
+        return self._threadPool
+
+    async def _callHook(self, hook, ctx:JobContext):
+        """
+        Call a runner hook, on the thread pool if it is a synchronous method.
+        Args:
+            hook: The bound hook (eg. runner.preRun).
+            ctx (JobContext): The context of the job.
+        Returns:
+            The value returned by the hook.
+        """
+        profiler = getattr(ctx, "profiler", None)
+        if profiler is not None:
+            return await profiler.call(hook, self._getThreadPool(), ctx)
+        if asyncio.iscoroutinefunction(hook):
+            return await hook(ctx)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._getThreadPool(), functools.partial(contextvars.copy_context().run, hook, ctx))
+
+    async def _runJob(self, runner:JobRunner, ctx:JobContext):
+        """
+        Call the run method of the runner, in a worker process if the runner is configured to do so.
+        Args:
+            runner (JobRunner): The runner.
+            ctx (JobContext): The context of the job.
+        Returns:
+            The output of the job.
+        """
+        if runner.isRunInProcess():
+            pool = self._processPools.get(runner)
+            if pool is None:
+                pool = ProcessPool(self, runner, runner.processPoolSize)
+                self._processPools[runner] = pool
+            return await pool.run(ctx)
+        return await self._callHook(runner.run, ctx)
+
+    async def _finishJob(self, runner:JobRunner, ctx:JobContext, t:float):
+        """
+        Run an accepted job, then complete or cancel it and release its slot.
+        Args:
+            runner (JobRunner): The runner.
+            ctx (JobContext): The context of the job.
+            t (float): The time the job was picked up.
+        """
+        name = runner.__class__.__name__
+        start = time.time()
+        self._jobStartDelay.labels(runner=name).observe(start - (ctx.acceptedAt or t))
+        span = self.tracer.startSpan("run", ctx.span)
+        with self.tracer.activate(span), self.recorder.activate(ctx.getJob().id):
+            try:
+                output = await self._runJob(runner, ctx)
+            except Exception as e:
+                output = e
+        error = output if isinstance(output, Exception) else None
+        span.end(error)
+        end = time.time()
+        self._jobRunDuration.labels(runner=name).observe(end - start)
+        self.recorder.recordRun(ctx.getJob().id, start, end, error)
+        await self._endJob(runner, ctx, t, output)
+
+    async def _finishBatch(self, runner:JobRunner, batch:list):
+        """
+        Run a batch of accepted jobs, then complete or cancel each of them.
+        Args:
+            runner (JobRunner): The runner.
+            batch (list): The (JobContext, pick up time) pairs of the jobs.
+        """
+        ctxs = [x[0] for x in batch]
+        name = runner.__class__.__name__
+        start = time.time()
+        for ctx, t in batch:
+            self._jobStartDelay.labels(runner=name).observe(start - (ctx.acceptedAt or t))
         try:
-            if not runner.initialized:
-                runner.initialized=True
-                await runner.init(self)
-            client = self._getClient()
-            jobs=[]
-            filter = runner.getFilter()
-            meta = runner.getMeta()
-            prices = "prices" in meta and meta["prices"] or None
+            if type(runner).runBatch is JobRunner.runBatch:
+                # each job takes the path of the unbatched jobs (thread pool for a synchronous run, process pool)
+                outputs = await asyncio.gather(*[self._runJob(runner, ctx) for ctx in ctxs], return_exceptions=True)
+            else:
+                outputs = await self._callHook(runner.runBatch, ctxs)
+            if outputs is None or len(outputs) != len(ctxs):
+                raise Exception("runBatch returned "+str(len(outputs or []))+" outputs for "+str(len(ctxs))+" jobs")
+        except Exception as e:
+            outputs = [e]*len(ctxs)
+        end = time.time()
+        for ctx, output in zip(ctxs, outputs):
+            self._jobRunDuration.labels(runner=name).observe(end - start)
+            error = output if isinstance(output, Exception) else None
+            self.tracer.recordSpan("run", start, end, {"batchSize": len(ctxs)}, error, ctx.span)
+            self.recorder.recordRun(ctx.getJob().id, start, end, error)
+        await asyncio.gather(*[self._endJob(runner, ctx, t, output) for (ctx, t), output in zip(batch, outputs)])
 
-            self.lockedJobs = [x for x in self.lockedJobs if time.time()-x[1] < 60]
-            jobs.extend((await client.getPendingJobs(rpc_pb2.RpcGetPendingJobs(
+    async def _endJob(self, runner:JobRunner, ctx:JobContext, t:float, output):
+        """
+        Run postRun, then queue the completion of the job, or its cancellation if output is an exception.
+        Release the slot of the job and close its context.
+        Args:
+            runner (JobRunner): The runner.
+            ctx (JobContext): The context of the job.
+            t (float): The time the job was picked up.
+            output: The output of the job or the exception that made it fail.
+        """
+        job = ctx.getJob()
+        error = None
+        try:
+            try:
+                if isinstance(output, Exception):
+                    raise output
+                with self.tracer.activate(ctx.span), self.tracer.span("postRun"), self.recorder.activate(job.id):
+                    await self._callHook(runner.postRun, ctx)
+                ctx.getLogger().info("Job completed in "+str(time.time()-t)+" seconds on node "+self.nodeName, job.id)                
+                self._outbox.complete(job.id, output, self.tracer.startSpan("complete", ctx.span))
+                self._jobsTotal.labels(runner=runner.__class__.__name__, status="completed").inc()
+            except Exception as e:
+                error = e
+                ctx.getLogger().error("Job failed in "+str(time.time()-t)+" seconds on node "+self.nodeName+" with error "+str(e), job.id)
+                self._outbox.cancel(job.id, str(e), self.tracer.startSpan("cancel", ctx.span))
+                self._jobsTotal.labels(runner=runner.__class__.__name__, status="failed").inc()
+                traceback.print_exc()
+        finally:
+            # the outbox delivers the result, the slot is free for the next job
+            await self._releaseSlot(runner)
+        if ctx.profiler is not None:
+            await self._saveProfile(ctx)
+        try:
+            await ctx.close()
+        except Exception as e:
+            self.getLogger().error("Error closing job context "+str(e))
+        ctx.span.end(error)
+
+    def _shouldProfile(self, runner:JobRunner, ctx:JobContext) -> bool:
+        """
+        Check if a job must be profiled, by the profile rate of its runner or of the node, or by its params.
+        Args:
+            runner (JobRunner): The runner.
+            ctx (JobContext): The context of the job.
+        """
+        if runner.maxBatchSize > 1:
+            return False
+        rate = runner.profileRate or self.profileRate
+        if rate > 0 and random.random() < rate:
+            return True
+        if self.profileParam:
+            values = ctx.getJobParamValues(self.profileParam, [])
+            return len(values) > 0 and values[0].lower() == "true"
+        return False
+
+    async def _saveProfile(self, ctx:JobContext):
+        """
+        Save the profile of a job to NODE_PROFILE_PATH, or upload it to NODE_PROFILE_DISK.
+        Args:
+            ctx (JobContext): The context of the job.
+        """
+        jobId = ctx.getJob().id
+        try:
+            loop = asyncio.get_running_loop()
+            paths = await loop.run_in_executor(self._getThreadPool(), ctx.profiler.save, self.profilePath)
+            if self.profileDisk:
+                disk = await ctx.openStorage(self.profileDisk)
+                for path in paths:
+                    with open(path, "rb") as f:
+                        await disk.writeBytes(jobId+"/profile"+os.path.splitext(path)[1], f.read())
+                    os.remove(path)
+                ctx.getLogger().info("Profile uploaded to "+self.profileDisk+" "+jobId+"/profile.prof")
+            else:
+                ctx.getLogger().info("Profile saved to "+paths[0])
+        except Exception as e:
+            traceback.print_exc()
+            self.getLogger().error("Error saving profile of job "+jobId+" "+str(e))
+
+    def getMetrics(self) -> MetricsRegistry:
+        """
+        Get the metrics registry of the node.
+        Returns:
+            MetricsRegistry: The registry (see MetricsRegistry.expose for the text format).
+        """
+        return self.metrics
+
+    def addTraceExporter(self, exporter):
+        """
+        Add an exporter of the spans of the jobs, this enables tracing.
+        Args:
+            exporter: A function called with each ended span as a dictionary (see Span.toDict),
+                or an exporter object (eg. JsonLinesExporter).
+        """
+        self.tracer.addExporter(exporter)
+
+    def removeTraceExporter(self, exporter):
+        """
+        Remove an exporter added with addTraceExporter.
+        Args:
+            exporter: The exporter.
+        """
+        self.tracer.removeExporter(exporter)
+
+    def getOutboxStats(self) -> dict:
+        """
+        Get the stats of the delivery of the job results.
+        Returns:
+            dict: The stats of the outbox (see CompletionOutbox.getStats).
+        """
+        return self._outbox.getStats()
+
+    def _getBatchCollector(self, runner:JobRunner) -> BatchCollector:
+        collector = self._batchCollectors.get(runner)
+        if collector is None:
+            collector = BatchCollector(
+                runner.maxBatchSize, 
+                runner.maxBatchWait, 
+                lambda batch: self._finishBatch(runner, batch),
+                serial = not runner.isRunInParallel()
+            )
+            self._batchCollectors[runner] = collector
+        return collector
+
+    async def _pollJobs(self, filter:dict, prices:list=None, name:str="") -> list:
+        """
+        Long-poll the pool for pending jobs.
+        Failed polls, and polls that return nothing without holding the long-poll,
+        are followed by a backoff wait.
+        Args:
+            filter (dict): The filter of the jobs (see RunnerConfig.getFilter).
+            prices (list): Optional: The prices to filter the bids by.
+            name (str): Optional: The name of the poller, for its backoff state.
+        Returns:
+            list: The pending jobs that were not already picked up by the node.
+        """
+        backoff = self._getBackoff("poll."+name if name else "poll")
+        idleBackoff = self._getBackoff("idle."+name if name else "idle", 100, min(5000, self.backoffMax))
+        t = time.monotonic()
+        try:
+            client = self._getClient()
+            jobs = (await client.getPendingJobs(rpc_pb2.RpcGetPendingJobs(
                 filterByRunOn =  filter["filterByRunOn"] if "filterByRunOn" in filter else None,
                 filterByCustomer = filter["filterByCustomer"] if "filterByCustomer" in filter else None,
                 filterByDescription = filter["filterByDescription"] if "filterByDescription" in filter else None,
@@ -228,58 +719,229 @@ class OpenAgentsNode:
                 filterByBids = prices,
                 wait=60000,
                 # exclude failed jobs
-                excludeId = [x[0] for x in self.lockedJobs]
-            ))).jobs)    
+                excludeId = self.lockedJobs.getExcludeIds()
+            ))).jobs
+        except Exception as e:
+            self.getLogger().error("Error polling jobs "+str(e))
+            await backoff.wait()
+            return []
+        self._pollDuration.labels(poller=name or "node").observe(time.monotonic() - t)
+        self._jobsPerPoll.labels(poller=name or "node").observe(len(jobs))
+        if self.tracer.isEnabled():
+            end = time.time()
+            fetchTimes = (end - (time.monotonic() - t), end)
+            for job in jobs:
+                self._fetchTimes[job.id] = fetchTimes
+            while len(self._fetchTimes) > MAX_FETCH_TIMES:
+                self._fetchTimes.popitem(last=False)
+        backoff.reset()
+        if self.workerCount > 1:
+            # the jobs of the other workers are excluded from the next polls, so the pool holds the long-poll
+            for job in jobs:
+                if not self._isOwnJob(job.id):
+                    self.lockedJobs.add(job.id)
+        if len(jobs) == 0 and time.monotonic() - t < 1.0:
+            # the pool didn't hold the long-poll, don't hammer it
+            await idleBackoff.wait()
+        else:
+            idleBackoff.reset()
+        # the exclude list is capped, so the pool can still return jobs we already picked up
+        jobs = [job for job in jobs if job.id not in self.lockedJobs and self._isOwnJob(job.id)]
+        self.recorder.recordJobs(jobs)
+        return jobs
 
-            if len(jobs)>0 : self.getLogger().log(str(len(jobs))+" pending jobs for "+runner.__class__.__name__)
-            else : self.getLogger().finer("No pending jobs for "+runner.__class__.__name__)
-            
-            for job in jobs:              
-                wasAccepted=False
-                t=time.time()   
-                ctx = JobContext(self,runner,job)
-                try:
-                    client = self._getClient() # Refresh client connection if needed
-                    if not await runner.canRun(ctx):
-                        await ctx.close()
-                        continue
-                    self.lockedJobs.append([job.id, time.time()])
-                    await self._acceptJob(job.id)
-                    wasAccepted = True
-
-
-                    
-                    ctx.getLogger().info("Job started on node "+self.nodeName)  
-                    
-                    await runner.preRun(ctx)
-                    async def task():
-                        try:
-                            output=await runner.run(ctx) 
-                            await runner.postRun(ctx)                  
-                            ctx.getLogger().info("Job completed in "+str(time.time()-t)+" seconds on node "+self.nodeName, job.id)                
-                            await client.completeJob(rpc_pb2.RpcJobOutput(jobId=job.id, output=output))
-                        except Exception as e:
-                            ctx.getLogger().error("Job failed in "+str(time.time()-t)+" seconds on node "+self.nodeName+" with error "+str(e), job.id)
-                            if wasAccepted:
-                                await client.cancelJob(rpc_pb2.RpcCancelJob(jobId=job.id, reason=str(e)))
-                            traceback.print_exc()
-                        await ctx.close()
-                    if not runner.isRunInParallel():
-                        await task()
-                    else:
-                        asyncio.create_task(task())
-                except Exception as e:
-                    ctx.getLogger().error("Job failed in "+str(time.time()-t)+" seconds on node "+self.nodeName+" with error "+str(e), job.id)
+    def _isOwnJob(self, jobId:str) -> bool:
+        """
+        Check if a job is taken by this worker: with several workers each one polls the same jobs,
+        so the job ids are partitioned across the workers to run each job once.
+        Args:
+            jobId (str): The ID of the job.
+        Returns:
+            bool: True if the job is taken by this worker.
+        """
+        if self.workerCount <= 1:
+            return True
+        return zlib.crc32(jobId.encode("utf-8")) % self.workerCount == self.workerIndex
+
+    async def _pickUpJob(self, runner:JobRunner, job):
+        """
+        Try to take a job for a runner: check canRun, accept the job and call preRun.
+        On success the job holds a slot until it is finished with _startJob.
+        Args:
+            runner (JobRunner): The runner.
+            job (Job): The job.
+        Returns:
+            tuple: The (JobContext, pick up time) of the job, or None if the job was not taken.
+        """
+        wasAccepted=False
+        hasSlot=False
+        t=time.time()   
+        ctx = JobContext(self,runner,job)
+        if self.tracer.isEnabled():
+            fetchTimes = self._fetchTimes.pop(job.id, None)
+            ctx.span = self.tracer.startTrace(job.id, attributes={"runner": runner.__class__.__name__, "job.kind": job.kind},
+                start=fetchTimes[0] if fetchTimes else t)
+            if fetchTimes:
+                self.tracer.recordSpan("fetch", fetchTimes[0], fetchTimes[1], parent=ctx.span)
+        if self._shouldProfile(runner, ctx):
+            # None if another job is being profiled
+            ctx.profiler = JobProfiler.acquire(job.id)
+        try:
+            client = self._getClient() # Refresh client connection if needed
+            with self.tracer.activate(ctx.span), self.recorder.activate(job.id):
+                if not await runner.canRun(ctx):
+                    ctx.span.setAttribute("skipped", True)
+                    ctx.span.end()
                     await ctx.close()
-                    if wasAccepted:
-                        await client.cancelJob(rpc_pb2.RpcCancelJob(jobId=job.id, reason=str(e)))
-                    traceback.print_exc()
+                    return None
+                self._acquireSlot(runner)
+                hasSlot=True
+                self.lockedJobs.add(job.id)
+                with self.tracer.span("accept"):
+                    await self._acceptJob(job.id)
+                wasAccepted = True
+                ctx.acceptedAt = time.time()
 
+                ctx.getLogger().info("Job started on node "+self.nodeName)  
+                
+                with self.tracer.span("preRun"):
+                    await self._callHook(runner.preRun, ctx)
+            return (ctx, t)
         except Exception as e:
+            ctx.getLogger().error("Job failed in "+str(time.time()-t)+" seconds on node "+self.nodeName+" with error "+str(e), job.id)
+            ctx.span.end(e)
+            if wasAccepted:
+                # retried by the outbox if the pool is unreachable
+                self._outbox.cancel(job.id, str(e))
+            await ctx.close()
+            if hasSlot:
+                await self._releaseSlot(runner)
             traceback.print_exc()
-            self.getLogger().error("Error executing runner "+str(e))
-            await asyncio.sleep(5000.0/1000.0)
-        self.runnerTasks[runner]=asyncio.create_task(self._executePendingJobForRunner(runner))
+            return None
+
+    async def _startJob(self, runner:JobRunner, ctx:JobContext, t:float, wait:bool):
+        """
+        Run a job picked up with _pickUpJob, the slot of the job is released when it is finished.
+        Args:
+            runner (JobRunner): The runner.
+            ctx (JobContext): The context of the job.
+            t (float): The time the job was picked up.
+            wait (bool): If True wait for the job to finish, otherwise run it in background.
+        """
+        if runner.maxBatchSize > 1:
+            self._getBatchCollector(runner).add((ctx, t))
+        elif wait:
+            await self._finishJob(runner, ctx, t)
+        else:
+            asyncio.create_task(self._finishJob(runner, ctx, t))
+
+    async def _initRunner(self, runner:JobRunner):
+        if not runner.initialized:
+            runner.initialized=True
+            await runner.init(self)
+
+    def _isRegistered(self, runner:JobRunner) -> bool:
+        return len([x for x in self.registeredRunners if x["runner"]==runner])>0
+
+    async def _executePendingJobForRunner(self , runner:JobRunner):
+        """
+        Execute all pending jobs for a runner, until the runner is unregistered.
+        Args:
+            runner (JobRunner): The runner to execute the job.
+        """
+        while self._isRegistered(runner):
+            try:
+                await self._initRunner(runner)
+                # Don't long-poll while at capacity, so pending jobs stay available to other nodes
+                await self._waitForFreeSlot(runner)
+                if self.prefetchJobs > 0 and not runner.isRunInParallel() and runner.maxBatchSize <= 1:
+                    await self._executePrefetchedJob(runner)
+                    self._getBackoff("runner."+runner.__class__.__name__).reset()
+                    continue
+                meta = runner.getMeta()
+                prices = "prices" in meta and meta["prices"] or None
+                jobs = await self._pollJobs(runner.getFilter(), prices, runner.__class__.__name__)
+
+                if len(jobs)>0 : self.getLogger().log(str(len(jobs))+" pending jobs for "+runner.__class__.__name__)
+                else : self.getLogger().finer("No pending jobs for "+runner.__class__.__name__)
+                
+                for job in jobs:              
+                    if not self._hasFreeSlot(runner):
+                        self.getLogger().finer("Concurrency limit reached for "+runner.__class__.__name__+", leaving remaining jobs in the pool")
+                        break
+                    picked = await self._pickUpJob(runner, job)
+                    if picked:
+                        await self._startJob(runner, picked[0], picked[1], not runner.isRunInParallel())
+                self._getBackoff("runner."+runner.__class__.__name__).reset()
+
+            except Exception as e:
+                traceback.print_exc()
+                self.getLogger().error("Error executing runner "+str(e))
+                await self._getBackoff("runner."+runner.__class__.__name__).wait()
+
+        del self.runnerTasks[runner]
+        if runner in self._processPools:
+            self._processPools.pop(runner).close()
+        if runner in self._prefetchers:
+            self._prefetchers.pop(runner).release()
+
+    async def _executePrefetchedJob(self, runner:JobRunner):
+        """
+        Execute the next job of a serial runner, while the job runs the following
+        jobs are fetched in background.
+        Args:
+            runner (JobRunner): The runner to execute the job.
+        """
+        prefetcher = self._prefetchers.get(runner)
+        if prefetcher is None:
+            prefetcher = JobPrefetcher(self, runner, self.prefetchJobs)
+            self._prefetchers[runner] = prefetcher
+        job = await prefetcher.take()
+        if job is None:
+            self.getLogger().finer("No pending jobs for "+runner.__class__.__name__)
+            return
+        picked = await self._pickUpJob(runner, job)
+        if not picked:
+            # not taken by this runner, let the pool offer it again
+            self.lockedJobs.remove(job.id)
+            return
+        if self.maxParallelJobs <= 0 or self.runningJobs < self.maxParallelJobs:
+            prefetcher.start()
+        await self._startJob(runner, picked[0], picked[1], True)
+
+    async def _dispatchPendingJobs(self):
+        """
+        Execute all pending jobs for all runners with a single shared long-poll,
+        the jobs are routed locally to the matching runners.
+        """
+        while True:
+            try:
+                runners = [reg["runner"] for reg in self.registeredRunners]
+                for runner in runners:
+                    await self._initRunner(runner)
+                if not await self._jobDispatcher.waitForFreeSlot():
+                    continue
+                jobs = await self._jobDispatcher.poll()
+                if len(jobs)>0 : self.getLogger().log(str(len(jobs))+" pending jobs")
+                else : self.getLogger().finer("No pending jobs")
+                for job in jobs:
+                    picked = None
+                    busy = False
+                    for runner in self._jobDispatcher.match(job):
+                        if not self._hasFreeSlot(runner):
+                            busy = True
+                            continue
+                        picked = await self._pickUpJob(runner, job)
+                        if picked:
+                            await self._startJob(runner, picked[0], picked[1], False)
+                            break
+                    if not picked:
+                        self._jobDispatcher.skip(job, busy)
+                self._getBackoff("dispatcher").reset()
+            except Exception as e:
+                traceback.print_exc()
+                self.getLogger().error("Error dispatching jobs "+str(e))
+                await self._getBackoff("dispatcher").wait()
 
  
     runnerTasks={}
@@ -287,6 +949,11 @@ class OpenAgentsNode:
         """
         Execute all pending jobs for all runners.
         """
+        self.loop = asyncio.get_running_loop()
+        if self.sharedPolling:
+            if self._dispatcherTask is None:
+                self._dispatcherTask = asyncio.create_task(self._dispatchPendingJobs())
+            return
         for reg in self.registeredRunners:
             try:
                 runner = reg["runner"]
@@ -296,81 +963,295 @@ class OpenAgentsNode:
                 self.getLogger().log("Error executing pending job "+str(e), None)
 
 
+    def _getAnnouncement(self, reg:dict):
+        """
+        Get the announcement request of a runner, serialized again only when its config changed.
+        """
+        runner = reg["runner"]
+        if reg.get("announcementRevision") != runner.configRevision:
+            reg["announcement"] = rpc_pb2.RpcAnnounceTemplateRequest(
+                meta=json.dumps(runner.getMeta()),
+                template=runner.getTemplate(),
+                sockets=json.dumps(runner.getSockets())
+            )
+            reg["announcementRevision"] = runner.configRevision
+        return reg["announcement"]
+
+    def _onRunnerConfigChanged(self, runner:JobRunner):
+        """
+        Announce again the template of a runner whose config changed.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # called from a synchronous hook running on the thread pool
+            if self.loop:
+                self.loop.call_soon_threadsafe(self._onRunnerConfigChanged, runner)
+                return
+        for reg in self.registeredRunners:
+            if reg["runner"] == runner:
+                reg["nextAnnouncementTimestamp"] = 0
+        self._jobDispatcher.invalidate()
+        self._announceWake.set()
+
+    def _getNextAnnouncement(self) -> int:
+        """
+        Get the timestamp in milliseconds of the next due announcement.
+        """
+        return min([self.nextNodeAnnounce]+[reg["nextAnnouncementTimestamp"] for reg in self.registeredRunners])
+
+    async def _announceNode(self):
+        async with self._announceSemaphore:
+            try:
+                client = self._getClient()
+                res=await client.announceNode(rpc_pb2.RpcAnnounceNodeRequest(
+                    iconUrl = self.nodeIcon,
+                    name = self.nodeName,
+                    description = self.nodeDescription,
+                ))
+                self.nextNodeAnnounce = int(time.time()*1000) + max(res.refreshInterval, MIN_ANNOUNCE_INTERVAL)
+                self.getLogger().log("Node announced, next announcement in "+str(res.refreshInterval)+" ms")
+                self._getBackoff("announce").reset()
+            except Exception as e:
+                self.getLogger().error("Error announcing node "+ str(e), None)
+                self.nextNodeAnnounce = int(time.time()*1000 + self._getBackoff("announce").next())
+
+    async def _announceTemplate(self, reg:dict):
+        async with self._announceSemaphore:
+            name = reg["runner"].__class__.__name__
+            try:
+                client = self._getClient()
+                res = await client.announceEventTemplate(self._getAnnouncement(reg))
+                reg["nextAnnouncementTimestamp"] = int(time.time()*1000) + max(res.refreshInterval, MIN_ANNOUNCE_INTERVAL)
+                self.getLogger().log("Template announced, next announcement in "+str(res.refreshInterval)+" ms")
+                self._getBackoff("announce."+name).reset()
+            except Exception as e:
+                self.getLogger().error("Error announcing template "+ str(e), None)
+                reg["nextAnnouncementTimestamp"] = int(time.time()*1000 + self._getBackoff("announce."+name).next())
+
     async def reannounce(self):    
         """
-        Reannounce the node and all templates.
+        Reannounce the node and all the templates that are due, at most NODE_ANNOUNCE_CONCURRENCY at a time.
         """
-        # Announce node
         try:
             time_ms=int(time.time()*1000)
+            announcements = []
             if time_ms >= self.nextNodeAnnounce:
-                try:
-                    client = self._getClient()
-                    res=await client.announceNode(rpc_pb2.RpcAnnounceNodeRequest(
-                        iconUrl = self.nodeIcon,
-                        name = self.nodeName,
-                        description = self.nodeDescription,
-                    ))
-                    self.nextNodeAnnounce = int(time.time()*1000) + res.refreshInterval
-                    self.getLogger().log("Node announced, next announcement in "+str(res.refreshInterval)+" ms")
-                except Exception as e:
-                    self.getLogger().error("Error announcing node "+ str(e), None)
-                    self.nextNodeAnnounce = int(time.time()*1000) + 5000
-
+                announcements.append(self._announceNode())
             for reg in self.registeredRunners:
-                try:
-                    if time_ms >=  reg["nextAnnouncementTimestamp"]:
-                        client = self._getClient()
-                        res = await client.announceEventTemplate(rpc_pb2.RpcAnnounceTemplateRequest(
-                            meta=json.dumps(reg["runner"].getMeta()),
-                            template=reg["runner"].getTemplate(),
-                            sockets=json.dumps(reg["runner"].getSockets())
-                        ))
-                        reg["nextAnnouncementTimestamp"] = int(time.time()*1000) + res.refreshInterval
-                        self.getLogger().log("Template announced, next announcement in "+str(res.refreshInterval)+" ms")
-                except Exception as e:
-                    self.getLogger().error("Error announcing template "+ str(e), None)
-                    reg["nextAnnouncementTimestamp"] = int(time.time()*1000) + 5000
+                if time_ms >= reg["nextAnnouncementTimestamp"]:
+                    announcements.append(self._announceTemplate(reg))
+            await asyncio.gather(*announcements)
         except Exception as e:
             self.getLogger().error("Error reannouncing "+str(e), None)
-        await asyncio.sleep(5)
-        asyncio.create_task(self.reannounce())
-  
-    async def _loop(self):
+
+    async def _announceLoop(self):
         """
-        The main loop of the node.
+        Reannounce the node and all templates when they are due.
         """
-        promises = [reg["runner"].loop(self) for reg in self.registeredRunners]
-        await asyncio.gather(*promises)
-        self.isLooping = False
-        await asyncio.sleep(self.loopInterval/1000.0)
-        asyncio.create_task(self._loop())
+        while True:
+            # wake at the next deadline, or when a runner is registered or changed
+            self._announceWake.clear()
+            delay = self._getNextAnnouncement() - time.time()*1000
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._announceWake.wait(), delay/1000.0)
+                except asyncio.TimeoutError:
+                    pass
+            await self.reannounce()
+
+    def _loop(self):
+        """
+        Start the loop of every registered runner and stop the loops of the unregistered ones.
+        """
+        runners = [reg["runner"] for reg in self.registeredRunners]
+        for runner in runners:
+            if runner not in self._loopSchedulers:
+                interval = 1000.0/runner.getLoopTPS() if runner.getLoopTPS() > 0 else self.loopInterval
+                scheduler = LoopScheduler(runner.__class__.__name__, lambda runner=runner: runner.loop(self), interval, self.getLogger())
+                self._loopSchedulers[runner] = scheduler
+                scheduler.start()
+        for runner in list(self._loopSchedulers.keys()):
+            if runner not in runners:
+                self._loopSchedulers.pop(runner).stop()
+
+    def getLoopStats(self) -> dict:
+        """
+        Get the timing stats of the runner loops.
+        Returns:
+            dict: The stats of each runner loop by runner name (see LoopScheduler.getStats).
+        """
+        return {scheduler.name: scheduler.getStats() for scheduler in self._loopSchedulers.values()}
+
+    def getLoopLagStats(self) -> dict:
+        """
+        Get the stats of the event loop stalls.
+        Returns:
+            dict: The stats of the loop monitor (see LoopMonitor.getStats).
+        """
+        return self._loopMonitor.getStats()
+
+    def _getLocalCache(self) -> LocalCache:
+        """
+        Internal method to get the local cache, opened on first use in CACHE_PATH/local.
+        The entries left in CACHE_PATH by the previous flat layout are moved into it.
+        Should not be called, use JobContext.cacheSet/cacheGet instead.
+        """
+        if self._localCache is None:
+            cachePath = os.getenv("CACHE_PATH", "cache")
+            self._localCache = LocalCache(
+                os.path.join(cachePath, "local"),
+                self.cacheMaxBytes,
+                self.cacheCleanupInterval,
+                self.metrics
+            )
+            try:
+                imported = self._localCache.importLegacy(cachePath)
+                if imported > 0:
+                    self.getLogger().info("Imported "+str(imported)+" entries of the legacy local cache")
+            except Exception as e:
+                self.getLogger().error("Error importing the legacy local cache "+str(e))
+            self._localCache.start()
+        return self._localCache
+
+    def getLocalCacheStats(self) -> dict:
+        """
+        Get the stats of the local cache.
+        Returns:
+            dict: The stats of the local cache (see LocalCache.getStats).
+        """
+        return self._getLocalCache().getStats()
         
 
-    async def _run(self, poolAddress=None, poolPort=None, poolSsl=False):
+    def _setPool(self, poolAddress=None, poolPort=None, poolSsl=False):
         """
-        Internal method to run the node.
+        Internal method to set the address of the pool, from the arguments or the environment variables.
         Should not be called, use start() instead.
         """
-        await asyncio.sleep(5000.0/1000.0)
         self.poolAddress = poolAddress or os.getenv('POOL_ADDRESS', "playground.openagents.com")
         self.poolPort = poolPort or int(os.getenv('POOL_PORT', "6021"))
         self.poolSsl = poolSsl or os.getenv('POOL_SSL', "true")== "true"
+
+    async def _run(self, poolAddress=None, poolPort=None, poolSsl=False):
+        """
+        Internal method to run the node.
+        Should not be called, use start() instead.
+        """
+        await asyncio.sleep(5000.0/1000.0)
+        self._setPool(poolAddress, poolPort, poolSsl)
         self.loopInterval = 1000.0/int(os.getenv('NODE_TPS', "10"))
 
-        await self._loop()
-        await self.reannounce()
-        while True:
-            await self._executePendingJob()
-            await asyncio.sleep(1000.0/1000.0)
+        try:
+            self._loop()
+            if self.loopLagThreshold > 0:
+                self._loopMonitor.start()
+            asyncio.create_task(self._outbox.resendSpilled())
+            if self.metricsPort:
+                # every worker exposes its own metrics
+                port = self.metricsPort + self.workerIndex
+                self.metrics.serve(port, self.metricsHost)
+                self.getLogger().info("Metrics available on http://"+self.metricsHost+":"+str(port)+"/metrics")
+            # the workers share the same identity, only the first one announces it
+            if self.workerIndex == 0:
+                await self.reannounce()
+                self._announceTask = asyncio.create_task(self._announceLoop())
+            while True:
+                self._loop()
+                await self._executePendingJob()
+                # wake up when runners are registered, instead of ticking
+                self._runnersChanged.clear()
+                try:
+                    await asyncio.wait_for(self._runnersChanged.wait(), 60)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # the main task is cancelled on SIGINT (see asyncio.Runner)
+            await self._shutdown()
+
+    async def _shutdown(self):
+        """
+        Internal method to deliver the results of the finished jobs and close the pool connections.
+        Should not be called, the node shuts down when its main task is cancelled.
+        """
+        self._loopMonitor.stop()
+        try:
+            pending = len(self._outbox.pending)
+            if pending > 0:
+                self.getLogger().info("Delivering the results of "+str(pending)+" jobs before shutting down")
+            await self._outbox.close(self.shutdownTimeout/1000.0)
+        except Exception as e:
+            self.getLogger().error("Error delivering the results on shutdown "+str(e))
+        try:
+            await self._channelPool.close()
+        except Exception as e:
+            self.getLogger().error("Error closing the pool connections "+str(e))
         
-    def start(self, poolAddress:str=None, poolPort:str=None):
+    def _getEventLoopFactory(self):
+        """
+        Get the factory of the event loop selected by NODE_EVENT_LOOP.
+        Returns:
+            The event loop factory, or None for the default asyncio loop.
+        """
+        eventLoop = self.config.getOption("eventLoop", "NODE_EVENT_LOOP", "asyncio")
+        if eventLoop == "uvloop":
+            try:
+                import uvloop
+                self.getLogger().info("Using uvloop event loop")
+                return uvloop.new_event_loop
+            except ImportError:
+                self.getLogger().warn("uvloop is not installed, using the default asyncio event loop")
+        elif eventLoop != "asyncio":
+            self.getLogger().warn("Unknown event loop "+str(eventLoop)+", using the default asyncio event loop")
+        return None
+
+    def _runWorker(self, index:int, readyQueue, poolAddress:str=None, poolPort:int=None, workers:int=1):
+        """
+        Internal method to run the node in a forked worker process.
+        Should not be called, use start() instead.
+        """
+        self.workerIndex = index
+        self.workerCount = workers
+        # the worker stops on SIGINT (see asyncio.Runner), not through the supervisor handlers
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        # threads and loop bound objects don't survive the fork, the connections are closed before forking
+        self.logger = Logger(self.nodeName+"-"+str(index), self.nodeVersion)
+        self._threadPool = None
+        self._localCache = None
+        self._slotsCondition = asyncio.Condition()
+        self._runnersChanged = asyncio.Event()
+        self._announceWake = asyncio.Event()
+        self._announceSemaphore = asyncio.Semaphore(max(1, self.announceConcurrency))
+        # every worker records the jobs it receives to its own file
+        self.recorder = self.recorder.forWorker(index)
+
+        async def run():
+            readyQueue.put((index, os.getpid()))
+            await self._run(poolAddress, poolPort)
+
+        try:
+            with asyncio.Runner(loop_factory=self._getEventLoopFactory()) as runner:
+                runner.run(run())
+        except KeyboardInterrupt:
+            pass
+
+    def start(self, poolAddress:str=None, poolPort:str=None, workers:int=None):
         """
         Start the node in an asyncio event loop.
+        With more than one worker, the runners are initialized once and the node is forked
+        in several processes, each one with its own event loop and pool connection.
+        The state loaded by JobRunner.init is shared by the workers until they modify it.
         Args:
             poolAddress (str): The address of the pool. Defaults to
                 the environment variable POOL_ADDRESS.
             poolPort (int): The port of the pool. Defaults to the
                 environment variable POOL_PORT.
+            workers (int): The number of worker processes. Defaults to the
+                environment variable NODE_WORKERS.
         """
-        asyncio.run(self._run(poolAddress, poolPort))
\ No newline at end of file
+        workers = workers or self.workers
+        if workers > 1:
+            NodeSupervisor(self, workers).run(poolAddress, poolPort)
+            return
+        with asyncio.Runner(loop_factory=self._getEventLoopFactory()) as runner:
+            runner.run(self._run(poolAddress, poolPort))
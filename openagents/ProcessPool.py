@@ -0,0 +1,180 @@
+import asyncio
+import threading
+import multiprocessing
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from openagents_grpc_proto import Job_pb2
+from .Logger import Logger
+from .JobContext import JobContext
+
+# State of the worker process, set by _initWorker
+_workerRunner = None
+_workerLogQueue = None
+_workerMeta = None
+
+def _initWorker(runner, logQueue, meta:dict):
+    global _workerRunner, _workerLogQueue, _workerMeta
+    _workerRunner = runner
+    _workerLogQueue = logQueue
+    _workerMeta = meta
+
+def _runInWorker(jobBytes:bytes):
+    job = Job_pb2.Job.FromString(jobBytes)
+    ctx = ProcessJobContext(job, _workerRunner, _workerMeta, _workerLogQueue)
+    try:
+        if asyncio.iscoroutinefunction(_workerRunner.run):
+            return asyncio.run(_workerRunner.run(ctx))
+        return _workerRunner.run(ctx)
+    finally:
+        ctx.close()
+
+
+class ProcessJobContext:
+    """
+    The context of a job running in a worker process.
+    It exposes the job and a logger that forwards to the job log of the parent node.
+    Disks and remote cache are not available in worker processes, use preRun/postRun for them.
+    """
+    def __init__(self, job, runner, meta:dict, logQueue):
+        self.job = job
+        self.runner = runner
+        self._jobIndex = None
+        self._inputs = None
+        self.logger = Logger(
+            meta["name"]+"."+runner.getMeta()["name"],
+            meta["version"],
+            job.id,
+            lambda x: logQueue.put((job.id, x)),
+            enableOobs=False
+        )
+
+    def getLogger(self):
+        """
+        Get the logger of the job.
+        """
+        return self.logger
+
+    def getJob(self):
+        """
+        Get the job object.
+        """
+        return self.job
+
+    def getNode(self):
+        """
+        The node is not reachable from a worker process.
+        """
+        return None
+
+    def close(self):
+        self.logger.close()
+
+    getJobParamValues = JobContext.getJobParamValues
+    getJobParamValue = JobContext.getJobParamValue
+    getJobInputs = JobContext.getJobInputs
+    getJobInput = JobContext.getJobInput
+    getInputs = JobContext.getInputs
+    _getJobIndex = JobContext._getJobIndex
+    getOutputFormat = JobContext.getOutputFormat
+
+
+class ProcessPool:
+    """
+    A pool of worker processes that execute the run method of a runner.
+    The pool is configured by the node options (see OpenAgentsNode):
+    - NODE_PROCESS_POOL_SIZE: The default number of worker processes. Defaults to the number of cpus.
+    - NODE_PROCESS_START_METHOD: The multiprocessing start method ("fork", "spawn" or "forkserver").
+        Defaults to "fork" when available, so the workers inherit the state loaded by JobRunner.init.
+    """
+
+    def __init__(self, node, runner, size:int=0):
+        """
+        Create a new process pool.
+        Args:
+            node (OpenAgentsNode): The node.
+            runner (JobRunner): The runner executed by the workers.
+            size (int): Optional: The number of worker processes. Defaults to NODE_PROCESS_POOL_SIZE.
+        """
+        self.node = node
+        self.runner = runner
+        self.size = size or node.processPoolSize
+        startMethod = node.processStartMethod
+        if not startMethod:
+            startMethod = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+        self.mpContext = multiprocessing.get_context(startMethod)
+        self.executor = None
+        self.logQueue = None
+        self.logThread = None
+        self.loop = None
+        self.crashes = 0
+
+    def _start(self):
+        if self.logQueue is None:
+            self.loop = asyncio.get_running_loop()
+            self.logQueue = self.mpContext.SimpleQueue()
+            self.logThread = threading.Thread(target=self._forwardLogs, args=(self.logQueue,), daemon=True)
+            self.logThread.start()
+        if self.executor is None:
+            self.executor = self._createExecutor(self.size)
+
+    def _createExecutor(self, size:int) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=size,
+            mp_context=self.mpContext,
+            initializer=_initWorker,
+            initargs=(self.runner, self.logQueue, self.node.getMeta())
+        )
+
+    def _forwardLogs(self, logQueue):
+        while True:
+            entry = logQueue.get()
+            if entry is None:
+                break
+            jobId, message = entry
+            try:
+                self.loop.call_soon_threadsafe(self.node._log, message, jobId)
+            except RuntimeError:
+                # loop closed
+                break
+
+    async def run(self, ctx:JobContext):
+        """
+        Run a job in a worker process.
+        Args:
+            ctx (JobContext): The context of the job.
+        Returns:
+            The output of the runner.
+        """
+        jobBytes = ctx.getJob().SerializeToString()
+        self._start()
+        executor = self.executor
+        try:
+            return await self.loop.run_in_executor(executor, _runInWorker, jobBytes)
+        except BrokenProcessPool:
+            traceback.print_exc()
+            if self.executor is executor:
+                self.crashes += 1
+                self.executor = None
+                executor.shutdown(wait=False, cancel_futures=True)
+        # A crash breaks every job queued on the same pool, so each job gets one more
+        # attempt in its own process: only the job that actually crashes the worker fails
+        isolated = self._createExecutor(1)
+        try:
+            return await self.loop.run_in_executor(isolated, _runInWorker, jobBytes)
+        except BrokenProcessPool:
+            self.crashes += 1
+            raise Exception("Worker process crashed while running job "+ctx.getJob().id)
+        finally:
+            isolated.shutdown(wait=False)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        if self.logQueue:
+            self.logQueue.put(None)
+            self.logQueue = None
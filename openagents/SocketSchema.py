@@ -0,0 +1,156 @@
+import json
+import re
+
+def _toInt(value) -> int:
+    if isinstance(value, str) and "." in value:
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError("not an integer "+value)
+        return int(number)
+    return int(value)
+
+
+class _Field:
+    def __init__(self, name:str, schema:dict):
+        self.name = name
+        self.type = schema.get("type", "string")
+        self.isArray = self.type == "array"
+        self.default = schema.get("default")
+        self.required = schema.get("required") is True
+        self.decode = SocketSchema._compileDecoder(schema.get("items", {}) if self.isArray else schema)
+        self.checks = SocketSchema._compileChecks(schema)
+        self.itemChecks = SocketSchema._compileChecks(schema.get("items", {})) if self.isArray else []
+
+
+class SocketSchema:
+    """
+    The "in" sockets of a runner (JSON Schema properties, see RunnerConfig) compiled once into
+    decoders and validators for the params and inputs of its jobs.
+    Each socket is read from the job param with the same key, or if there is no such param,
+    from the job inputs whose marker is the name of the socket.
+    The values are converted to the type of the socket ("integer", "number", "boolean", "string",
+    "object" and "array" of those), the missing ones take the default of the socket.
+    The supported constraints are: required (bool), enum, const, minimum, maximum, exclusiveMinimum, exclusiveMaximum,
+    minLength, maxLength, pattern, minItems, maxItems.
+    """
+
+    def __init__(self, sockets:dict=None):
+        """
+        Compile the sockets.
+        Args:
+            sockets (dict): Optional: The sockets of the runner, only the "in" sockets are used. Defaults to None.
+        """
+        self.sockets = sockets or {}
+        self.fields = [_Field(name, schema) for name, schema in (self.sockets.get("in") or {}).items() if isinstance(schema, dict)]
+
+    def __getstate__(self):
+        # the compiled checks are closures, they are compiled again when unpickled (eg. in a worker process)
+        return {"sockets": self.sockets}
+
+    def __setstate__(self, state:dict):
+        self.__init__(state["sockets"])
+
+    @staticmethod
+    def _compileDecoder(schema:dict):
+        type = schema.get("type", "string")
+        if type == "integer":
+            return _toInt
+        if type == "number":
+            return float
+        if type == "boolean":
+            return lambda value: value if isinstance(value, bool) else str(value).strip().lower() in ("true", "1", "yes", "on")
+        if type == "object":
+            return lambda value: json.loads(value) if isinstance(value, (str, bytes)) else value
+        return lambda value: value if isinstance(value, str) else str(value)
+
+    @staticmethod
+    def _compileChecks(schema:dict) -> list:
+        # each check returns an error message or None
+        checks = []
+        if "enum" in schema:
+            enum = schema["enum"]
+            checks.append(lambda v: None if v in enum else "must be one of "+json.dumps(enum))
+        if "const" in schema:
+            const = schema["const"]
+            checks.append(lambda v: None if v == const else "must be "+json.dumps(const))
+        if "minimum" in schema:
+            minimum = schema["minimum"]
+            checks.append(lambda v: None if v >= minimum else "must be >= "+str(minimum))
+        if "maximum" in schema:
+            maximum = schema["maximum"]
+            checks.append(lambda v: None if v <= maximum else "must be <= "+str(maximum))
+        if "exclusiveMinimum" in schema:
+            exclusiveMinimum = schema["exclusiveMinimum"]
+            checks.append(lambda v: None if v > exclusiveMinimum else "must be > "+str(exclusiveMinimum))
+        if "exclusiveMaximum" in schema:
+            exclusiveMaximum = schema["exclusiveMaximum"]
+            checks.append(lambda v: None if v < exclusiveMaximum else "must be < "+str(exclusiveMaximum))
+        if "minLength" in schema:
+            minLength = schema["minLength"]
+            checks.append(lambda v: None if len(v) >= minLength else "must be at least "+str(minLength)+" characters long")
+        if "maxLength" in schema:
+            maxLength = schema["maxLength"]
+            checks.append(lambda v: None if len(v) <= maxLength else "must be at most "+str(maxLength)+" characters long")
+        if "pattern" in schema:
+            pattern = re.compile(schema["pattern"])
+            checks.append(lambda v: None if pattern.search(v) else "must match "+pattern.pattern)
+        if "minItems" in schema:
+            minItems = schema["minItems"]
+            checks.append(lambda v: None if len(v) >= minItems else "must have at least "+str(minItems)+" items")
+        if "maxItems" in schema:
+            maxItems = schema["maxItems"]
+            checks.append(lambda v: None if len(v) <= maxItems else "must have at most "+str(maxItems)+" items")
+        return checks
+
+    @staticmethod
+    def _check(checks:list, value, name:str, errors:list):
+        for check in checks:
+            try:
+                error = check(value)
+            except TypeError:
+                error = "has an invalid type"
+            if error:
+                errors.append(name+" "+error)
+
+    def decode(self, ctx) -> dict:
+        """
+        Decode and validate the inputs of a job.
+        Args:
+            ctx (JobContext): The context of the job.
+        Returns:
+            dict: The typed value of each socket, None for the missing sockets without a default.
+        Raises:
+            ValueError: If some values can't be converted or don't satisfy the constraints of their socket.
+        """
+        out = {}
+        errors = []
+        for field in self.fields:
+            raw = ctx.getJobParamValues(field.name)
+            if raw is None:
+                raw = [i.data for i in ctx.getJobInputs(field.name)] or None
+            if raw is not None and len(raw) == 1 and raw[0] == "":
+                # rendered from an empty template variable
+                raw = None
+            if raw is None:
+                if field.required:
+                    errors.append(field.name+" is required")
+                out[field.name] = field.default
+                continue
+            try:
+                if field.isArray:
+                    if len(raw) == 1 and isinstance(raw[0], str) and raw[0].lstrip().startswith("["):
+                        # the whole array in a single JSON value
+                        raw = json.loads(raw[0])
+                    value = [field.decode(v) for v in raw]
+                else:
+                    value = field.decode(raw[0])
+            except (ValueError, TypeError) as e:
+                errors.append(field.name+" is not a valid "+field.type+": "+str(e))
+                continue
+            self._check(field.checks, value, field.name, errors)
+            for i, item in enumerate(value if field.isArray else []):
+                self._check(field.itemChecks, item, field.name+"["+str(i)+"]", errors)
+            out[field.name] = value
+        if len(errors) > 0:
+            raise ValueError("Invalid job inputs: "+", ".join(errors))
+        return out
@@ -0,0 +1,297 @@
+import contextvars
+import hashlib
+import json
+import random
+import threading
+import time
+import traceback
+
+# the span of the code that is running, used as parent of the nested spans
+_currentSpan = contextvars.ContextVar("openagents_span", default=None)
+
+class Span:
+    """
+    A timed operation in the trace of a job.
+    """
+
+    def __init__(self, tracer:'Tracer', name:str, traceId:str, parentId:str=None, attributes:dict=None, start:float=None):
+        self.tracer = tracer
+        self.name = name
+        self.traceId = traceId
+        self.spanId = "%016x" % random.getrandbits(64)
+        self.parentId = parentId
+        self.attributes = dict(attributes) if attributes else {}
+        self.start = start if start is not None else time.time()
+        self.endTime = None
+        self.error = None
+
+    def setAttribute(self, key:str, value):
+        """
+        Set an attribute of the span.
+        Args:
+            key (str): The name of the attribute.
+            value: The value of the attribute, it must be serializable to JSON.
+        """
+        self.attributes[key] = value
+
+    def end(self, error=None, end:float=None):
+        """
+        End the span and export it. Ending a span twice has no effect.
+        Args:
+            error (Exception|str): Optional: The error that made the operation fail.
+            end (float): Optional: The end timestamp in seconds. Defaults to now.
+        """
+        if self.endTime is not None:
+            return
+        self.endTime = end if end is not None else time.time()
+        if error is not None:
+            self.error = str(error)
+        self.tracer._export(self)
+
+    def toDict(self) -> dict:
+        """
+        Get the span as a dictionary, with timestamps and durations in milliseconds.
+        Returns:
+            dict: The span.
+        """
+        return {
+            "traceId": self.traceId,
+            "spanId": self.spanId,
+            "parentId": self.parentId,
+            "name": self.name,
+            "start": self.start*1000,
+            "end": self.endTime*1000 if self.endTime is not None else None,
+            "duration": (self.endTime-self.start)*1000 if self.endTime is not None else None,
+            "status": "error" if self.error is not None else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan(Span):
+    def __init__(self):
+        self.traceId = None
+        self.spanId = None
+        self.attributes = {}
+
+    def setAttribute(self, key:str, value):
+        pass
+
+    def end(self, error=None, end:float=None):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _ActiveSpan:
+    def __init__(self, span:Span, endOnExit:bool):
+        self.span = span
+        self.endOnExit = endOnExit
+        self.token = None
+
+    def __enter__(self) -> Span:
+        if self.span is not NOOP_SPAN:
+            self.token = _currentSpan.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.token is not None:
+            _currentSpan.reset(self.token)
+        if self.endOnExit:
+            self.span.end(exc_val)
+        return False
+
+
+class JsonLinesExporter:
+    """
+    Export the spans to a file, one JSON object per line.
+    """
+
+    def __init__(self, path:str):
+        """
+        Create a new exporter.
+        Args:
+            path (str): The path of the file, the spans are appended.
+        """
+        self.path = path
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def export(self, span:dict):
+        line = json.dumps(span, default=str)+"\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class CallbackExporter:
+    """
+    Export the spans to a function.
+    """
+
+    def __init__(self, callback):
+        """
+        Create a new exporter.
+        Args:
+            callback (callable): A function called with each ended span as a dictionary (see Span.toDict).
+        """
+        self.callback = callback
+
+    def export(self, span:dict):
+        self.callback(span)
+
+    def close(self):
+        pass
+
+
+class Tracer:
+    """
+    Records the phases of the jobs as spans of a trace whose ID is derived from the job ID,
+    and passes the ended spans to the exporters.
+    Without exporters tracing is disabled and spans cost nothing.
+    """
+
+    def __init__(self):
+        self.exporters = []
+
+    def isEnabled(self) -> bool:
+        """
+        Check if there is any exporter.
+        Returns:
+            bool: True if the spans are recorded.
+        """
+        return len(self.exporters) > 0
+
+    def addExporter(self, exporter):
+        """
+        Add an exporter.
+        Args:
+            exporter: An object with export(span:dict) and close() methods (eg. JsonLinesExporter),
+                or a function called with each ended span.
+        """
+        if callable(exporter) and not hasattr(exporter, "export"):
+            exporter = CallbackExporter(exporter)
+        self.exporters.append(exporter)
+
+    def removeExporter(self, exporter):
+        """
+        Remove an exporter.
+        Args:
+            exporter: The exporter or the function passed to addExporter.
+        """
+        self.exporters = [e for e in self.exporters if e is not exporter and getattr(e, "callback", None) is not exporter]
+
+    @staticmethod
+    def getTraceId(jobId:str) -> str:
+        """
+        Get the trace ID of a job.
+        Args:
+            jobId (str): The ID of the job.
+        Returns:
+            str: The trace ID, 32 hex characters.
+        """
+        return hashlib.sha256(jobId.encode("utf-8")).hexdigest()[:32]
+
+    def getCurrentSpan(self) -> Span:
+        """
+        Get the active span.
+        Returns:
+            Span: The span, or None.
+        """
+        return _currentSpan.get()
+
+    def startTrace(self, jobId:str, name:str="job", attributes:dict=None, start:float=None) -> Span:
+        """
+        Start the root span of the trace of a job.
+        Args:
+            jobId (str): The ID of the job.
+            name (str): The name of the span. Defaults to "job".
+            attributes (dict): Optional: The attributes of the span.
+            start (float): Optional: The start timestamp in seconds. Defaults to now.
+        Returns:
+            Span: The span.
+        """
+        if not self.isEnabled():
+            return NOOP_SPAN
+        span = Span(self, name, Tracer.getTraceId(jobId), None, attributes, start)
+        span.setAttribute("job.id", jobId)
+        return span
+
+    def startSpan(self, name:str, parent:Span=None, attributes:dict=None, start:float=None) -> Span:
+        """
+        Start a span, child of parent or of the active span.
+        Args:
+            name (str): The name of the span.
+            parent (Span): Optional: The parent span. Defaults to the active span.
+            attributes (dict): Optional: The attributes of the span.
+            start (float): Optional: The start timestamp in seconds. Defaults to now.
+        Returns:
+            Span: The span, a no-op span if tracing is disabled or there is no parent.
+        """
+        if not self.isEnabled():
+            return NOOP_SPAN
+        parent = parent or _currentSpan.get()
+        if parent is None or parent is NOOP_SPAN:
+            return NOOP_SPAN
+        return Span(self, name, parent.traceId, parent.spanId, attributes, start)
+
+    def span(self, name:str, parent:Span=None, attributes:dict=None) -> _ActiveSpan:
+        """
+        Start a span and make it active inside a with block, the span ends with the block.
+            with tracer.span("load") as span:
+                ...
+        Args:
+            name (str): The name of the span.
+            parent (Span): Optional: The parent span. Defaults to the active span.
+            attributes (dict): Optional: The attributes of the span.
+        Returns:
+            A context manager that returns the span.
+        """
+        return _ActiveSpan(self.startSpan(name, parent, attributes), True)
+
+    def activate(self, span:Span) -> _ActiveSpan:
+        """
+        Make a span active inside a with block, without ending it.
+        Args:
+            span (Span): The span.
+        Returns:
+            A context manager that returns the span.
+        """
+        return _ActiveSpan(span, False)
+
+    def recordSpan(self, name:str, start:float, end:float=None, attributes:dict=None, error=None, parent:Span=None):
+        """
+        Record a span that already ended, child of parent or of the active span.
+        Args:
+            name (str): The name of the span.
+            start (float): The start timestamp in seconds.
+            end (float): Optional: The end timestamp in seconds. Defaults to now.
+            attributes (dict): Optional: The attributes of the span.
+            error (Exception|str): Optional: The error that made the operation fail.
+            parent (Span): Optional: The parent span. Defaults to the active span.
+        """
+        if not self.isEnabled():
+            return
+        self.startSpan(name, parent, attributes, start).end(error, end)
+
+    def _export(self, span:Span):
+        data = span.toDict()
+        for exporter in self.exporters:
+            try:
+                exporter.export(data)
+            except Exception as e:
+                traceback.print_exc()
+                print("Error exporting span "+str(e))
+
+    def close(self):
+        """
+        Close the exporters.
+        """
+        for exporter in self.exporters:
+            exporter.close()
+        self.exporters = []
+
@@ -6,3 +6,20 @@ from .RunnerConfig import RunnerConfig
 from .JobRunner import JobRunner
 from .OpenAgentsNode import OpenAgentsNode
 from .NodeConfig import NodeConfig
+from .ProcessPool import ProcessPool, ProcessJobContext
+from .BatchCollector import BatchCollector
+from .JobLeases import JobLeases
+from .JobDispatcher import JobDispatcher
+from .LoopScheduler import LoopScheduler
+from .Backoff import Backoff
+from .NodeSupervisor import NodeSupervisor
+from .ChannelPool import ChannelPool, ChannelStats
+from .JobLogBuffer import JobLogBuffer
+from .CompletionOutbox import CompletionOutbox
+from .MetricsRegistry import MetricsRegistry, Counter, Gauge, Histogram
+from .Tracer import Tracer, Span, JsonLinesExporter, CallbackExporter
+from .JobProfiler import JobProfiler
+from .JobRecorder import JobRecorder
+from .LoopMonitor import LoopMonitor
+from .SocketSchema import SocketSchema
+from .LocalCache import LocalCache
@@ -19,11 +19,15 @@ setup(
     version=version,
     description='A Python SDK for OpenAgents Nodes',
     author='OpenAgents',
+    python_requires='>=3.11',
     setup_requires=['pytest-runner'],
     tests_require=['pytest==8.2.0'],
     install_requires=[
         "openagents-grpc-proto",
         "packaging",
         "requests"
-    ]
+    ],
+    extras_require={
+        "uvloop": ["uvloop"]
+    }
 )
\ No newline at end of file
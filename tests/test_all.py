@@ -3,6 +3,81 @@ import os
 sys.path.insert(0, os.path.abspath('.'))
 from openagents import NodeConfig
 from openagents import RunnerConfig
+from openagents import BatchCollector
+from openagents import JobLeases
+from openagents import Backoff
+from openagents import OpenAgentsNode
+from openagents import JobRunner
+from openagents import JobLogBuffer
+from openagents import MetricsRegistry
+from openagents import Tracer
+from openagents import JobProfiler
+from openagents import JobRecorder
+from openagents import LoopMonitor
+from openagents import Logger
+from openagents import LocalCache
+import time
+import asyncio
+from openagents_grpc_proto import Job_pb2
+
+
+class FakeResponse:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+class FakePoolClient:
+    """
+    A pool client that serves jobs from a list and records what the node sends.
+    """
+    def __init__(self, jobs=0):
+        self.pending=[Job_pb2.Job(id="job"+str(i), kind=5003) for i in range(jobs)]
+        self.accepted=[]
+        self.completed=[]
+        self.cancelled=[]
+        self.logs=[]
+        self.failures=0
+    async def getPendingJobs(self, req):
+        excluded=set(req.excludeId)
+        jobs=[job for job in self.pending if job.id not in excluded and job.id not in self.accepted]
+        if len(jobs) == 0:
+            await asyncio.sleep(0.05)
+        return FakeResponse(jobs=jobs)
+    async def acceptJob(self, req):
+        self.accepted.append(req.jobId)
+        return FakeResponse()
+    async def completeJob(self, req):
+        if self.failures > 0:
+            self.failures-=1
+            raise Exception("unavailable")
+        self.completed.append((req.jobId, req.output))
+        return FakeResponse()
+    async def cancelJob(self, req):
+        if self.failures > 0:
+            self.failures-=1
+            raise Exception("unavailable")
+        self.cancelled.append((req.jobId, req.reason))
+        return FakeResponse()
+    async def logForJob(self, req):
+        self.logs.append((req.jobId, req.log))
+        return FakeResponse()
+
+def makeTestNode(client, **options):
+    os.environ["LOG_LEVEL"]="error"
+    node=OpenAgentsNode(NodeConfig(meta={"name": "Test"}, options=options))
+    node._getClient=lambda *args, **kwargs: client
+    return node
+
+async def waitForJobs(client, count, timeout=10):
+    deadline=time.time()+timeout
+    while len(client.completed)+len(client.cancelled) < count:
+        assert time.time() < deadline
+        await asyncio.sleep(0.02)
+
+async def stopTestNode(node):
+    for task in node.runnerTasks.values():
+        task.cancel()
+    node.runnerTasks.clear()
+    await node._shutdown()
 
 
 # def test_nodeconfig():
@@ -129,8 +204,820 @@ def test_from_json():
     print(config.getTemplate())
 
 
+def test_node_options():
+    os.environ["NODE_MAX_PARALLEL_JOBS"]="4"
+    assert NodeConfig().getOption("maxParallelJobs", "NODE_MAX_PARALLEL_JOBS", 0) == 4
+    assert NodeConfig(options={"maxParallelJobs": 2}).getOption("maxParallelJobs", "NODE_MAX_PARALLEL_JOBS", 0) == 2
+    del os.environ["NODE_MAX_PARALLEL_JOBS"]
+    assert NodeConfig().getOption("maxParallelJobs", "NODE_MAX_PARALLEL_JOBS", 0) == 0
+
+def test_batch_collector():
+    batches=[]
+    async def onBatch(batch):
+        batches.append(batch)
+    async def run():
+        collector=BatchCollector(3, 50, onBatch)
+        for i in range(7):
+            collector.add(i)
+        await asyncio.sleep(0.1)
+    asyncio.run(run())
+    assert batches == [[0,1,2],[3,4,5],[6]]
+
+def test_job_leases():
+    leases=JobLeases(ttl=50, maxExcluded=2)
+    leases.add("a")
+    leases.add("b")
+    leases.add("c", ttl=10000)
+    leases.add("a")
+    assert "b" in leases
+    assert leases.getExcludeIds() == ["a", "c"]
+    time.sleep(0.1)
+    assert "a" not in leases
+    assert leases.getExcludeIds() == ["c"]
+    leases.remove("c")
+    assert len(leases) == 0
+
+def test_backoff():
+    backoff=Backoff("test", base=100, cap=400)
+    delays=[backoff.next() for i in range(6)]
+    assert all(0 <= d <= 400 for d in delays)
+    assert backoff.getState()["attempts"] == 6
+    backoff.reset()
+    assert backoff.getState()["attempts"] == 0
+    assert backoff.next() <= 100
+    assert backoff.getState()["failures"] == 7
+
+def test_announcement_cache():
+    node=OpenAgentsNode(NodeConfig(meta={"name":"test"}))
+    runner=JobRunner(RunnerConfig(meta={"name":"runner"}))
+    node.registerRunner(runner)
+    reg=node.registeredRunners[0]
+    reg["nextAnnouncementTimestamp"]=time.time()*1000+60000
+    announcement=node._getAnnouncement(reg)
+    assert node._getAnnouncement(reg) is announcement
+    runner.getMeta()["name"]="changed"
+    runner.invalidateConfig()
+    assert reg["nextAnnouncementTimestamp"] == 0
+    assert "changed" in node._getAnnouncement(reg).meta
+
         
 
+def test_job_log_buffer():
+    class Client:
+        def __init__(self):
+            self.logs=[]
+        async def logForJob(self, req):
+            self.logs.append(req.log)
+    class Node:
+        def __init__(self):
+            self.client=Client()
+            self.droppedJobLogs=0
+            self.metrics=MetricsRegistry()
+        def _getClient(self):
+            return self.client
+    async def run():
+        node=Node()
+        buffer=JobLogBuffer(node, "job", maxWait=1000, maxBytes=20, maxBuffered=30)
+        for i in range(10):
+            buffer.add("line"+str(i))
+        await buffer.close()
+        return node
+    node=asyncio.run(run())
+    lines="\n".join(node.client.logs).split("\n")
+    assert lines[:-1] == ["line"+str(i) for i in range(len(lines)-1)]
+    assert lines[-1] == str(node.droppedJobLogs)+" log lines dropped"
+    assert node.droppedJobLogs > 0
+    assert all(len(log) <= 20 for log in node.client.logs[:-1])
+    async def runMultibyte():
+        node=Node()
+        buffer=JobLogBuffer(node, "job", maxWait=1000, maxBytes=20, maxBuffered=40)
+        for i in range(3):
+            # 8 characters, 16 bytes
+            buffer.add("é"*8)
+        assert buffer.getStats()["bufferedBytes"] == 32
+        await buffer.close()
+        return node
+    node=asyncio.run(runMultibyte())
+    assert node.client.logs[:2] == ["é"*8, "é"*8]
+    assert all(len(log.encode("utf-8")) <= 20 for log in node.client.logs[:-1])
+    assert node.droppedJobLogs == 1
+
+def test_metrics_registry():
+    registry=MetricsRegistry(prefix="test_")
+    registry.counter("jobs_total", "Jobs", ("runner",)).labels(runner="a").inc(2)
+    registry.gauge("in_flight", "In flight").set(3)
+    histogram=registry.histogram("duration_seconds", "Duration", buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert registry.counter("jobs_total", "Jobs", ("runner",)).labels(runner="a").value == 2
+    text=registry.expose()
+    assert 'test_jobs_total{runner="a"} 2' in text
+    assert "test_in_flight 3" in text
+    assert 'test_duration_seconds_bucket{le="0.1"} 1' in text
+    assert 'test_duration_seconds_bucket{le="1"} 2' in text
+    assert 'test_duration_seconds_bucket{le="+Inf"} 3' in text
+    assert "test_duration_seconds_count 3" in text
+
+def test_tracer():
+    tracer=Tracer()
+    assert tracer.startTrace("job1").spanId is None
+    spans=[]
+    tracer.addExporter(spans.append)
+    root=tracer.startTrace("job1")
+    with tracer.activate(root):
+        with tracer.span("run"):
+            tracer.recordSpan("cache.get", time.time())
+    root.end()
+    assert [s["name"] for s in spans] == ["cache.get", "run", "job"]
+    assert all(s["traceId"] == Tracer.getTraceId("job1") for s in spans)
+    assert spans[0]["parentId"] == spans[1]["spanId"]
+    assert spans[1]["parentId"] == root.spanId
+    assert tracer.getCurrentSpan() is None
+
+def test_job_profiler():
+    profiler=JobProfiler("job1")
+    async def run(x):
+        await asyncio.sleep(0.01)
+        return x*2
+    def postRun(x):
+        return sum(range(1000))
+    async def main():
+        assert await profiler.call(run, None, 2) == 4
+        assert await profiler.call(postRun, None, 0) == 499500
+    asyncio.run(main())
+    assert profiler.timings["run"]["steps"] == 2
+    assert profiler.timings["run"]["wall"] >= profiler.timings["run"]["busy"]
+    assert profiler.timings["postRun"]["calls"] == 1
+    assert "run" in [f["function"] for f in profiler.getSummary()["functions"]]
+
+def test_job_profiler_overlapping_jobs(tmp_path):
+    import threading
+    class OverlapRunner(JobRunner):
+        def __init__(self):
+            super().__init__(RunnerConfig(meta={"name": "Overlap"}))
+            self.setRunInParallel(True)
+            self.setProfileRate(1)
+            self.barrier=threading.Barrier(2, timeout=5)
+        def run(self, ctx):
+            # both jobs run at the same time on the thread pool
+            self.barrier.wait()
+            return "out-"+ctx.getJob().id
+    async def run():
+        client=FakePoolClient(2)
+        node=makeTestNode(client, profilePath=str(tmp_path))
+        node.registerRunner(OverlapRunner())
+        await node._executePendingJob()
+        await waitForJobs(client, 2)
+        await stopTestNode(node)
+        return client
+    client=asyncio.run(run())
+    assert sorted(client.completed) == [("job0", "out-job0"), ("job1", "out-job1")]
+    # only one of the jobs is profiled
+    assert len(list(tmp_path.glob("*.prof"))) == 1
+    assert JobProfiler._active is None
+    # with another profiling tool active, the hooks run without profiling
+    class ActiveProfile:
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+    def postRun(x):
+        return x+1
+    profiler=JobProfiler.acquire("job3")
+    assert JobProfiler.acquire("job4") is None
+    profiler.profile=ActiveProfile()
+    assert asyncio.run(profiler.call(postRun, None, 1)) == 2
+    profiler.release()
+    assert JobProfiler._active is None
+
+def test_job_recorder(tmp_path):
+    from openagents_grpc_proto import Job_pb2
+    assert not JobRecorder().isEnabled()
+    path=str(tmp_path/"jobs.jsonl.gz")
+    recorder=JobRecorder(path)
+    recorder.recordJobs([Job_pb2.Job(id="job1", kind=5003), Job_pb2.Job(id="job1", kind=5003)])
+    with recorder.activate("job1"):
+        recorder.recordTransfer("disk.read", 100, time.time())
+    recorder.recordRun("job1", 0, 1, Exception("failed"))
+    recorder.close()
+    records=list(JobRecorder.read(path))
+    assert [r["type"] for r in records] == ["start", "job", "disk.read", "run"]
+    assert records[1]["job"].kind == 5003
+    assert records[2]["id"] == "job1"
+    assert records[3]["status"] == "error"
+    assert recorder.forWorker(2).path == str(tmp_path/"jobs.2.jsonl.gz")
+    bounded=JobRecorder(str(tmp_path/"bounded.jsonl"), maxSeen=2)
+    bounded.recordJobs([Job_pb2.Job(id="job"+str(i)) for i in range(3)])
+    assert list(bounded._seen) == ["job1", "job2"]
+    bounded.recordJobs([Job_pb2.Job(id="job2"), Job_pb2.Job(id="job0")])
+    bounded.close()
+    assert [r["id"] for r in JobRecorder.read(bounded.path) if r["type"] == "job"] == ["job0", "job1", "job2", "job0"]
+    assert bounded.forWorker(1).maxSeen == 2
+
+def test_loop_monitor():
+    class Node:
+        def __init__(self):
+            self.metrics=MetricsRegistry()
+            self.logger=Logger("test", "0.0.1", level="error")
+        def getLogger(self):
+            return self.logger
+    class Blocking(JobRunner):
+        async def loop(self, node):
+            time.sleep(0.4)
+    async def run():
+        monitor=LoopMonitor(Node(), threshold=150, interval=50)
+        monitor.start()
+        await asyncio.sleep(0.1)
+        await Blocking(RunnerConfig()).loop(None)
+        await asyncio.sleep(0.1)
+        monitor.stop()
+        return monitor.getStats()
+    stats=asyncio.run(run())
+    assert stats["stalls"] == 1
+    assert stats["lastStall"]["runner"] == "Blocking"
+    assert stats["lastStall"]["blocked"] >= 300
+    assert "time.sleep" in stats["lastStall"]["stack"]
+
+
+def test_shared_log_sink(monkeypatch):
+    import threading
+    monkeypatch.setenv("OPENOBSERVE_ENDPOINT", "http://127.0.0.1:9")
+    monkeypatch.setenv("OPENOBSERVE_FLUSHINTERVAL", "60000")
+    nodeLogger=Logger("test", "0.0.1", level="error")
+    sink=nodeLogger.oobsLogger
+    sent=[]
+    sink._flushToOpenObserve=lambda batch: sent.extend(batch)
+    threads=threading.active_count()
+    for i in range(50):
+        jobLogger=Logger("test.runner", "0.0.1", "job"+str(i), level="error")
+        assert jobLogger.oobsLogger is sink
+        jobLogger.error("failed")
+        jobLogger.close()
+    assert threading.active_count() == threads
+    assert sink.refs == 1
+    nodeLogger.close()
+    sink.flushThread.join(5)
+    assert not sink.flushThread.is_alive()
+    assert [entry["jobId"] for entry in sent] == ["job"+str(i) for i in range(50)]
+
+
+def test_socket_schema():
+    from openagents_grpc_proto import Job_pb2
+    from openagents import ProcessJobContext
+    runner=JobRunner(RunnerConfig(sockets={
+        "in": {
+            "k": {"type": "integer", "default": 0, "minimum": 0},
+            "queries": {"type": "array", "items": {"type": "string"}, "minItems": 1},
+            "outputType": {"type": "string", "default": "application/json"},
+        }
+    }))
+    job=Job_pb2.Job(id="job1")
+    param=job.param.add()
+    param.key="k"
+    param.value.append("5")
+    for query in ("a", "b"):
+        job.input.add(data=query, marker="queries")
+    ctx=ProcessJobContext(job, runner, {"name": "test", "version": "0.0.1"}, None)
+    assert ctx.getInputs() == {"k": 5, "queries": ["a", "b"], "outputType": "application/json"}
+    assert ctx.getJobParamValue("k") == "5"
+    assert ctx.getJobInput("queries").data == "a"
+    param.value[0]="-1"
+    ctx=ProcessJobContext(job, runner, {"name": "test", "version": "0.0.1"}, None)
+    try:
+        ctx.getInputs()
+        assert False
+    except ValueError as e:
+        assert "k must be >= 0" in str(e)
+
+
+def test_local_cache(tmp_path):
+    path=str(tmp_path/"local")
+    cache=LocalCache(path, maxBytes=2500)
+    assert cache.set("a", b"1"*1000)
+    assert cache.set("b", b"2"*1000, version=2)
+    assert cache.get("a") == b"1"*1000
+    assert cache.set("c", b"3"*1000)
+    # b is the least recently used
+    assert cache.get("b") is None
+    assert cache.get("c", lastVersion=1) is None
+    assert not cache.set("d", b"4"*3000)
+    assert cache.set("e", b"5", expireAt=int(time.time()*1000)-1)
+    assert cache.removeExpired() == 1
+    stats=cache.getStats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1 and stats["expired"] == 1
+    assert stats["hits"] == 1 and stats["misses"] == 2
+    cache.close()
+    assert LocalCache(path).get("c") == b"3"*1000
+    os.remove(os.path.join(path, LocalCache.INDEX_FILE))
+    assert LocalCache(path).getStats()["entries"] == 2
+
+
+def test_local_cache_import_legacy(tmp_path):
+    import pickle
+    import json
+    def writeLegacy(key, value, expireAt=0):
+        with open(str(tmp_path/key), "wb") as f:
+            f.write(pickle.dumps(value))
+        with open(str(tmp_path/(key+".meta.json")), "w") as f:
+            f.write(json.dumps({"version": 3, "expireAt": expireAt}))
+    writeLegacy("kept", "value")
+    writeLegacy("old", "value", int(time.time()*1000)-1)
+    writeLegacy("large", "x"*5000)
+    (tmp_path/"profiles").mkdir()
+    (tmp_path/"other.txt").write_text("untouched")
+    # files of a runner, a directory and an unreadable entry are left in place
+    (tmp_path/"runner.bin").write_text("data")
+    (tmp_path/"runner.bin.meta.json").write_text('{"owner": "runner"}')
+    (tmp_path/"dir").mkdir()
+    (tmp_path/"dir.meta.json").write_text('{"version": 0, "expireAt": 0}')
+    (tmp_path/"broken").write_text("data")
+    (tmp_path/"broken.meta.json").write_text("{")
+    cache=LocalCache(str(tmp_path/"local"), maxBytes=1000)
+    assert cache.importLegacy(str(tmp_path)) == 1
+    assert pickle.loads(cache.get("kept", lastVersion=3)) == "value"
+    assert cache.get("old") is None
+    assert cache.get("large") is None
+    left=["broken", "broken.meta.json", "dir", "dir.meta.json", "large", "large.meta.json", "local", "other.txt", "profiles", "runner.bin", "runner.bin.meta.json"]
+    assert sorted(os.listdir(str(tmp_path))) == left
+    assert cache.importLegacy(str(tmp_path)) == 0
+    assert sorted(os.listdir(str(tmp_path))) == left
+
+
+def test_batch_sync_run():
+    import threading
+    class SyncRunner(JobRunner):
+        def __init__(self):
+            super().__init__(RunnerConfig(meta={"name": "Sync"}))
+            self.threads=set()
+            self.setBatchSize(3, 50)
+        def run(self, ctx):
+            self.threads.add(threading.get_ident())
+            if ctx.getJob().id == "job2":
+                raise Exception("bad")
+            return "out-"+ctx.getJob().id
+    async def run():
+        client=FakePoolClient(6)
+        node=makeTestNode(client)
+        runner=SyncRunner()
+        node.registerRunner(runner)
+        await node._executePendingJob()
+        await waitForJobs(client, 6)
+        await stopTestNode(node)
+        return client, runner
+    client, runner=asyncio.run(run())
+    assert sorted(client.completed) == sorted(("job"+str(i), "out-job"+str(i)) for i in range(6) if i != 2)
+    assert client.cancelled == [("job2", "bad")]
+    assert threading.get_ident() not in runner.threads
+
+
+def test_completion_outbox(tmp_path):
+    spillPath=str(tmp_path/"spill")
+    async def run():
+        client=FakePoolClient()
+        node=makeTestNode(client, backoffBase=10, backoffMax=20, outboxRetries=2, outboxSpillPath=spillPath)
+        outbox=node._outbox
+        # retried until delivered, a job is completed once
+        client.failures=2
+        outbox.complete("job1", "out1")
+        outbox.complete("job1", "again")
+        await outbox.flush(5)
+        assert client.completed == [("job1", "out1")]
+        assert outbox.getStats()["retries"] == 2
+        outbox.cancel("job1", "late")
+        assert client.cancelled == []
+        # spilled when the retries are exhausted, then resent
+        client.failures=3
+        outbox.cancel("job2", "failed")
+        await outbox.flush(5)
+        assert os.listdir(spillPath) == ["job2.json"]
+        outbox.complete("job2", "duplicate")
+        assert outbox.getStats()["pending"] == 0
+        await outbox.resendSpilled()
+        assert client.cancelled == [("job2", "failed")]
+        assert os.listdir(spillPath) == []
+        # the deliveries still retrying on shutdown are spilled
+        client.failures=100
+        node.shutdownTimeout=50
+        outbox.complete("job3", "out3")
+        await node._shutdown()
+        assert os.listdir(spillPath) == ["job3.json"]
+        return outbox.getStats()
+    stats=asyncio.run(run())
+    assert stats["delivered"] == 2 and stats["resent"] == 1 and stats["spilled"] == 1
+
+
+def test_pre_run_failure_cancelled_through_outbox():
+    class FailingRunner(JobRunner):
+        def __init__(self):
+            super().__init__(RunnerConfig(meta={"name": "Failing"}))
+        async def preRun(self, ctx):
+            if ctx.getJob().id == "job0":
+                raise Exception("bad")
+        async def run(self, ctx):
+            return "out-"+ctx.getJob().id
+    async def run():
+        client=FakePoolClient(2)
+        # the pool is unreachable for the first call
+        client.failures=1
+        node=makeTestNode(client, backoffBase=10, backoffMax=20)
+        node.registerRunner(FailingRunner())
+        await node._executePendingJob()
+        await waitForJobs(client, 2)
+        await stopTestNode(node)
+        return client
+    client=asyncio.run(run())
+    assert client.cancelled == [("job0", "bad")]
+    assert client.completed == [("job1", "out-job1")]
+
+
+def test_sync_hooks_run_sync():
+    import threading
+    from openagents.JobContext import JobContext
+    async def getThread():
+        return threading.get_ident()
+    class SyncHooksRunner(JobRunner):
+        def __init__(self):
+            super().__init__(RunnerConfig(meta={"name": "SyncHooks"}))
+            self.calls=[]
+        def preRun(self, ctx):
+            # the async methods of the context are called on the event loop
+            self.calls.append(("preRun", threading.get_ident(), ctx.runSync(getThread(), 5)))
+        async def run(self, ctx):
+            try:
+                ctx.runSync(getThread())
+            except RuntimeError as e:
+                return str(e)
+        def postRun(self, ctx):
+            self.calls.append(("postRun", threading.get_ident(), None))
+    async def run():
+        client=FakePoolClient(1)
+        node=makeTestNode(client)
+        runner=SyncHooksRunner()
+        node.registerRunner(runner)
+        await node._executePendingJob()
+        await waitForJobs(client, 1)
+        await stopTestNode(node)
+        return client, runner
+    client, runner=asyncio.run(run())
+    loopThread=threading.get_ident()
+    assert [call[0] for call in runner.calls] == ["preRun", "postRun"]
+    # the sync hooks run on the thread pool
+    assert all(call[1] != loopThread for call in runner.calls)
+    assert runner.calls[0][2] == loopThread
+    assert client.completed == [("job0", "runSync can't be called from the event loop, use await instead")]
+    # a context created outside of an event loop can't run coroutines
+    node=makeTestNode(FakePoolClient())
+    ctx=JobContext(node, runner, Job_pb2.Job(id="job1"))
+    coro=getThread()
+    try:
+        ctx.runSync(coro)
+        assert False
+    except RuntimeError as e:
+        assert "event loop" in str(e)
+    assert coro.cr_frame is None
+
+
+def test_supervisor_init_with_pool():
+    import gc
+    from openagents import NodeSupervisor
+    class InitRunner(JobRunner):
+        async def init(self, node):
+            # the client can be created since the pool address is known
+            node._getClient()
+            self.address=node.poolAddress+":"+str(node.poolPort)
+    node=makeTestNode(None)
+    del node._getClient
+    runner=InitRunner(RunnerConfig())
+    node.registerRunner(runner)
+    supervisor=NodeSupervisor(node, 2)
+    supervisor._spawn=lambda *args: None
+    supervisor._waitReady=lambda: None
+    supervisor.stopping=True
+    try:
+        supervisor.run("127.0.0.1", 6021)
+    finally:
+        gc.unfreeze()
+    assert runner.address == "127.0.0.1:6021"
+
+
+def test_job_dispatcher():
+    from openagents import JobDispatcher
+    node=makeTestNode(None)
+    search=JobRunner(RunnerConfig(meta={"name": "Search", "prices": [{"amount": 100, "currency": "bitcoin", "protocol": "lightning"}]}, filter={"filterByKind": "5003", "filterByRunOn": "search"}))
+    other=JobRunner(RunnerConfig(meta={"name": "Other"}, filter={"filterByKind": "5004"}))
+    node.registerRunner(search)
+    node.registerRunner(other)
+    dispatcher=JobDispatcher(node)
+    # the runOn filter of Search can't be used since Other accepts any runOn
+    assert dispatcher.getFilter() == {"filterByKind": "(?:5003)|(?:5004)"}
+    assert dispatcher.getPrices() is None
+    job=Job_pb2.Job(id="job1", kind=5003, runOn="search")
+    assert dispatcher.match(job) == []
+    job.bid.amount=150
+    job.bid.currency="bitcoin"
+    job.bid.protocol="lightning"
+    assert dispatcher.match(job) == [search]
+    assert dispatcher.match(Job_pb2.Job(id="job2", kind=5004)) == [other]
+    # busy jobs are excluded until a slot is released, unmatched jobs until their lease expires
+    dispatcher.skip(job, True)
+    dispatcher.skip(Job_pb2.Job(id="job3"), False)
+    assert set(node.lockedJobs.getExcludeIds()) == {"job1", "job3"}
+    async def run():
+        dispatcher._pollTask=asyncio.create_task(asyncio.sleep(10))
+        dispatcher.onSlotReleased()
+        await asyncio.sleep(0)
+        return dispatcher._pollTask.cancelled()
+    assert asyncio.run(run())
+    assert node.lockedJobs.getExcludeIds() == ["job3"]
+
+
+class FakeChannel:
+    """
+    A grpc channel whose connectivity state is set by the test.
+    """
+    def __init__(self, state):
+        self.state=state
+        self.closed=False
+        self._changed=asyncio.Event()
+    def setState(self, state):
+        self.state=state
+        self._changed.set()
+    def get_state(self, try_to_connect=False):
+        return self.state
+    async def wait_for_state_change(self, state):
+        while self.state == state:
+            self._changed.clear()
+            await self._changed.wait()
+    async def close(self):
+        self.closed=True
+    def unary_unary(self, *args, **kwargs):
+        return None
+    unary_stream=stream_unary=stream_stream=unary_unary
+
+def test_channel_pool():
+    import grpc
+    from openagents import ChannelPool
+    async def run():
+        node=makeTestNode(None, backoffBase=10, backoffMax=20)
+        channels=[]
+        def connect(options, interceptors):
+            channels.append(FakeChannel(grpc.ChannelConnectivity.READY))
+            return channels[-1]
+        node._connect=connect
+        pool=ChannelPool(node, bulkChannels=2, reconnectTimeout=50)
+        control=pool.getControlClient()
+        bulk0=pool._getStub(1)
+        bulk1=pool._getStub(2)
+        await asyncio.sleep(0.01)
+        # the least active healthy bulk channel is used
+        pool._stats[1].active=2
+        assert pool.getBulkClient() is bulk1
+        channels[2].setState(grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        await asyncio.sleep(0.01)
+        assert pool.getBulkClient() is bulk0
+        # the control traffic fails over to a ready bulk channel
+        channels[0].setState(grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        await asyncio.sleep(0.01)
+        assert pool.getControlClient() is bulk0
+        assert pool.getControlClient() is bulk0
+        assert pool.getStats()["control"]["failovers"] == 1
+        # a new failure of the control channel is a new failover
+        channels[0].setState(grpc.ChannelConnectivity.READY)
+        await asyncio.sleep(0.01)
+        assert pool.getControlClient() is control
+        channels[0].setState(grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        await asyncio.sleep(0.01)
+        assert pool.getControlClient() is bulk0
+        assert pool.getStats()["control"]["failovers"] == 2
+        # the channels stuck in TRANSIENT_FAILURE are rebuilt
+        await asyncio.sleep(0.2)
+        assert channels[0].closed and channels[2].closed
+        stats=pool.getStats()
+        assert stats["control"]["reconnects"] == 1 and stats["control"]["state"] == "READY"
+        assert stats["bulk1"]["reconnects"] == 1 and stats["bulk0"]["reconnects"] == 0
+        assert pool.getControlClient() is not control
+        await pool.close()
+        assert pool.getStats()["control"]["state"] is None
+    asyncio.run(run())
+
+
+def test_channel_stats_interceptors():
+    import grpc
+    from openagents import ChannelPool
+    from openagents_grpc_proto import rpc_pb2
+    from openagents_grpc_proto import rpc_pb2_grpc
+    class Servicer(rpc_pb2_grpc.PoolConnectorServicer):
+        async def acceptJob(self, request, context):
+            return Job_pb2.Job(id=request.jobId)
+        async def cancelJob(self, request, context):
+            await context.abort(grpc.StatusCode.NOT_FOUND, "no job")
+        async def cacheGet(self, request, context):
+            for i in range(3):
+                yield rpc_pb2.RpcCacheGetResponse(exists=True, data=b"x"*100)
+        async def diskReadFile(self, request, context):
+            yield rpc_pb2.RpcDiskReadFileResponse(data=b"x"*100)
+            await context.abort(grpc.StatusCode.INTERNAL, "broken")
+        async def cacheSet(self, request_iterator, context):
+            async for request in request_iterator:
+                pass
+            return rpc_pb2.RpcCacheSetResponse(success=True)
+    async def run():
+        server=grpc.aio.server()
+        if not hasattr(server, "add_registered_method_handlers"):
+            server.add_registered_method_handlers=lambda *args: None
+        rpc_pb2_grpc.add_PoolConnectorServicer_to_server(Servicer(), server)
+        port=server.add_insecure_port("127.0.0.1:0")
+        await server.start()
+        node=makeTestNode(None)
+        node.poolAddress="127.0.0.1"
+        node.poolPort=port
+        node.poolSsl=False
+        connect=node._connect
+        interceptors=[]
+        def connectAndKeepInterceptors(options, channelInterceptors):
+            interceptors.extend(channelInterceptors)
+            return connect(options, channelInterceptors)
+        node._connect=connectAndKeepInterceptors
+        pool=ChannelPool(node, bulkChannels=0)
+        client=pool.getControlClient()
+        stats=pool._stats[0]
+        # unary unary
+        request=rpc_pb2.RpcAcceptJob(jobId="job1")
+        assert (await client.acceptJob(request)).id == "job1"
+        assert stats.bytesSent == request.ByteSize() and stats.bytesReceived == Job_pb2.Job(id="job1").ByteSize()
+        try:
+            await client.cancelJob(rpc_pb2.RpcCancelJob(jobId="job1"))
+            assert False
+        except grpc.aio.AioRpcError as e:
+            assert e.code() == grpc.StatusCode.NOT_FOUND
+        # unary stream
+        received=stats.bytesReceived
+        chunks=[chunk async for chunk in client.cacheGet(rpc_pb2.RpcCacheGetRequest(key="k"))]
+        assert len(chunks) == 3
+        assert stats.bytesReceived - received == 3*chunks[0].ByteSize()
+        try:
+            async for chunk in client.diskReadFile(rpc_pb2.RpcDiskReadFileRequest(path="/file")):
+                pass
+            assert False
+        except grpc.aio.AioRpcError as e:
+            assert e.code() == grpc.StatusCode.INTERNAL
+        # stream unary
+        sent=stats.bytesSent
+        requests=[rpc_pb2.RpcCacheSetRequest(key="k", data=b"y"*100) for i in range(2)]
+        assert (await client.cacheSet(iter(requests))).success
+        # the task watching the end of the call is kept until it is done
+        watching=sum(len(interceptor._tasks) for interceptor in interceptors)
+        await asyncio.sleep(0.05)
+        assert watching == 1 and all(len(interceptor._tasks) == 0 for interceptor in interceptors)
+        assert stats.bytesSent - sent == 2*requests[0].ByteSize()
+        result=(stats.calls, stats.active, stats.errors)
+        durations={key: child.count for key, child in node.metrics.histogram("rpc_duration_seconds", "", ("method", "channel", "status"))._children.items()}
+        await pool.close()
+        await server.stop(None)
+        return result, durations
+    (calls, active, errors), durations=asyncio.run(run())
+    assert (calls, active, errors) == (5, 0, 2)
+    assert durations == {
+        ("acceptJob", "control", "ok"): 1,
+        ("cancelJob", "control", "error"): 1,
+        ("cacheGet", "control", "ok"): 1,
+        ("diskReadFile", "control", "error"): 1,
+        ("cacheSet", "control", "ok"): 1,
+    }
+
+
+class ProcessRunner(JobRunner):
+    def __init__(self):
+        super().__init__(RunnerConfig(meta={"name": "Process"}))
+    def run(self, ctx):
+        if ctx.getJobParamValue("crash") == "true":
+            os._exit(1)
+        time.sleep(0.2)
+        ctx.getLogger().info("running in "+str(os.getpid()))
+        return ctx.getJobParamValue("value")+"@"+str(os.getpid())
+
+def test_process_pool():
+    from openagents import ProcessPool
+    from openagents.JobContext import JobContext
+    def makeJob(jobId, **params):
+        job=Job_pb2.Job(id=jobId)
+        for key, value in params.items():
+            param=job.param.add()
+            param.key=key
+            param.value.append(value)
+        return job
+    async def run():
+        client=FakePoolClient()
+        node=makeTestNode(client)
+        node.loop=asyncio.get_running_loop()
+        runner=ProcessRunner()
+        pool=ProcessPool(node, runner, 2)
+        ctxs=[JobContext(node, runner, makeJob("job0", value="a")), JobContext(node, runner, makeJob("job1", crash="true"))]
+        outputs=await asyncio.gather(*[pool.run(ctx) for ctx in ctxs], return_exceptions=True)
+        # the pool works again after the crash
+        outputs.append(await pool.run(JobContext(node, runner, makeJob("job2", value="b"))))
+        await asyncio.sleep(0.1)
+        for ctx in ctxs:
+            await ctx.close()
+        pool.close()
+        return outputs, pool.crashes, client.logs
+    outputs, crashes, logs=asyncio.run(run())
+    # the job that shared the pool with the crashing one is retried in its own process
+    assert outputs[0].startswith("a@") and outputs[0] != "a@"+str(os.getpid())
+    assert isinstance(outputs[1], Exception) and "job1" in str(outputs[1])
+    assert outputs[2].startswith("b@")
+    assert crashes >= 2
+    assert ("job0", "running in "+outputs[0].split("@")[1]) in logs
+
+def test_process_pool_spawn():
+    from openagents import ProcessPool
+    from openagents.JobContext import JobContext
+    os.environ["NODE_PROCESS_START_METHOD"]="spawn"
+    async def run():
+        client=FakePoolClient()
+        node=makeTestNode(client)
+        node.loop=asyncio.get_running_loop()
+        runner=ProcessRunner()
+        # the runner is sent to the workers without its node
+        node.registerRunner(runner)
+        pool=ProcessPool(node, runner, 1)
+        job=Job_pb2.Job(id="job0")
+        param=job.param.add()
+        param.key="value"
+        param.value.append("a")
+        ctx=JobContext(node, runner, job)
+        try:
+            return await pool.run(ctx), runner._node
+        finally:
+            await ctx.close()
+            pool.close()
+    try:
+        output, runnerNode=asyncio.run(run())
+    finally:
+        del os.environ["NODE_PROCESS_START_METHOD"]
+    assert output.startswith("a@") and output != "a@"+str(os.getpid())
+    assert runnerNode is not None
+
+
+class CountingRunner(JobRunner):
+    def __init__(self):
+        super().__init__(RunnerConfig(meta={"name": "Counting"}, filter={"filterByKind": "5003"}))
+    async def run(self, ctx):
+        return ctx.getJob().id
+
+def runMockPool(jobs, portQueue, resultQueue):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+    from mock_pool import MockPool
+    async def run():
+        pool=MockPool(maxWait=0.2)
+        completeJob=pool.completeJob
+        calls=[]
+        async def countingCompleteJob(request, context):
+            calls.append(request.jobId)
+            return await completeJob(request, context)
+        pool.completeJob=countingCompleteJob
+        portQueue.put(await pool.start())
+        for i in range(jobs):
+            pool.addJob(Job_pb2.Job(id="job"+str(i), kind=5003))
+        try:
+            await pool.waitForJobs(jobs, 30)
+            # leave time to the other worker to run the jobs again
+            await asyncio.sleep(1)
+        finally:
+            resultQueue.put((len(pool.completed), pool.duplicateAccepts, len(calls)))
+            await pool.stop()
+    asyncio.run(run())
+
+def runWorkersNode(port):
+    os.environ["LOG_LEVEL"]="error"
+    os.environ["POOL_SSL"]="false"
+    node=OpenAgentsNode(NodeConfig(meta={"name": "Workers"}))
+    node.registerRunner(CountingRunner())
+    node.start("127.0.0.1", port, workers=2)
+
+def test_workers_run_each_job_once():
+    import multiprocessing
+    import signal
+    mp=multiprocessing.get_context("spawn")
+    portQueue=mp.Queue()
+    resultQueue=mp.Queue()
+    pool=mp.Process(target=runMockPool, args=(40, portQueue, resultQueue))
+    pool.start()
+    node=None
+    try:
+        port=portQueue.get(timeout=30)
+        node=mp.Process(target=runWorkersNode, args=(port,))
+        node.start()
+        completed, duplicateAccepts, completeCalls=resultQueue.get(timeout=60)
+    finally:
+        if node is not None and node.is_alive():
+            os.kill(node.pid, signal.SIGINT)
+            node.join(30)
+        pool.join(10)
+    assert completed == 40
+    assert duplicateAccepts == 0
+    assert completeCalls == 40
+
+        
 def __main__():
     # test_nodeconfig()
     # test_eventconfig()